@@ -0,0 +1,71 @@
+"""In-memory trace of samples held as NumPy arrays."""
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ArrayTrace:
+    """Samples stored as arrays with the draw along the first axis.
+
+    Indexing follows the PyMC3 MultiTrace conventions used by the helper
+    functions, so ``trace['F']``, ``trace['F', 100::10]`` and
+    ``trace.get_values('X', burn=100, thin=10)`` all work.
+    """
+    def __init__(self, values=None):
+        self._values = OrderedDict()
+        if values is not None:
+            for varname, value in values.items():
+                self._values[varname] = np.asarray(value)
+
+    @property
+    def varnames(self):
+        return list(self._values.keys())
+
+    def __len__(self):
+        if not self._values:
+            return 0
+        return len(next(iter(self._values.values())))
+
+    def __contains__(self, varname):
+        return varname in self._values
+
+    def __getitem__(self, idx):
+        if isinstance(idx, tuple):
+            varname, draws = idx
+            return self._values[varname][draws]
+        return self._values[idx]
+
+    def __setitem__(self, varname, value):
+        value = np.asarray(value)
+        if self._values and len(value) != len(self):
+            raise ValueError('Expected {} draws for {}, got {}'
+                             .format(len(self), varname, len(value)))
+        self._values[varname] = value
+
+    def get_values(self, varname, burn=0, thin=1):
+        return self._values[varname][burn::thin]
+
+    def point(self, idx):
+        """Dictionary of values at draw `idx`."""
+        return {varname: value[idx] for varname, value in self._values.items()}
+
+    def select(self, draws):
+        """New trace with only the given draws (slice or index array)."""
+        return ArrayTrace(OrderedDict((varname, value[draws])
+                                      for varname, value in self._values.items()))
+
+    @classmethod
+    def concatenate(cls, traces):
+        """Join traces with the same variables along the draw axis."""
+        varnames = traces[0].varnames
+        return cls(OrderedDict((varname, np.concatenate([tr[varname] for tr in traces]))
+                               for varname in varnames))
+
+    def save(self, filename):
+        np.savez(filename, **self._values)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(OrderedDict((varname, data[varname]) for varname in data.files))
@@ -0,0 +1,247 @@
+"""Benchmarks of the steel model, inference and post-processing.
+
+Times model construction and compilation, logp/gradient evaluations, ADVI
+iterations, NUTS effective samples per second and the Sankey
+post-processing helpers, and writes the results as JSON so runs can be
+compared across versions:
+
+    python benchmarks.py --output benchmarks/results.json
+    python benchmarks.py --quick --only build,logp --solver blocks
+    python benchmarks.py --only scaling --solver blocks --packed-params
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+from collections import OrderedDict
+
+import numpy as np
+import theano
+import pymc3 as pm
+from pymc3.backends.base import merge_traces
+
+from floweaver import weave
+
+from flow_frames import inputs_flows_as_dataframe
+from forward_model import ForwardModel
+from leontief_model import SplitParamModel
+from model_cache import CompiledModelFunctions
+from parallel_sampling import diagnostics
+from priors import param_defs
+from profiling import peak_rss_mb
+from sankey_aggregation import SankeyAggregation
+from steel_processes import define_processes
+from steel_sdd import sdd
+from synthetic_networks import generate_network
+import trace_sankey_helpers
+
+
+INPUT_DEFS = {
+    'BF': 5000,
+    'DR': 300,
+    'SP': 1000,
+    'IFC': 300,
+}
+
+BENCHMARKS = ['build', 'logp', 'advi', 'nuts', 'postprocess']
+
+# widths of the synthetic networks for the 'scaling' benchmark (not run by
+# default); with 10 layers these have about 500 to 5,000 processes
+SCALING_WIDTHS = [25, 50, 100, 250]
+
+
+def _best_time(fn, repeat=3):
+    """Shortest wall-clock time of `repeat` calls of `fn`, and its last result."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_build(processes, model_options, input_defs=INPUT_DEFS, defs=param_defs):
+    """Build the model and compile its logp/gradient once each.
+
+    The functions are compiled directly rather than through the disk cache
+    of `SplitParamModel.compiled_functions`, so the timings do not depend
+    on what is cached and nothing is written to the cache directory.
+    """
+    build_time, model = _best_time(
+        lambda: SplitParamModel(processes, input_defs, defs, **model_options), repeat=1)
+    compile_time, functions = _best_time(lambda: CompiledModelFunctions(model.model),
+                                         repeat=1)
+    return model, functions, {'build_seconds': build_time, 'compile_seconds': compile_time}
+
+
+def bench_logp(model, functions, evaluations):
+    point = model.model.test_point
+
+    def run():
+        for _ in range(evaluations):
+            functions.logp_dlogp(point)
+    seconds, _ = _best_time(run)
+    return {'evaluations': evaluations, 'logp_dlogp_per_second': evaluations / seconds}
+
+
+def bench_advi(model, iterations, random_seed):
+    with model.model:
+        seconds, advi = _best_time(lambda: pm.variational.advi(
+            n=iterations, random_seed=random_seed), repeat=1)
+    return advi, {'iterations': iterations, 'iterations_per_second': iterations / seconds}
+
+
+def bench_nuts(model, advi, draws, random_seed):
+    # two chains, since the effective sample size needs more than one
+    traces = []
+    start = time.perf_counter()
+    with model.model:
+        for chain in range(2):
+            step = pm.NUTS(scaling=model.model.dict_to_array(advi.stds)**2, is_cov=True)
+            traces.append(pm.sample(draws, step=step, start=advi.means, chain=chain,
+                                    random_seed=random_seed + chain, progressbar=False))
+    seconds = time.perf_counter() - start
+    trace = merge_traces(traces)
+    effective_n = diagnostics(trace, varnames=[v.name for v in model.model.vars])['effective_n']
+    min_ess = min(np.min(value) for value in effective_n.values())
+    return {'draws': 2 * draws, 'seconds': seconds,
+            'min_effective_n': float(min_ess),
+            'min_effective_samples_per_second': float(min_ess / seconds)}
+
+
+def bench_postprocess(processes, samples, random_seed):
+    forward = ForwardModel(processes, INPUT_DEFS, param_defs)
+    trace = forward.sample_prior(samples, random_state=random_seed)
+    possible_inputs = forward.possible_inputs
+
+    flows_seconds, flows = _best_time(lambda: trace_sankey_helpers.flows_from_trace(
+        processes, possible_inputs, trace, nburn=0, thin=1))
+    variance_seconds, _ = _best_time(
+        lambda: trace_sankey_helpers.weave_variance(flows, sdd), repeat=1)
+    aggregation_seconds, aggregation = _best_time(
+        lambda: SankeyAggregation(sdd, processes, possible_inputs), repeat=1)
+    aggregated_seconds, _ = _best_time(lambda: trace_sankey_helpers.weave_variance(
+        aggregation.trace_link_values(trace), aggregation))
+
+    # one frame of `animate_samples`: build the flow table and weave
+    def frame():
+        I = trace['inputs'][0]
+        F = trace['F'][0]
+        return weave(sdd, inputs_flows_as_dataframe(processes, possible_inputs, I, F))
+    frame_seconds, _ = _best_time(frame)
+    frames_seconds, _ = _best_time(lambda: trace_sankey_helpers.sankey_frames(
+        processes, possible_inputs, trace, sdd, np.arange(samples)), repeat=1)
+
+    return {
+        'samples': samples,
+        'flows_from_trace_seconds': flows_seconds,
+        'weave_variance_seconds': variance_seconds,
+        'aggregation_compile_seconds': aggregation_seconds,
+        'aggregated_weave_variance_seconds': aggregated_seconds,
+        'animate_frame_seconds': frame_seconds,
+        'precomputed_frame_seconds': frames_seconds / samples,
+    }
+
+
+def bench_scaling(widths, layers, evaluations, random_seed, model_options):
+    """Build, compile and gradient time of synthetic networks of growing size."""
+    rows = []
+    for width in widths:
+        network = generate_network(layers=layers, width=width, loops=max(1, width // 5),
+                                   random_state=random_seed)
+        options = dict(model_options, flow_observations=network.flow_observations,
+                       input_observations=network.input_observations)
+        model, functions, row = bench_build(network.processes, options, network.input_defs,
+                                            network.param_defs)
+        row.update(bench_logp(model, functions, evaluations))
+        row['num_processes'] = len(network.processes)
+        row['num_free_parameters'] = int(sum(np.size(v) for v in model.model.test_point.values()))
+        row['peak_rss_mb'] = peak_rss_mb()
+        rows.append(row)
+    return rows
+
+
+def _versions():
+    versions = OrderedDict([
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('theano', theano.__version__),
+        ('pymc3', pm.__version__),
+    ])
+    try:
+        versions['git'] = subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        versions['git'] = None
+    return versions
+
+
+def run(only=BENCHMARKS, quick=False, random_seed=974067, **model_options):
+    """Run the benchmarks named in `only`; returns a JSON-ready dictionary."""
+    sizes = ({'evaluations': 20, 'advi': 500, 'draws': 50, 'samples': 200} if quick else
+             {'evaluations': 200, 'advi': 5000, 'draws': 500, 'samples': 2000})
+    processes = define_processes()
+    results = OrderedDict()
+
+    # the model is needed for the later benchmarks even when 'build' is
+    # not asked for, but is then not recorded
+    if {'build', 'logp', 'advi', 'nuts'} & set(only):
+        model, functions, build = bench_build(processes, model_options)
+        if 'build' in only:
+            results['build'] = build
+    if 'logp' in only:
+        results['logp'] = bench_logp(model, functions, sizes['evaluations'])
+    if 'advi' in only or 'nuts' in only:
+        advi, results['advi'] = bench_advi(model, sizes['advi'], random_seed)
+        if 'nuts' in only:
+            results['nuts'] = bench_nuts(model, advi, sizes['draws'], random_seed)
+    if 'postprocess' in only:
+        results['postprocess'] = bench_postprocess(processes, sizes['samples'], random_seed)
+    if 'scaling' in only:
+        widths = SCALING_WIDTHS[:2] if quick else SCALING_WIDTHS
+        results['scaling'] = bench_scaling(widths, 10, sizes['evaluations'], random_seed,
+                                           model_options)
+
+    return OrderedDict([
+        ('timestamp', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('versions', _versions()),
+        ('theano_config', {'mode': str(theano.config.mode),
+                           'optimizer': str(theano.config.optimizer),
+                           'floatX': theano.config.floatX}),
+        ('model_options', model_options),
+        ('quick', quick),
+        ('results', results),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output',
+                        help='JSON file to write the results to (by default they are '
+                        'printed)')
+    parser.add_argument('--only', default=','.join(BENCHMARKS),
+                        help='comma-separated benchmarks to run, from: ' +
+                        ', '.join(BENCHMARKS + ['scaling']))
+    parser.add_argument('--quick', action='store_true', help='use small problem sizes')
+    parser.add_argument('--solver', default='inverse', choices=['inverse', 'blocks', 'adjoint'])
+    parser.add_argument('--packed-params', action='store_true')
+    parser.add_argument('--edge-flows', action='store_true')
+    parser.add_argument('--seed', type=int, default=974067)
+    args = parser.parse_args()
+
+    results = run(only=args.only.split(','), quick=args.quick, random_seed=args.seed,
+                  solver=args.solver, packed_params=args.packed_params,
+                  edge_flows=args.edge_flows)
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(json.dumps(results['results'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
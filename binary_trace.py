@@ -0,0 +1,279 @@
+"""Binary trace backend with memory-mapped reading.
+
+Each chain is stored in its own directory (``<name>/chain-<n>``), holding a
+small ``meta.json`` header with the variable names, shapes, dtypes and
+number of draws, and one raw C-ordered ``<varname>.bin`` file per variable.
+Draws are buffered and appended in chunks while sampling. When reading,
+the files are memory-mapped, so selecting one variable, a range of draws or
+every n-th draw only touches the bytes which are needed.
+
+    with model.model:
+        trace = pm.sample(500, step=step, trace=BinaryTrace('traces/trace2'))
+    ...
+    trace = load('traces/trace2')
+    flows = trace['F', 100::10]
+
+Existing text traces can be converted with `convert_text_trace`.
+"""
+
+import json
+import os
+from glob import glob
+
+import numpy as np
+import pandas as pd
+from pymc3.backends import base
+
+
+META_FILENAME = 'meta.json'
+
+
+def _chain_dir(name, chain):
+    return os.path.join(name, 'chain-{}'.format(chain))
+
+
+class _ChainWriter:
+    """Buffer draws and append them to the per-variable files in chunks."""
+    def __init__(self, directory, var_shapes, var_dtypes, chunk_size):
+        self.directory = directory
+        self.var_shapes = var_shapes
+        self.var_dtypes = var_dtypes
+        self.chunk_size = chunk_size
+        self.meta_filename = os.path.join(directory, META_FILENAME)
+
+        if os.path.exists(self.meta_filename):
+            with open(self.meta_filename) as f:
+                meta = json.load(f)
+            prev_shapes = {k: tuple(v) for k, v in meta['shapes'].items()}
+            if prev_shapes != {k: tuple(v) for k, v in var_shapes.items()}:
+                raise base.BackendError(
+                    "Previous trace '{}' has different variables than current model."
+                    .format(directory))
+            self.draws = meta['draws']
+        else:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self.draws = 0
+            self._write_meta()
+
+        self._buffer = {varname: np.empty((chunk_size,) + tuple(shape), dtype=var_dtypes[varname])
+                        for varname, shape in var_shapes.items()}
+        self._buffered = 0
+
+    def record(self, values):
+        for varname, value in values.items():
+            self._buffer[varname][self._buffered] = value
+        self._buffered += 1
+        if self._buffered == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffered:
+            return
+        for varname, buf in self._buffer.items():
+            with open(_var_filename(self.directory, varname), 'ab') as f:
+                f.write(buf[:self._buffered].tobytes())
+        self.draws += self._buffered
+        self._buffered = 0
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = {
+            'varnames': list(self.var_shapes.keys()),
+            'shapes': {k: list(v) for k, v in self.var_shapes.items()},
+            'dtypes': {k: np.dtype(v).str for k, v in self.var_dtypes.items()},
+            'draws': self.draws,
+        }
+        tmp_filename = self.meta_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_filename, self.meta_filename)
+
+
+def _var_filename(directory, varname):
+    return os.path.join(directory, '{}.bin'.format(varname))
+
+
+class BinaryTrace(base.BaseTrace):
+    """Binary trace object
+
+    Parameters
+    ----------
+    name : str
+        Name of directory to store the chain directories in
+    model : Model
+        If None, the model is taken from the `with` context.
+    vars : list of variables
+        Sampling values will be stored for these variables. If None,
+        `model.unobserved_RVs` is used.
+    chunk_size : int
+        Number of draws buffered in memory before writing to disk.
+    """
+
+    def __init__(self, name, model=None, vars=None, chunk_size=100):
+        if not os.path.exists(name):
+            os.makedirs(name)
+        super(BinaryTrace, self).__init__(name, model, vars)
+        self.chunk_size = chunk_size
+        self.directory = None
+        self._writer = None
+        self._arrays = None
+
+    # Sampling methods
+
+    def setup(self, draws, chain):
+        self.chain = chain
+        self.directory = _chain_dir(self.name, chain)
+        self._writer = _ChainWriter(self.directory,
+                                    {v: self.var_shapes[v] for v in self.varnames},
+                                    self.var_dtypes, self.chunk_size)
+        self._arrays = None
+
+    def record(self, point):
+        self._writer.record(dict(zip(self.varnames, self.fn(point))))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.flush()
+            self._writer = None  # Avoid serialization issue.
+        self._arrays = None
+
+    # Selection methods
+
+    def _open(self):
+        if self._arrays is None:
+            if self._writer is not None:
+                self._writer.flush()
+            self._arrays = _open_chain(self.directory)
+        return self._arrays
+
+    def __len__(self):
+        if self.directory is None:
+            return 0
+        arrays = self._open()
+        return len(arrays[self.varnames[0]]) if arrays else 0
+
+    def get_values(self, varname, burn=0, thin=1):
+        """Get values from trace (a memory-mapped view)."""
+        return self._open()[varname][burn::thin]
+
+    def _slice(self, idx):
+        # Return an in-memory copy; only the selected draws are read.
+        sliced = LoadedChain(self.chain, self.varnames,
+                              {varname: np.array(values[idx])
+                               for varname, values in self._open().items()})
+        return sliced
+
+    def point(self, idx):
+        idx = int(idx)
+        return {varname: np.array(values[idx])
+                for varname, values in self._open().items()}
+
+
+class LoadedChain(base.BaseTrace):
+    """Chain of in-memory or memory-mapped arrays, read back without the model."""
+    # pylint: disable=super-init-not-called
+    def __init__(self, chain, varnames, arrays):
+        self.name = None
+        self.model = None
+        self.chain = chain
+        self.varnames = varnames
+        self._arrays = arrays
+        self.var_shapes = {v: arrays[v].shape[1:] for v in varnames}
+        self.var_dtypes = {v: arrays[v].dtype for v in varnames}
+
+    def __len__(self):
+        return len(self._arrays[self.varnames[0]]) if self.varnames else 0
+
+    def get_values(self, varname, burn=0, thin=1):
+        return self._arrays[varname][burn::thin]
+
+    def _slice(self, idx):
+        return LoadedChain(self.chain, self.varnames,
+                            {v: np.array(values[idx]) for v, values in self._arrays.items()})
+
+    def point(self, idx):
+        idx = int(idx)
+        return {v: np.array(values[idx]) for v, values in self._arrays.items()}
+
+
+def _open_chain(directory):
+    """Memory-map the variable files of one chain."""
+    with open(os.path.join(directory, META_FILENAME)) as f:
+        meta = json.load(f)
+    arrays = {}
+    for varname in meta['varnames']:
+        shape = (meta['draws'],) + tuple(meta['shapes'][varname])
+        dtype = np.dtype(meta['dtypes'][varname])
+        if meta['draws'] == 0:
+            arrays[varname] = np.empty(shape, dtype=dtype)
+        else:
+            arrays[varname] = np.memmap(_var_filename(directory, varname),
+                                        dtype=dtype, mode='r', shape=shape)
+    return arrays
+
+
+def load(name):
+    """Load binary trace as a MultiTrace, memory-mapping the files.
+
+    The model is not needed to load the trace.
+    """
+    directories = glob(os.path.join(name, 'chain-*'))
+    if len(directories) == 0:
+        raise ValueError('No chains present in directory {}'.format(name))
+
+    straces = []
+    for directory in directories:
+        chain = int(directory.rsplit('-', 1)[1])
+        with open(os.path.join(directory, META_FILENAME)) as f:
+            varnames = json.load(f)['varnames']
+        straces.append(LoadedChain(chain, varnames, _open_chain(directory)))
+    return base.MultiTrace(straces)
+
+
+def convert_text_trace(text_name, binary_name, chunk_size=500):
+    """Convert a directory of PyMC3 text (CSV) traces into a binary trace.
+
+    The CSV files are read in chunks of `chunk_size` rows, so the whole
+    trace never needs to fit in memory. Variable shapes are recovered
+    from the column names (e.g. ``F__3_7``).
+    """
+    files = glob(os.path.join(text_name, 'chain-*.csv'))
+    if len(files) == 0:
+        raise ValueError('No files present in directory {}'.format(text_name))
+
+    for filename in files:
+        chain = int(os.path.splitext(filename)[0].rsplit('-', 1)[1])
+        with open(filename) as f:
+            columns = next(f).strip().split(',')
+
+        # group flat column names by variable, keeping the column order
+        var_columns = {}
+        varnames = []
+        for column in columns:
+            varname = column.rsplit('__', 1)[0] if '__' in column else column
+            if varname not in var_columns:
+                varnames.append(varname)
+                var_columns[varname] = []
+            var_columns[varname].append(column)
+        var_shapes = {}
+        for varname in varnames:
+            last = var_columns[varname][-1]
+            if '__' in last:
+                var_shapes[varname] = tuple(int(i) + 1 for i in last.rsplit('__', 1)[1].split('_'))
+            else:
+                var_shapes[varname] = ()
+
+        writer = _ChainWriter(_chain_dir(binary_name, chain), var_shapes,
+                              {v: np.float64 for v in varnames}, chunk_size)
+        if writer.draws:
+            raise base.BackendError("Binary trace '{}' already has draws for chain {}"
+                                    .format(binary_name, chain))
+        for df in pd.read_csv(filename, chunksize=chunk_size):
+            values = {varname: df[var_columns[varname]].values.reshape(
+                (len(df),) + var_shapes[varname]) for varname in varnames}
+            for i in range(len(df)):
+                writer.record({varname: values[varname][i] for varname in varnames})
+        writer.flush()
+
+    return load(binary_name)
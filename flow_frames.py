@@ -0,0 +1,72 @@
+"""Convert arrays of inputs and flows into long-format flow tables."""
+
+import numpy as np
+import pandas as pd
+
+from process_graph import edge_endpoints
+
+
+def _categories(processes):
+    return ['inputs'] + list(processes.keys())
+
+
+def flows_as_dataframe(processes, possible_inputs, inputs, flows, samples=None):
+    """Long-format table of non-zero inputs and flows for stacked samples.
+
+    `inputs` has shape (num_samples, num_inputs) and `flows` has shape
+    (num_samples, Np, Np). The result has columns source, target, material,
+    sample and value, with categorical source and target columns. `samples`
+    gives the sample number for each row of the arrays (default 0, 1, ...).
+    """
+    flows = np.asarray(flows)
+    f_sample, f_source, f_target = np.nonzero(flows > 0)
+    return _flows_frame(processes, possible_inputs, inputs, samples,
+                        f_sample, f_source, f_target, flows[f_sample, f_source, f_target])
+
+
+def edge_flows_as_dataframe(processes, possible_inputs, inputs, edge_flows, samples=None):
+    """Like `flows_as_dataframe`, but with flows given as edge vectors.
+
+    `edge_flows` has shape (num_samples, num_edges), in the edge order of
+    `process_graph.transfer_coefficient_index` (e.g. the 'F_edges' trace).
+    """
+    edge_flows = np.asarray(edge_flows)
+    edge_sources, edge_targets = edge_endpoints(processes)
+    f_sample, f_edge = np.nonzero(edge_flows > 0)
+    return _flows_frame(processes, possible_inputs, inputs, samples,
+                        f_sample, edge_sources[f_edge], edge_targets[f_edge],
+                        edge_flows[f_sample, f_edge])
+
+
+def _flows_frame(processes, possible_inputs, inputs, samples,
+                 f_sample, f_source, f_target, f_value):
+    inputs = np.asarray(inputs)
+    if samples is None:
+        samples = np.arange(len(inputs))
+    categories = _categories(processes)
+
+    # inputs: source is 'inputs' (category 0)
+    i_sample, i_input = np.nonzero(inputs > 0)
+    input_codes = np.array([categories.index(k) for k in possible_inputs], dtype=int)
+
+    sample = np.concatenate([samples[i_sample], samples[f_sample]])
+    source = np.concatenate([np.zeros(len(i_sample), dtype=int), f_source + 1])
+    target = np.concatenate([input_codes[i_input], f_target + 1])
+    value = np.concatenate([inputs[i_sample, i_input], f_value])
+
+    # keep the same row order as looping over samples, then inputs, then flows
+    order = np.argsort(sample, kind='mergesort')
+
+    return pd.DataFrame({
+        'source': pd.Categorical.from_codes(source[order], categories),
+        'target': pd.Categorical.from_codes(target[order], categories),
+        'material': '?',
+        'sample': sample[order],
+        'value': value[order],
+    }, columns=['source', 'target', 'material', 'sample', 'value'])
+
+
+def inputs_flows_as_dataframe(processes, possible_inputs, I, F):
+    """Turn inputs & flows vectors into dataframe of flows"""
+    df = flows_as_dataframe(processes, possible_inputs, np.asarray(I)[None], np.asarray(F)[None])
+    return df.drop('sample', axis=1)
@@ -0,0 +1,57 @@
+"""Vectorised summary statistics of many flows at once.
+
+These work on a (samples x flows) array, such as the link values from
+`sankey_aggregation.SankeyAggregation` or the 'F_edges' trace, and
+summarise every column in one pass instead of calling `pm.hpd` per flow.
+
+Every draw counts, including those in which a flow or link is zero. The
+long-format flow tables (`flow_frames`) leave out zero flows, so
+statistics grouped from them only cover the draws in which a link is
+non-zero, and give a larger mean for links which are sometimes zero.
+"""
+
+import numpy as np
+
+
+def hpd_intervals(values, alpha=0.05):
+    """Highest posterior density interval of each column of `values`.
+
+    Gives the same result as `pm.hpd` on each column: the narrowest
+    interval containing a fraction ``1 - alpha`` of the sorted samples.
+    Returns arrays of lower and upper bounds.
+    """
+    values = np.asarray(values, dtype=float)
+    x = np.sort(values.reshape(len(values), -1), axis=0)
+    n = len(x)
+    interval_idx_inc = int(np.floor((1.0 - alpha) * n))
+    n_intervals = n - interval_idx_inc
+    widths = x[interval_idx_inc:] - x[:n_intervals]
+    min_idx = np.argmin(widths, axis=0)
+    columns = np.arange(x.shape[1])
+    shape = values.shape[1:]
+    return (x[min_idx, columns].reshape(shape),
+            x[min_idx + interval_idx_inc, columns].reshape(shape))
+
+
+def summarise(values, alpha=0.05, quantiles=(0.025, 0.5, 0.975)):
+    """Means, standard deviations, HPD intervals and quantiles of each column.
+
+    Returns a dictionary of arrays: 'mean', 'sd', 'hpd_lower', 'hpd_upper',
+    'hpd_width' and 'quantiles' (one row per quantile).
+    """
+    values = np.asarray(values, dtype=float)
+    lower, upper = hpd_intervals(values, alpha)
+    return {
+        'mean': values.mean(axis=0),
+        'sd': values.std(axis=0),
+        'hpd_lower': lower,
+        'hpd_upper': upper,
+        'hpd_width': upper - lower,
+        'quantiles': np.percentile(values, 100 * np.asarray(quantiles), axis=0),
+    }
+
+
+def link_measures(summary):
+    """Split a `summarise` result into one dictionary of measures per column."""
+    names = ['mean', 'sd', 'hpd_lower', 'hpd_upper', 'hpd_width']
+    return [dict(zip(names, column)) for column in zip(*[summary[k] for k in names])]
@@ -0,0 +1,186 @@
+"""Pure NumPy forward evaluation of process models.
+
+This draws parameters from the same priors as `SplitParamModel` and solves
+the Leontief system for a whole batch of samples at once, which is much
+faster than running a sampler when there are no observations (e.g. to
+sample from the prior).
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from array_trace import ArrayTrace
+from process_graph import edges_to_dense, process_index, solve_levels, transfer_coefficient_index
+
+
+class ForwardModel:
+    """Batched NumPy version of the model without observations.
+
+    Transfer coefficients are handled as "edge" vectors, with one entry for
+    each process output in the order given by
+    `process_graph.transfer_coefficient_index`.
+
+    Results have the layout of the trace of a `SplitParamModel` built with
+    the same `edge_flows` option: dense (Np, Np) 'TCs_coeffs' and 'F' by
+    default, or edge vectors 'TCs_edges' and 'F_edges' with ``edge_flows=True``.
+    Dense flows need memory for Np x Np values per sample, so use edge flows
+    for large numbers of samples.
+    """
+    def __init__(self, processes, input_defs, param_defs, edge_flows=False):
+        self.processes = processes
+        self.record_edge_flows = edge_flows
+        self.possible_inputs = possible_inputs = sorted(list(input_defs.keys()))
+        self.input_max = np.array([input_defs[k] for k in possible_inputs], dtype=float)
+        self.param_defs = param_defs
+
+        pids = process_index(processes)
+        self.input_idx = np.array([pids[k] for k in possible_inputs], dtype=int)
+        self.edge_targets, self.edge_sources = transfer_coefficient_index(processes)
+
+        # For each level of the process graph, the edges flowing into it,
+        # so only the small blocks of the coefficient matrix that are needed
+        # get built
+        self.solve_steps = []
+        for acyclic, loops in solve_levels(processes):
+            for rows, is_loop in [(acyclic, False)] + [(loop, True) for loop in loops]:
+                if len(rows):
+                    self.solve_steps.append(self._solve_step(rows, is_loop))
+
+        # position of each process's first output in the edge vectors
+        offsets = np.cumsum([0] + [len(p.outputs) for p in processes.values()])
+        edge_offset = dict(zip(processes, offsets))
+
+        # Group processes of the same type and size so their parameters can
+        # be drawn and transformed together
+        groups = OrderedDict()
+        for pid, process in processes.items():
+            if not process.outputs:
+                continue
+            defs = param_defs.get(pid)
+            key = (type(process).__name__, process.nparams, defs is None or len(defs) == 0)
+            groups.setdefault(key, []).append(pid)
+        self.groups = []
+        for pids_in_group in groups.values():
+            process = processes[pids_in_group[0]]
+            if not hasattr(process, 'batch_sample_params'):
+                raise TypeError('{} is not supported by ForwardModel'
+                                .format(type(process).__name__))
+            edges = np.concatenate([
+                edge_offset[pid] + np.arange(len(processes[pid].outputs))
+                for pid in pids_in_group])
+            self.groups.append((pids_in_group, edges))
+
+    def _solve_step(self, rows, is_loop):
+        edges = np.nonzero((self.edge_targets[:, None] == rows[None, :]).any(axis=1))[0]
+        cols = np.unique(self.edge_sources[edges])
+        local_rows = np.searchsorted(rows, self.edge_targets[edges])
+        local_cols = np.searchsorted(cols, self.edge_sources[edges])
+        # position of the loop's own processes within `cols`
+        loop_cols = np.searchsorted(cols, rows) if is_loop else None
+        if is_loop:
+            assert np.all(cols[loop_cols] == rows)
+        return rows, cols, edges, local_rows, local_cols, loop_cols
+
+    @property
+    def num_edges(self):
+        return len(self.edge_sources)
+
+    def sample_inputs(self, size, random_state):
+        return random_state.uniform(0, self.input_max, size=(size, len(self.input_max)))
+
+    def sample_params(self, size, random_state):
+        """Draw parameters for every process: dict of pid -> (size, nparams)."""
+        params = OrderedDict()
+        for pids, _ in self.groups:
+            process = self.processes[pids[0]]
+            values = process.batch_sample_params(
+                [self.param_defs.get(pid) for pid in pids], size, random_state)
+            for i, pid in enumerate(pids):
+                params[pid] = values[:, i]
+        return params
+
+    def transfer_coefficients(self, params):
+        """Edge vectors of transfer coefficients, shape (size, num_edges)."""
+        size = len(next(iter(params.values())))
+        coeffs = np.zeros((size, self.num_edges))
+        for pids, edges in self.groups:
+            process = self.processes[pids[0]]
+            values = np.stack([params[pid] for pid in pids], axis=1)
+            coeffs[:, edges] = process.batch_transfer_values(values)
+        return coeffs
+
+    def throughputs(self, coeffs, inputs):
+        """Solve (I - A) X = inputs for each sample, shape (size, Np)."""
+        size = len(coeffs)
+        Np = len(self.processes)
+        b = np.zeros((size, Np))
+        b[:, self.input_idx] = inputs
+
+        # Forward substitution through the process graph, as with the
+        # 'blocks' solver in SplitParamModel: unsolved throughputs are zero
+        X = np.zeros((size, Np))
+        for rows, cols, edges, local_rows, local_cols, loop_cols in self.solve_steps:
+            A = np.zeros((size, len(rows), len(cols)))
+            A[:, local_rows, local_cols] = coeffs[:, edges]
+            rhs = b[:, rows] + np.einsum('sij,sj->si', A, X[:, cols])
+            if loop_cols is None:
+                X[:, rows] = rhs
+            else:
+                # small dense solve for the recycling loop
+                A_loop = A[:, :, loop_cols]
+                X[:, rows] = np.linalg.solve(np.eye(len(rows)) - A_loop,
+                                             rhs[:, :, None])[:, :, 0]
+        return X
+
+    def edge_flows(self, coeffs, X):
+        """Flow along each edge, shape (size, num_edges)."""
+        return coeffs * X[:, self.edge_sources]
+
+    def dense_matrix(self, edge_values):
+        """Rebuild (size, Np, Np) source x target matrices from edge vectors."""
+        return edges_to_dense(self.processes, edge_values)
+
+    def evaluate(self, params, inputs, dense=None):
+        """Inputs, throughputs and flows for given parameter samples.
+
+        With `dense`, 'TCs_coeffs' and 'F' have the same (Np, Np) layout as
+        the default `SplitParamModel` trace; otherwise edge vectors
+        'TCs_edges' and 'F_edges' are returned instead. By default this
+        follows the model's `edge_flows` option.
+        """
+        if dense is None:
+            dense = not self.record_edge_flows
+        coeffs = self.transfer_coefficients(params)
+        X = self.throughputs(coeffs, inputs)
+        flows = self.edge_flows(coeffs, X)
+        result = OrderedDict([('inputs', inputs), ('X', X)])
+        if dense:
+            # TCs_coeffs is indexed [target, source] but F is [source, target]
+            result['TCs_coeffs'] = self.dense_matrix(coeffs).transpose(0, 2, 1)
+            result['F'] = self.dense_matrix(flows)
+        else:
+            result['TCs_edges'] = coeffs
+            result['F_edges'] = flows
+        return result
+
+    def sample_prior(self, size, random_state=None, dense=None, chunk_size=5000):
+        """Draw `size` exact samples from the prior.
+
+        Returns an `ArrayTrace` with 'inputs', 'X', the flows and
+        'param_<pid>' for each process, like a sampled `SplitParamModel`
+        trace. Samples are solved in chunks to limit memory use; `dense` is
+        as for `evaluate`.
+        """
+        if random_state is None or isinstance(random_state, int):
+            random_state = np.random.RandomState(random_state)
+        chunks = []
+        for start in range(0, size, chunk_size):
+            n = min(chunk_size, size - start)
+            inputs = self.sample_inputs(n, random_state)
+            params = self.sample_params(n, random_state)
+            values = self.evaluate(params, inputs, dense=dense)
+            for pid, value in params.items():
+                values['param_{}'.format(pid)] = value
+            chunks.append(ArrayTrace(values))
+        return ArrayTrace.concatenate(chunks)
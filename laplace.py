@@ -0,0 +1,110 @@
+"""Gaussian (Laplace) approximation of the posterior about the MAP point.
+
+This is much faster than ADVI and NUTS, so it is useful for quick checks
+of new priors before a full run:
+
+    approx = model.laplace()
+    trace = approx.sample(2000, random_seed=1)
+    model.get_flow(trace, 'BF', 'PI')
+
+The MAP point is found in the unconstrained space of the model's free
+variables (as `scenarios.fit_map`). The Hessian of the log-probability
+there is found by central finite differences of the compiled gradient, or
+exactly with Theano (which can be slow to compile for large models). Draws
+from the Gaussian are mapped through the model's deterministics, so the
+trace has the same variables ('inputs', 'X', 'F', ...) as a sampled one.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import scipy.linalg
+import pymc3 as pm
+from pymc3.blocking import ArrayOrdering, DictToArrayBijection
+
+from array_trace import ArrayTrace
+from scenarios import fit_map
+
+
+def finite_difference_hessian(functions, bijection, x, eps=1e-5):
+    """Hessian of the log-probability at `x` from central differences of
+    the gradient, made symmetric."""
+    n = len(x)
+    H = np.empty((n, n))
+    for i in range(n):
+        step = np.zeros(n)
+        step[i] = eps * max(1.0, abs(x[i]))
+        _, upper = functions.logp_dlogp(bijection.rmap(x + step))
+        _, lower = functions.logp_dlogp(bijection.rmap(x - step))
+        H[:, i] = (upper - lower) / (2 * step[i])
+    return (H + H.T) / 2
+
+
+class LaplaceApproximation:
+    """Gaussian approximation with mean `mean` and precision `precision`
+    in the unconstrained space of the model's free variables.
+
+    Directions in which the log-probability is not concave at the MAP
+    point (e.g. if the optimiser did not converge) have their curvature
+    raised to `min_precision`; `num_clipped` counts them.
+    """
+    def __init__(self, model, map_result, precision, min_precision=1e-8):
+        self.model = model
+        self.map = map_result
+        self.bijection = DictToArrayBijection(ArrayOrdering(model.model.vars),
+                                              map_result['point'])
+        self.mean = self.bijection.map(map_result['point'])
+        eigenvalues, eigenvectors = np.linalg.eigh(precision)
+        self.num_clipped = int(np.sum(eigenvalues < min_precision))
+        if self.num_clipped:
+            eigenvalues = np.maximum(eigenvalues, min_precision)
+            precision = (eigenvectors * eigenvalues).dot(eigenvectors.T)
+        self.precision = precision
+        self._cholesky = np.linalg.cholesky(precision)
+
+    @property
+    def cov(self):
+        return np.linalg.inv(self.precision)
+
+    @property
+    def stds(self):
+        """Standard deviations of the free variables, as a point dictionary."""
+        return self.bijection.rmap(np.sqrt(np.diag(self.cov)))
+
+    def sample(self, draws=1000, random_seed=None):
+        """Draws of the free variables and deterministics as an `ArrayTrace`."""
+        rs = np.random.RandomState(random_seed)
+        z = rs.randn(len(self.mean), draws)
+        # with precision L L^T, x = mean + L^-T z has the right covariance
+        samples = self.mean[:, None] + scipy.linalg.solve_triangular(
+            self._cholesky, z, lower=True, trans='T')
+
+        functions = self.model.compiled_functions()
+        values = {}
+        for x in samples.T:
+            point = self.bijection.rmap(x)
+            point.update(functions.deterministics(point))
+            for varname, value in point.items():
+                values.setdefault(varname, []).append(value)
+        return ArrayTrace(OrderedDict((varname, np.array(values[varname])) for varname in
+                                      functions.varnames + functions.deterministic_names))
+
+
+def laplace_approximation(model, start=None, maxiter=1000, hessian='fd', eps=1e-5):
+    """Laplace approximation of a `SplitParamModel` posterior.
+
+    `hessian` is 'fd' for finite differences of the gradient, with relative
+    step `eps`, or 'exact' to compile the Hessian with Theano.
+    """
+    if hessian not in ('fd', 'exact'):
+        raise ValueError('Unknown hessian: {}'.format(hessian))
+    map_result = fit_map(model, start, maxiter)
+    point = map_result['point']
+    if hessian == 'exact':
+        # find_hessian gives the negative Hessian, i.e. the precision
+        precision = pm.find_hessian(point, model=model.model)
+    else:
+        bijection = DictToArrayBijection(ArrayOrdering(model.model.vars), point)
+        precision = -finite_difference_hessian(model.compiled_functions(), bijection,
+                                               bijection.map(point), eps)
+    return LaplaceApproximation(model, map_result, precision)
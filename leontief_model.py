@@ -4,43 +4,123 @@ Copied from 4. Bayesian - Leontief models/leontief_model.py
 2016-12-19
 """
 
+from collections import OrderedDict
+
 import numpy as np
-import pandas as pd
+import theano
 import theano.tensor as T
+from theano.ifelse import ifelse
+from theano.tensor.shared_randomstreams import RandomStreams
 from theano.tensor.nlinalg import matrix_inverse
+from theano.tensor.slinalg import solve
 import pymc3 as pm
 
 
 from floweaver import Dataset, weave
 
+from flow_frames import inputs_flows_as_dataframe
+from laplace import laplace_approximation
+from leontief_op import leontief_solve
+from model_cache import (DEFAULT_CACHE_DIR, CompiledModelFunctions, load_or_compile,
+                         model_cache_key)
+from parallel_sampling import sample_chains
+from profiling import profile_ops, profile_terms
+from process_graph import edge_list, edges_to_dense, solve_levels, transfer_coefficient_index
+
 
-def inputs_flows_as_dataframe(processes, possible_inputs, inputs, flows):
-    """Turn inputs & flows vectors into dataframe of flows"""
-    flows = []
-    num_processes = flows.shape[0]  # pylint: disable=no-member
-    for target, value in zip(possible_inputs, inputs):
-        if value > 0:
-            flows.append(('inputs', target, '?', value))
+def _segment_sum(segment_ids, values, num_segments):
+    """Sum `values` into `num_segments` bins given by `segment_ids`."""
+    return T.inc_subtensor(T.zeros(num_segments)[segment_ids], values)
 
-    # lookup process id to index
-    process_ids = list(processes.keys())
-    for i in range(num_processes):
-        for j in range(num_processes):
-            if flows[i, j] > 0:
-                flows.append((process_ids[i], process_ids[j], '?', flows[i, j]))
-    return pd.DataFrame.from_records(flows, columns=('source', 'target', 'material', 'value'))
 
+def _padded_rows(obs_index, num_obs, *index_arrays):
+    """Rearrange a sparse observation operator into one padded row per
+    observation, so that a batch of observations can be gathered by row.
+
+    Returns a 0/1 matrix of which entries are used and, for each of
+    `index_arrays`, a matrix of the same shape with the indices.
+    """
+    counts = np.bincount(obs_index, minlength=num_obs)
+    # entries of each observation are contiguous, as built by
+    # `_flow_observations` and `_input_observations`
+    position = np.arange(len(obs_index)) - np.repeat(np.cumsum(counts) - counts, counts)
+    shape = (num_obs, max(counts.max(), 1))
+    used = np.zeros(shape, dtype=np.int8)
+    used[obs_index, position] = 1
+    padded = []
+    for index in index_arrays:
+        rows = np.zeros(shape, dtype=int)
+        rows[obs_index, position] = index
+        padded.append(rows)
+    return used, padded
+
+
+def _observation_key(observation):
+    """Which quantity an observation is of, ignoring its value and std."""
+    return tuple(tuple(part) for part in observation[:-2])
 
 
 class SplitParamModel:
     """Flow model with different types of prior for different process sub-models.
+
+    `solver` chooses how the process throughputs are found: 'inverse' takes
+    the dense inverse of (I - A); 'blocks' uses forward substitution through
+    the process graph, with small dense solves only inside recycling loops;
+    'adjoint' uses one LU-factorised solve, with the gradient found by the
+    adjoint method (see `leontief_op`).
+
+    With `packed_params`, processes of the same type share one random
+    variable (e.g. all efficiencies in `param_efficiency`, all 3-way
+    Dirichlet allocations in `param_dirichlet3`) instead of one each. Use
+    `get_params` to pick out the values for one process from a trace.
+
+    With `edge_flows`, transfer coefficients and flows are recorded as
+    vectors `TCs_edges` and `F_edges` with one entry per possible flow (see
+    `edges`), instead of dense Np x Np matrices. Use `get_flow` and
+    `dense_flows` to read them back.
+
+    With `shared_observations`, the observation values, standard deviations
+    and a mask are held in shared variables. The observations given when
+    the model is built fix the layout (which flows, inputs and inflow
+    fractions can be observed); `set_observations` then swaps in new values
+    for any subset of them without rebuilding or recompiling the model.
+
+    With `minibatch_size`, `fit_advi` estimates the likelihood of each kind
+    of observation from a random batch of that many rows (drawn with
+    replacement and scaled up to the full number of rows) on each
+    iteration, so the cost per iteration does not grow with the number of
+    observations. At all other times, including NUTS sampling, the full
+    likelihood is used.
     """
     def __init__(self, processes, input_defs, param_defs, flow_observations=None,
-                 input_observations=None, inflow_observations=None):
+                 input_observations=None, inflow_observations=None, solver='inverse',
+                 packed_params=False, edge_flows=False, shared_observations=False,
+                 minibatch_size=None):
+        if solver not in ('inverse', 'blocks', 'adjoint'):
+            raise ValueError('Unknown solver: {}'.format(solver))
         self.processes = processes
+        self.solver = solver
+        self.packed_params = packed_params
+        self.edge_flows = edge_flows
+        self.edges = edge_list(processes)
+        self.shared_observations = shared_observations
+        self.observation_layout = {}
+        self.observation_data = {}
+        self._compiled = None
+        self.minibatch_size = minibatch_size
+        # switched on only while fitting with minibatches
+        self.use_minibatches = theano.shared(np.int8(0), name='use_minibatches')
+        self._random = RandomStreams()
+        self.param_index = {}
         self.possible_inputs = possible_inputs = sorted(list(input_defs.keys()))
         input_max = [input_defs[k] for k in possible_inputs]
         self.param_defs = param_defs
+        self.cache_key = model_cache_key(
+            processes, input_defs=input_defs, param_defs=param_defs,
+            flow_observations=flow_observations, input_observations=input_observations,
+            inflow_observations=inflow_observations, solver=solver,
+            packed_params=packed_params, edge_flows=edge_flows,
+            shared_observations=shared_observations, minibatch_size=minibatch_size)
 
         with pm.Model() as self.model:
             # Inputs
@@ -48,93 +128,358 @@ class SplitParamModel:
             inputs = pm.Uniform('inputs', lower=np.zeros_like(input_max),
                                 upper=input_max, shape=len(input_max))
 
-            # Params for each process
-            # params = pm.Normal('params', mu=param_means, sd=param_stds, shape=len(param_means))
-            process_params = {
-                pid: process.param_rv(pid, param_defs.get(pid))
-                for pid, process in processes.items()
-            }
+            # Params for each process (or each group of processes)
+            tc_groups = self._process_params(packed_params)
 
             # transfer_coeffs
-            transfer_coeffs, all_inputs = self._build_matrices(process_params, inputs)
-            transfer_coeffs = pm.Deterministic('TCs_coeffs', transfer_coeffs)
+            edge_coeffs, transfer_coeffs, all_inputs = self._build_matrices(tc_groups, inputs)
+            if edge_flows:
+                pm.Deterministic('TCs_edges', edge_coeffs)
+            else:
+                transfer_coeffs = pm.Deterministic('TCs_coeffs', transfer_coeffs)
             process_throughputs = pm.Deterministic(
-                'X', T.dot(matrix_inverse(T.eye(len(processes)) - transfer_coeffs), all_inputs))
+                'X', self._solve_throughputs(transfer_coeffs, all_inputs))
 
             # Flows
-            flows = pm.Deterministic('F', transfer_coeffs.T * process_throughputs[:, None])
+            if edge_flows:
+                _, edge_sources = transfer_coefficient_index(processes)
+                pm.Deterministic('F_edges', edge_coeffs * process_throughputs[edge_sources])
+            else:
+                pm.Deterministic('F', transfer_coeffs.T * process_throughputs[:, None])
 
             # Observations - flows
             if flow_observations is not None:
                 flow_obs, flow_data, flow_stds = self._flow_observations(flow_observations)
-                Fobs = pm.Deterministic('Fobs', T.tensordot(flow_obs, flows, 2))
-                pm.Normal('FD', mu=Fobs, sd=flow_stds, observed=flow_data)
+                Fobs = pm.Deterministic('Fobs', self._observed_flows(
+                    flow_obs, len(flow_data), transfer_coeffs, process_throughputs))
+                self._likelihood('FD', 'flow', flow_observations, Fobs, flow_data, flow_stds,
+                                 self._batch_flows(flow_obs, len(flow_data), transfer_coeffs,
+                                                   process_throughputs))
 
             # Observations - inputs
             if input_observations is not None:
                 input_obs, input_data, input_stds = self._input_observations(input_observations)
-                Iobs = pm.Deterministic('Iobs', T.dot(input_obs, all_inputs))
-                pm.Normal('ID', mu=Iobs, sd=input_stds, observed=input_data)
+                obs_index, target_idx = input_obs
+                Iobs = pm.Deterministic('Iobs', _segment_sum(
+                    obs_index, all_inputs[target_idx], len(input_data)))
+                self._likelihood('ID', 'input', input_observations, Iobs,
+                                 input_data, input_stds,
+                                 self._batch_inputs(input_obs, len(input_data), all_inputs))
 
             # Observations - ratios
             if inflow_observations is not None:
                 inflow_obs, inflow_data, inflow_stds = self._flow_observations(inflow_observations)
-                inflow_fractions = flows / process_throughputs[None, :]
-                Iratioobs = pm.Deterministic('IFobs', T.tensordot(inflow_obs, inflow_fractions, 2))
-                pm.Normal('IFD', mu=Iratioobs, sd=inflow_stds, observed=inflow_data)
-
-    def _build_matrices(self, process_params, inputs):
+                Iratioobs = pm.Deterministic('IFobs', self._observed_flows(
+                    inflow_obs, len(inflow_data), transfer_coeffs, process_throughputs,
+                    inflow_fractions=True))
+                self._likelihood('IFD', 'inflow', inflow_observations, Iratioobs,
+                                 inflow_data, inflow_stds,
+                                 self._batch_flows(inflow_obs, len(inflow_data), transfer_coeffs,
+                                                   process_throughputs, inflow_fractions=True))
+
+    def _likelihood(self, name, kind, observations, mu, data, stds, batch_mu):
+        """Normal likelihood of the observations, with fixed or shared data.
+
+        `batch_mu` gives the expected values of a batch of observations,
+        given their row numbers, for minibatch fitting.
+        """
+        num_obs = len(observations)
+        if self.shared_observations:
+            self.observation_layout[kind] = [_observation_key(obs) for obs in observations]
+            data = theano.shared(data, name='{}_data'.format(name))
+            stds = theano.shared(stds, name='{}_stds'.format(name))
+            mask = theano.shared(np.ones(num_obs), name='{}_mask'.format(name))
+            self.observation_data[kind] = (data, stds, mask)
+        elif self.minibatch_size is None or self.minibatch_size >= num_obs:
+            pm.Normal(name, mu=mu, sd=stds, observed=data)
+            return
+        else:
+            data, stds, mask = (T.as_tensor_variable(x) for x in (data, stds, np.ones(num_obs)))
+
+        logp = pm.Normal.dist(mu=mu, sd=stds).logp(data)
+        logp = T.sum(T.switch(mask, logp, 0))
+        if self.minibatch_size is not None and self.minibatch_size < num_obs:
+            rows = self._random.random_integers((self.minibatch_size,), 0, num_obs - 1)
+            batch_logp = pm.Normal.dist(mu=batch_mu(rows), sd=stds[rows]).logp(data[rows])
+            scale = num_obs / self.minibatch_size
+            batch_logp = scale * T.sum(T.switch(mask[rows], batch_logp, 0))
+            # lazy, so only the branch in use is evaluated
+            logp = ifelse(self.use_minibatches, batch_logp, logp)
+        pm.Potential(name, logp)
+
+    def set_observations(self, flow_observations=None, input_observations=None,
+                         inflow_observations=None):
+        """Swap in new observation values (shared observations only).
+
+        Observations are given in the same form as to the constructor, and
+        each must be part of the layout the model was built with; those in
+        the layout but not given are switched off. Kinds of observation
+        which are not given at all are left as they are.
+        """
+        if not self.shared_observations:
+            raise ValueError('Model was not built with shared_observations')
+        for kind, observations in [('flow', flow_observations),
+                                   ('input', input_observations),
+                                   ('inflow', inflow_observations)]:
+            if observations is None:
+                continue
+            if kind not in self.observation_layout:
+                raise ValueError('Model has no {} observations'.format(kind))
+            layout = self.observation_layout[kind]
+            data = np.zeros(len(layout))
+            stds = np.ones(len(layout))
+            mask = np.zeros(len(layout))
+            for obs in observations:
+                key = _observation_key(obs)
+                if key not in layout:
+                    raise ValueError('Observation {} is not in the model layout'.format(key))
+                i = layout.index(key)
+                data[i], stds[i], mask[i] = obs[-2], obs[-1], 1
+            for var, value in zip(self.observation_data[kind], (data, stds, mask)):
+                var.set_value(value)
+
+    def _process_params(self, packed):
+        """Create parameter random variables and transfer functions.
+
+        Returns a list of ``(pids, tcs)`` pairs, where `tcs` holds the
+        transfer coefficients of the processes `pids`, in order.
+        """
+        groups = OrderedDict()
+        tc_groups = []
+        for pid, process in self.processes.items():
+            defs = self.param_defs.get(pid)
+            key = process.batch_key(defs) if packed and hasattr(process, 'batch_key') else None
+            if key is None:
+                params = process.param_rv(pid, defs)
+                if process.outputs:
+                    tc_groups.append(([pid], process.transfer_functions(params)))
+            else:
+                groups.setdefault(key, []).append(pid)
+
+        for key, pids in groups.items():
+            name = 'param_{}'.format(key)
+            # processes in a group share a type and number of parameters
+            first = self.processes[pids[0]]
+            params = first.batch_param_rv(name, [self.param_defs.get(pid) for pid in pids])
+            tc_groups.append((pids, first.batch_transfer_functions(params)))
+            for row, pid in enumerate(pids):
+                self.param_index[pid] = (name, row)
+
+        return tc_groups
+
+    def _build_matrices(self, tc_groups, inputs):
         Np = len(self.processes)
-        transfer_coeffs = T.zeros((Np, Np))
 
         # lookup process id to index
         pids = {k: i for i, k in enumerate(self.processes)}
 
-        for pid, process in self.processes.items():
-            if not process_params.get(pid):
-                continue
-            params = process_params[pid]
-            process_tcs = process.transfer_functions(params)
-            if process.outputs:
-                dest_idx = [pids[dest_id] for dest_id in process.outputs]
-                transfer_coeffs = T.set_subtensor(transfer_coeffs[dest_idx, pids[pid]], process_tcs)
+        # Put the transfer coefficients into edge order, then write them all
+        # into the matrix in one scatter, rather than one set_subtensor per
+        # process
+        edge_position = {edge: i for i, edge in enumerate(self.edges)}
+        order = [edge_position[pid, dest_id]
+                 for group_pids, _ in tc_groups
+                 for pid in group_pids
+                 for dest_id in self.processes[pid].outputs]
+        edge_coeffs = T.zeros(len(self.edges))
+        if tc_groups:
+            edge_coeffs = T.set_subtensor(edge_coeffs[order],
+                                          T.concatenate([tcs for _, tcs in tc_groups]))
+        tc_rows, tc_cols = transfer_coefficient_index(self.processes)
+        transfer_coeffs = T.set_subtensor(T.zeros((Np, Np))[tc_rows, tc_cols], edge_coeffs)
 
         possible_inputs_idx = [pids[k] for k in self.possible_inputs]
         all_inputs = T.zeros(Np)
         all_inputs = T.set_subtensor(all_inputs[possible_inputs_idx], inputs)
 
-        return transfer_coeffs, all_inputs
+        return edge_coeffs, transfer_coeffs, all_inputs
 
-    def _flow_observations(self, observations):
+    def _solve_throughputs(self, transfer_coeffs, all_inputs):
+        """Solve (I - A) X = inputs for the process throughputs X."""
         Np = len(self.processes)
+        if self.solver == 'inverse':
+            return T.dot(matrix_inverse(T.eye(Np) - transfer_coeffs), all_inputs)
+        if self.solver == 'adjoint':
+            return leontief_solve(transfer_coeffs, all_inputs)
+
+        # Forward substitution, one level of the process graph at a time.
+        # Throughputs which are not solved yet are still zero, so T.dot with
+        # the full X only picks up flows from upstream levels.
+        X = T.zeros(Np)
+        for acyclic, loops in solve_levels(self.processes):
+            if len(acyclic):
+                X = T.set_subtensor(X[acyclic],
+                                    all_inputs[acyclic] + T.dot(transfer_coeffs[acyclic], X))
+            for loop in loops:
+                # small dense solve for the recycling loop
+                rhs = all_inputs[loop] + T.dot(transfer_coeffs[loop], X)
+                A_loop = transfer_coeffs[loop][:, loop]
+                X = T.set_subtensor(X[loop], solve(T.eye(len(loop)) - A_loop, rhs))
+        return X
+
+    def _flow_observations(self, observations):
+        """Sparse observation operator: each observation is the sum of the
+        flows ``source_idx[i] -> target_idx[i]`` for which ``obs_index[i]``
+        is the observation number."""
         No = len(observations)
-        flow_obs = np.zeros((No, Np, Np))
+        obs_index, source_idx, target_idx = [], [], []
         flow_data = np.zeros(No)
         flow_stds = np.zeros(No)
         pids = {k: i for i, k in enumerate(self.processes)}
         for i, (sources, targets, value, std) in enumerate(observations):
-            flow_obs[i, [pids[k] for k in sources], [pids[k] for k in targets]] = 1
+            sources, targets = np.broadcast_arrays([pids[k] for k in sources],
+                                                   [pids[k] for k in targets])
+            pairs = sorted(set(zip(sources, targets)))
+            obs_index.extend([i] * len(pairs))
+            source_idx.extend(j for j, _ in pairs)
+            target_idx.extend(k for _, k in pairs)
             flow_data[i] = value
             flow_stds[i] = std
+        flow_obs = tuple(np.array(xx, dtype=int) for xx in (obs_index, source_idx, target_idx))
         return flow_obs, flow_data, flow_stds
 
     def _input_observations(self, observations):
-        Np = len(self.processes)
+        """Sparse observation operator: each observation is the sum of the
+        inputs to ``target_idx[i]`` for which ``obs_index[i]`` is the
+        observation number."""
         No = len(observations)
-        input_obs = np.zeros((No, Np))
+        obs_index, target_idx = [], []
         input_data = np.zeros(No)
         input_stds = np.zeros(No)
         pids = {k: i for i, k in enumerate(self.processes)}
         for i, (targets, value, std) in enumerate(observations):
-            input_obs[i, [pids[k] for k in targets]] = 1
+            targets = sorted(set(pids[k] for k in targets))
+            obs_index.extend([i] * len(targets))
+            target_idx.extend(targets)
             input_data[i] = value
             input_stds[i] = std
+        input_obs = tuple(np.array(xx, dtype=int) for xx in (obs_index, target_idx))
         return input_obs, input_data, input_stds
 
+    @staticmethod
+    def _observed_flows(flow_obs, num_obs, transfer_coeffs, process_throughputs,
+                        inflow_fractions=False):
+        """Evaluate sparse flow observations by gathering only the flows needed."""
+        obs_index, source_idx, target_idx = flow_obs
+        values = transfer_coeffs[target_idx, source_idx] * process_throughputs[source_idx]
+        if inflow_fractions:
+            values = values / process_throughputs[target_idx]
+        return _segment_sum(obs_index, values, num_obs)
+
+    @staticmethod
+    def _batch_flows(flow_obs, num_obs, transfer_coeffs, process_throughputs,
+                     inflow_fractions=False):
+        """Function evaluating the flow observations in a batch of rows."""
+        obs_index, source_idx, target_idx = flow_obs
+        used, (source_rows, target_rows) = _padded_rows(obs_index, num_obs, source_idx, target_idx)
+
+        def batch_mu(rows):
+            sources = T.as_tensor_variable(source_rows)[rows]
+            targets = T.as_tensor_variable(target_rows)[rows]
+            values = transfer_coeffs[targets, sources] * process_throughputs[sources]
+            if inflow_fractions:
+                values = values / process_throughputs[targets]
+            return T.sum(T.switch(T.as_tensor_variable(used)[rows], values, 0), axis=1)
+        return batch_mu
+
+    @staticmethod
+    def _batch_inputs(input_obs, num_obs, all_inputs):
+        """Function evaluating the input observations in a batch of rows."""
+        obs_index, target_idx = input_obs
+        used, (target_rows,) = _padded_rows(obs_index, num_obs, target_idx)
+
+        def batch_mu(rows):
+            values = all_inputs[T.as_tensor_variable(target_rows)[rows]]
+            return T.sum(T.switch(T.as_tensor_variable(used)[rows], values, 0), axis=1)
+        return batch_mu
+
+    def fit_advi(self, n=10000, start=None, random_seed=None):
+        """Fit ADVI, using minibatches of the observations if the model was
+        built with `minibatch_size`. Returns the `ADVIFit`."""
+        with self.model:
+            if self.minibatch_size is None:
+                return pm.variational.advi(start=start, n=n, random_seed=random_seed)
+            if random_seed is not None:
+                self._random.seed(random_seed)
+            self.use_minibatches.set_value(1)
+            try:
+                return pm.variational.advi(start=start, n=n, random_seed=random_seed)
+            finally:
+                self.use_minibatches.set_value(0)
+
+    def compiled_functions(self, cache_dir=DEFAULT_CACHE_DIR):
+        """Compiled logp/gradient and deterministics functions.
+
+        These are cached on disk in `cache_dir`, keyed by the model
+        definition and code, so only the first run with a given model
+        compiles them, and kept in memory for later calls. `pm.sample` and
+        ADVI compile their own graphs and do not use these.
+        With shared observations they are not cached on disk, since a
+        pickled copy would not follow `set_observations`.
+        """
+        if self._compiled is None:
+            if self.shared_observations:
+                self._compiled = CompiledModelFunctions(self.model)
+            else:
+                self._compiled = load_or_compile(self.model, self.cache_key, cache_dir)
+        return self._compiled
+
+    def __getstate__(self):
+        # compiled functions cannot always be pickled, and are compiled
+        # again when needed
+        state = self.__dict__.copy()
+        state['_compiled'] = None
+        return state
+
+    def sample_parallel(self, draws=500, chains=4, njobs=None, n_advi=10000, tune=None,
+                        random_seed=None, compiledir_root=None):
+        """Sample independent ADVI-initialised NUTS chains in parallel processes.
+
+        Returns the merged multi-chain trace and a dictionary of convergence
+        diagnostics; see `parallel_sampling.sample_chains`.
+        """
+        return sample_chains(self, draws=draws, chains=chains, njobs=njobs, n_advi=n_advi,
+                             tune=tune, random_seed=random_seed,
+                             compiledir_root=compiledir_root)
+
+    def laplace(self, start=None, maxiter=1000, hessian='fd'):
+        """Gaussian approximation of the posterior about the MAP point, for
+        quick checks of priors; ``laplace().sample(draws)`` gives a trace
+        with the same variables as the sampler. See `laplace`."""
+        return laplace_approximation(self, start=start, maxiter=maxiter, hessian=hessian)
+
+    def profile(self, point=None, evaluations=100, gradients=True):
+        """Time each logp term and deterministic, and the Theano operations
+        of the full logp and gradient; see `profiling`. The result can be
+        saved with `profiling.save_json`."""
+        return {
+            'terms': profile_terms(self, point, evaluations, gradients),
+            'ops': profile_ops(self, point, evaluations),
+        }
+
+    def get_params(self, trace, pid):
+        """Pick out parameter values for one process from trace."""
+        if pid in self.param_index:
+            name, row = self.param_index[pid]
+            values = trace[name][:, row]
+            return values[:, None] if values.ndim == 1 else values
+        return trace['param_{}'.format(pid)]
+
+    def edge_index(self, source, target):
+        """Position of the flow from `source` to `target` in edge vectors."""
+        return self.edges.index((source, target))
+
     def get_flow(self, trace, source, target):
         """Pick out flow from trace."""
+        if 'F_edges' in trace.varnames:
+            return trace['F_edges'][:, self.edge_index(source, target)]
         pids = {k: i for i, k in enumerate(self.processes)}
-        return trace['flows'][:, pids[source], pids[target]]
+        return trace['F'][:, pids[source], pids[target]]
+
+    def dense_flows(self, edge_values):
+        """Rebuild (..., Np, Np) flow matrices, indexed [source, target],
+        from edge vectors such as ``trace['F_edges']``."""
+        return edges_to_dense(self.processes, edge_values)
 
     def show_point(self, point, sdd):
         """Show Sankey diagram for trace point."""
@@ -163,6 +508,39 @@ class EfficiencyProcess:
         eff = T.exp(params[0]) / (1 + T.exp(params[0]))
         return T.stack([eff, 1 - eff])
 
+    @staticmethod
+    def batch_key(defs):
+        return 'efficiency' if defs else 'efficiency_uniform'
+
+    @staticmethod
+    def batch_param_rv(name, all_defs):
+        if all_defs[0]:
+            means, stds = (np.array(xx, dtype=float) for xx in zip(*all_defs))
+            return pm.Normal(name, mu=means, sd=stds, shape=len(means))
+        else:
+            return pm.Uniform(name, shape=len(all_defs))
+
+    @staticmethod
+    def batch_transfer_functions(params):
+        # logistic efficiencies, all processes at once
+        eff = T.nnet.sigmoid(params)
+        return T.stack([eff, 1 - eff], axis=1).flatten()
+
+    @staticmethod
+    def batch_sample_params(all_defs, size, random_state):
+        """Draw NumPy samples of the parameters, shape (size, n, 1)."""
+        if all_defs[0]:
+            means, stds = (np.array(xx, dtype=float) for xx in zip(*all_defs))
+            return random_state.normal(means, stds, size=(size, len(means)))[:, :, None]
+        else:
+            return random_state.uniform(size=(size, len(all_defs), 1))
+
+    @staticmethod
+    def batch_transfer_values(params):
+        """NumPy transfer coefficients for params of shape (size, n, 1)."""
+        eff = 1 / (1 + np.exp(-params[:, :, 0]))
+        return np.stack([eff, 1 - eff], axis=2).reshape(len(params), -1)
+
     def param_rv(self, pid, defs):
         if defs:
             # Normal dist about given mean & sd
@@ -183,6 +561,37 @@ class DirichletAllocationProcess:
     def transfer_functions(params):
         return params
 
+    def batch_key(self, defs):
+        # single-output allocations have no free parameters
+        return 'dirichlet{}'.format(self.nparams) if self.nparams > 1 else None
+
+    def batch_param_rv(self, name, all_defs):
+        alphas = np.array([np.ones(self.nparams) if defs is None else defs
+                           for defs in all_defs])
+        assert alphas.shape[1] == self.nparams
+        # Dirichlet.mean normalises over the whole array, so give each row
+        # its own mean as the starting value
+        return pm.Dirichlet(name, alphas, shape=alphas.shape,
+                            testval=alphas / alphas.sum(axis=1, keepdims=True))
+
+    @staticmethod
+    def batch_transfer_functions(params):
+        return params.flatten()
+
+    def batch_sample_params(self, all_defs, size, random_state):
+        """Draw NumPy samples of the parameters, shape (size, n, nparams)."""
+        alphas = np.array([np.ones(self.nparams) if defs is None else defs
+                           for defs in all_defs])
+        if self.nparams == 1:
+            return np.ones((size,) + alphas.shape)
+        gammas = random_state.gamma(alphas, size=(size,) + alphas.shape)
+        return gammas / gammas.sum(axis=2, keepdims=True)
+
+    @staticmethod
+    def batch_transfer_values(params):
+        """NumPy transfer coefficients for params of shape (size, n, nparams)."""
+        return params.reshape(len(params), -1)
+
     @staticmethod
     def prior(shares, concentration=None, with_stddev=None):
         if (concentration is not None and with_stddev is not None) or \
@@ -235,6 +644,17 @@ class NormalisedUniformAllocationProcess:
         result = uniforms / uniforms.sum()
         return result
 
+    def batch_sample_params(self, all_defs, size, random_state):
+        """Draw NumPy samples of the parameters, shape (size, n, nparams)."""
+        if any(defs is not None for defs in all_defs):
+            raise ValueError('no parameters')
+        return random_state.uniform(size=(size, len(all_defs), self.nparams))
+
+    @staticmethod
+    def batch_transfer_values(params):
+        """NumPy transfer coefficients for params of shape (size, n, nparams)."""
+        return (params / params.sum(axis=2, keepdims=True)).reshape(len(params), -1)
+
 
 class SymlogAllocationProcess:
     def __init__(self, name, outputs):
@@ -254,6 +674,21 @@ class SymlogAllocationProcess:
         x = T.exp(params)
         return x / x.sum()
 
+    def batch_sample_params(self, all_defs, size, random_state):
+        """Draw NumPy samples of the parameters, shape (size, n, nparams)."""
+        if all_defs[0]:
+            means, stds = (np.array([np.atleast_1d(xx) for xx in defs_i])
+                           for defs_i in zip(*all_defs))
+            return random_state.normal(means, stds, size=(size,) + means.shape)
+        else:
+            return random_state.uniform(size=(size, len(all_defs), self.nparams))
+
+    @staticmethod
+    def batch_transfer_values(params):
+        """NumPy transfer coefficients for params of shape (size, n, nparams)."""
+        x = np.exp(params - params.max(axis=2, keepdims=True))
+        return (x / x.sum(axis=2, keepdims=True)).reshape(len(params), -1)
+
     def param_rv(self, pid, defs):
         if defs:
             # Normal dist about given mean & sd
@@ -281,6 +716,37 @@ class SoftmaxAllocationProcess:
     def transfer_functions(params):
         return T.nnet.softmax(params)[0]
 
+    def batch_key(self, defs):
+        return 'softmax{}{}'.format(self.nparams, '' if defs else '_uniform')
+
+    def batch_param_rv(self, name, all_defs):
+        if all_defs[0]:
+            means, stds = (np.array([np.atleast_1d(xx) for xx in defs_i])
+                           for defs_i in zip(*all_defs))
+            return pm.Normal(name, mu=means, sd=stds, shape=means.shape)
+        else:
+            return pm.Uniform(name, shape=(len(all_defs), self.nparams))
+
+    @staticmethod
+    def batch_transfer_functions(params):
+        # softmax works row-wise, one row per process
+        return T.nnet.softmax(params).flatten()
+
+    def batch_sample_params(self, all_defs, size, random_state):
+        """Draw NumPy samples of the parameters, shape (size, n, nparams)."""
+        if all_defs[0]:
+            means, stds = (np.array([np.atleast_1d(xx) for xx in defs_i])
+                           for defs_i in zip(*all_defs))
+            return random_state.normal(means, stds, size=(size,) + means.shape)
+        else:
+            return random_state.uniform(size=(size, len(all_defs), self.nparams))
+
+    @staticmethod
+    def batch_transfer_values(params):
+        """NumPy transfer coefficients for params of shape (size, n, nparams)."""
+        x = np.exp(params - params.max(axis=2, keepdims=True))
+        return (x / x.sum(axis=2, keepdims=True)).reshape(len(params), -1)
+
     def param_rv(self, pid, defs):
         if defs:
             # Normal dist about given mean & sd
@@ -0,0 +1,92 @@
+"""Theano Op solving the Leontief system (I - A) x = b.
+
+Differentiating ``T.dot(matrix_inverse(I - A), b)`` builds the full inverse
+and its gradient. `LeontiefSolve` instead LU-factorises (I - A) once and
+gets the gradient from the adjoint system: for a loss with gradient g with
+respect to x, the gradients are
+
+    g_b = (I - A)^-T g        g_A = outer(g_b, x)
+
+so each gradient needs only one extra (transposed) solve, which reuses the
+factorisation from the forward pass.
+
+A stack of systems, such as one per year, can be solved at once by giving
+A with shape (T, Np, Np) and b with shape (T, Np).
+"""
+
+import numpy as np
+import scipy.linalg
+import theano
+import theano.tensor as T
+
+
+# Last LU factorisation for each matrix shape. The gradient's transposed
+# solve is evaluated with the same A straight after the forward solve, so
+# it finds the factorisation here instead of factorising again.
+_factorisations = {}
+
+
+def _lu_factor(A):
+    """LU factorisation of I - A, or a list of them for a stack of matrices."""
+    cached = _factorisations.get(A.shape)
+    if cached is None or not np.array_equal(cached[0], A):
+        identity = np.eye(A.shape[-1])
+        if A.ndim == 2:
+            factors = scipy.linalg.lu_factor(identity - A)
+        else:
+            factors = [scipy.linalg.lu_factor(identity - Ai) for Ai in A]
+        cached = (A.copy(), factors)
+        _factorisations[A.shape] = cached
+    return cached[1]
+
+
+class LeontiefSolve(theano.Op):
+    """Solve (I - A) x = b, or (I - A)^T x = b with `trans`.
+
+    A and b are a matrix and a vector, or stacks of them.
+    """
+    __props__ = ('trans',)
+
+    def __init__(self, trans=False):
+        self.trans = trans
+
+    def make_node(self, A, b):
+        A = T.as_tensor_variable(A)
+        b = T.as_tensor_variable(b)
+        if b.ndim not in (1, 2) or A.ndim != b.ndim + 1:
+            raise TypeError('LeontiefSolve needs a matrix A and a vector b, '
+                            'or stacks of them')
+        dtype = theano.scalar.upcast(A.dtype, b.dtype)
+        x = T.TensorType(dtype, b.broadcastable)()
+        return theano.Apply(self, [A, b], [x])
+
+    def perform(self, node, inputs, outputs):
+        A, b = inputs
+        factors = _lu_factor(A)
+        trans = 1 if self.trans else 0
+        if A.ndim == 2:
+            x = scipy.linalg.lu_solve(factors, b, trans=trans)
+        else:
+            x = np.array([scipy.linalg.lu_solve(f, bi, trans=trans)
+                          for f, bi in zip(factors, b)])
+        outputs[0][0] = x.astype(node.outputs[0].dtype)
+
+    def infer_shape(self, node, shapes):
+        return [shapes[1]]
+
+    def grad(self, inputs, output_grads):
+        A, b = inputs
+        gx, = output_grads
+        x = self(A, b)
+        gb = LeontiefSolve(not self.trans)(A, gx)
+        # outer products, for each system in a stack
+        if self.trans:
+            gA = T.shape_padright(x) * T.shape_padaxis(gb, -2)
+        else:
+            gA = T.shape_padright(gb) * T.shape_padaxis(x, -2)
+        return [gA, gb]
+
+
+def leontief_solve(A, b):
+    """Throughputs x with (I - A) x = b, for one system or a stack."""
+    return LeontiefSolve()(A, b)
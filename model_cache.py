@@ -0,0 +1,143 @@
+"""On-disk cache of compiled model functions.
+
+Compiling the logp/gradient graph of a `SplitParamModel` is slow, especially
+with Theano's full optimizer. The compiled functions are pickled under a
+key which hashes everything that goes into the graph (process structure,
+priors, inputs, observations and model options, the source of the modules
+which build the graph, plus the Theano version and compilation settings),
+so the next run with the same model can load them instead of compiling
+again. Functions which cannot be pickled (e.g. some BLAS fallbacks hold
+unpicklable objects) are returned without being cached.
+
+Only the functions from `SplitParamModel.compiled_functions` are cached
+(used by e.g. `scenarios.fit_map` and `laplace`). `pm.sample` and
+`pm.variational.advi` build and compile their own graphs, so NUTS and ADVI
+runs still compile every time.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+import theano
+from pymc3.theanof import gradient
+
+
+DEFAULT_CACHE_DIR = 'compiled'
+
+# Modules whose code goes into the compiled graph: changing any of them
+# changes the key, so functions compiled from old code are never loaded
+GRAPH_MODULES = ['leontief_model.py', 'leontief_op.py', 'model_cache.py', 'process_graph.py']
+
+
+def source_hash(directory=None):
+    """Hash of the sources of `GRAPH_MODULES` in `directory` (by default
+    the one this file is in)."""
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha1()
+    for name in GRAPH_MODULES:
+        with open(os.path.join(directory, name), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _describe(obj):
+    """Turn nested definitions into something with a stable JSON form."""
+    if isinstance(obj, dict):
+        return [[str(k), _describe(v)] for k, v in sorted(obj.items(), key=lambda kv: str(kv[0]))]
+    if isinstance(obj, (list, tuple)):
+        return [_describe(x) for x in obj]
+    if isinstance(obj, np.ndarray):
+        return [_describe(x) for x in obj.tolist()]
+    if isinstance(obj, (float, np.floating)):
+        return repr(float(obj))
+    if isinstance(obj, (int, np.integer)):
+        return int(obj)
+    if obj is None or isinstance(obj, (str, bool)):
+        return obj
+    raise TypeError('Cannot describe {!r} for the model cache key'.format(obj))
+
+
+def describe_processes(processes):
+    """Structure of the processes: id, type and outputs, in order."""
+    return [[pid, type(process).__name__, list(process.outputs)]
+            for pid, process in processes.items()]
+
+
+def model_cache_key(processes, **definitions):
+    """Hash of the process structure and everything else given in `definitions`."""
+    description = {
+        'processes': describe_processes(processes),
+        'definitions': _describe(definitions),
+        'source': source_hash(),
+        'theano': [theano.__version__, theano.config.floatX,
+                   str(theano.config.mode), str(theano.config.optimizer)],
+    }
+    text = json.dumps(description, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class CompiledModelFunctions:
+    """Compiled log-probability, gradient and deterministics of a model.
+
+    Functions take the model's free variables as keyword arguments, so a
+    point dictionary (e.g. ``model.test_point``) can be passed directly.
+    The gradient is flattened in the order of `varnames`.
+    """
+    def __init__(self, model):
+        self.varnames = [v.name for v in model.vars]
+        self.deterministic_names = [v.name for v in model.deterministics]
+        self._logp_dlogp = theano.function(
+            model.vars, [model.logpt, gradient(model.logpt, model.vars)],
+            allow_input_downcast=True, on_unused_input='ignore')
+        self._deterministics = theano.function(
+            model.vars, model.deterministics,
+            allow_input_downcast=True, on_unused_input='ignore')
+
+    def logp_dlogp(self, point):
+        """Log-probability and its gradient at `point`."""
+        logp, dlogp = self._logp_dlogp(**self._inputs(point))
+        return logp, dlogp
+
+    def logp(self, point):
+        return self.logp_dlogp(point)[0]
+
+    def deterministics(self, point):
+        """Dictionary of deterministic values (inputs, X, F, ...) at `point`."""
+        values = self._deterministics(**self._inputs(point))
+        return dict(zip(self.deterministic_names, values))
+
+    def _inputs(self, point):
+        return {name: point[name] for name in self.varnames}
+
+
+def load_or_compile(model, key, cache_dir=DEFAULT_CACHE_DIR):
+    """Load compiled functions for `key` from `cache_dir`, or compile and save them."""
+    filename = os.path.join(cache_dir, '{}.pickle'.format(key))
+    if os.path.exists(filename):
+        # Use the stored optimized graph rather than optimizing it again
+        reoptimize = theano.config.reoptimize_unpickled_function
+        theano.config.reoptimize_unpickled_function = False
+        try:
+            with open(filename, 'rb') as f:
+                return pickle.load(f)
+        finally:
+            theano.config.reoptimize_unpickled_function = reoptimize
+
+    functions = CompiledModelFunctions(model)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    # write to a temporary file first so a half-written cache is never loaded
+    tmp_filename = filename + '.tmp{}'.format(os.getpid())
+    try:
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump(functions, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        # not picklable: use the functions without caching them
+        os.remove(tmp_filename)
+        return functions
+    os.replace(tmp_filename, filename)
+    return functions
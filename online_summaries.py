@@ -0,0 +1,274 @@
+"""Running posterior summaries kept while sampling, in bounded memory.
+
+`SummaryTrace` is a PyMC3 trace backend which, instead of storing every
+draw, keeps for every element of every variable:
+
+- running means and variances (Welford's algorithm, with Chan et al.'s
+  formula for combining batches), and
+- a mergeable quantile sketch (a stack of compactors as in the KLL sketch),
+  from which quantiles and HPD interval widths are estimated.
+
+Summaries from separate chains can be merged:
+
+    with model.model:
+        trace = pm.sample(100000, step=step, trace=SummaryTrace(burn=500))
+    summary = merge_summaries(trace).summary('F_edges')
+
+Memory use grows only with the logarithm of the number of draws, but is
+proportional to the number of elements, so use a model with
+``edge_flows=True`` (or restrict `vars`) rather than dense flow matrices.
+"""
+
+import numpy as np
+from pymc3.backends import base
+
+
+class RunningMoments:
+    """Running count, mean and sum of squared deviations of each element."""
+    def __init__(self, shape=()):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, values):
+        """Add a batch of draws, shape (num_draws,) + shape."""
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        mean = values.mean(axis=0)
+        self._combine(len(values), mean, ((values - mean)**2).sum(axis=0))
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2)
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        if total == 0:
+            return
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + delta**2 * (self.count * count / total)
+        self.count = total
+
+    def variance(self, ddof=0):
+        return self.m2 / (self.count - ddof)
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch for each element of an array.
+
+    Level ``i`` holds values which each stand for ``2**i`` draws. When a
+    level holds more than `k` values it is sorted and every other value
+    (from a random offset) is promoted to the next level. All elements see
+    the same number of draws, so they are compacted together.
+    """
+    def __init__(self, shape=(), k=256, random_state=None):
+        self.shape = tuple(shape)
+        self.k = k
+        self.count = 0
+        self.levels = []
+        if random_state is None or isinstance(random_state, int):
+            random_state = np.random.RandomState(random_state)
+        self.random_state = random_state
+
+    def update(self, values):
+        """Add a batch of draws, shape (num_draws,) + shape."""
+        values = np.asarray(values, dtype=float).reshape(len(values), -1)
+        self._add_to_level(0, values)
+        self.count += len(values)
+        self._compact()
+
+    def merge(self, other):
+        for i, level in enumerate(other.levels):
+            self._add_to_level(i, level)
+        self.count += other.count
+        self._compact()
+
+    def _add_to_level(self, i, values):
+        while len(self.levels) <= i:
+            self.levels.append(np.zeros((0, int(np.prod(self.shape)))))
+        self.levels[i] = np.concatenate([self.levels[i], values])
+
+    def _compact(self):
+        i = 0
+        while i < len(self.levels):
+            level = self.levels[i]
+            if len(level) > self.k:
+                level = np.sort(level, axis=0)
+                # an odd value out stays on this level
+                n = len(level) - len(level) % 2
+                offset = self.random_state.randint(2)
+                self.levels[i] = level[n:]
+                self._add_to_level(i + 1, level[offset:n:2])
+            i += 1
+
+    def quantiles(self, q):
+        """Estimated quantiles, shape (len(q),) + shape."""
+        q = np.atleast_1d(q)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0**i)
+                                  for i, level in enumerate(self.levels)])
+        order = np.argsort(values, axis=0)
+        columns = np.arange(values.shape[1])
+        sorted_values = values[order, columns]
+        cumulative = np.cumsum(weights[order], axis=0)
+        total = cumulative[-1]
+        result = np.empty((len(q), values.shape[1]))
+        for j, qj in enumerate(q):
+            idx = np.minimum((cumulative < qj * total).sum(axis=0), len(values) - 1)
+            result[j] = sorted_values[idx, columns]
+        return result.reshape((len(q),) + self.shape)
+
+    def hpd_width(self, alpha=0.05, grid=20):
+        """Estimated width of the narrowest interval holding ``1 - alpha``."""
+        lower = np.linspace(0, alpha, grid + 1)
+        values = self.quantiles(np.concatenate([lower, lower + 1 - alpha]))
+        return (values[grid + 1:] - values[:grid + 1]).min(axis=0)
+
+
+class OnlineSummary:
+    """Moments and quantile sketches for a set of named variables."""
+    def __init__(self, var_shapes, k=256, random_state=None):
+        if random_state is None or isinstance(random_state, int):
+            random_state = np.random.RandomState(random_state)
+        self.var_shapes = var_shapes
+        self.moments = {v: RunningMoments(shape) for v, shape in var_shapes.items()}
+        self.sketches = {v: QuantileSketch(shape, k, random_state)
+                         for v, shape in var_shapes.items()}
+
+    @property
+    def varnames(self):
+        return list(self.var_shapes.keys())
+
+    def update(self, values):
+        """Add a batch of draws: dict of varname -> (num_draws,) + shape."""
+        for varname, value in values.items():
+            self.moments[varname].update(value)
+            self.sketches[varname].update(value)
+
+    def merge(self, other):
+        for varname in self.var_shapes:
+            self.moments[varname].merge(other.moments[varname])
+            self.sketches[varname].merge(other.sketches[varname])
+
+    def summary(self, varname, quantiles=(0.025, 0.5, 0.975), alpha=0.05):
+        """Dictionary with 'count', 'mean', 'sd', 'quantiles' and 'hpd_width'."""
+        moments = self.moments[varname]
+        sketch = self.sketches[varname]
+        return {
+            'count': moments.count,
+            'mean': moments.mean,
+            'sd': np.sqrt(moments.variance()),
+            'quantiles': sketch.quantiles(quantiles),
+            'hpd_width': sketch.hpd_width(alpha),
+        }
+
+
+class SummaryTrace(base.BaseTrace):
+    """Trace backend keeping running summaries instead of draws.
+
+    Parameters
+    ----------
+    model : Model
+        If None, the model is taken from the `with` context.
+    vars : list of variables
+        Summaries are kept for these variables. If None,
+        `model.unobserved_RVs` is used.
+    burn : int
+        Number of draws at the start of each chain to leave out.
+    k : int
+        Capacity of each level of the quantile sketches.
+    chunk_size : int
+        Number of draws buffered before the summaries are updated.
+    random_seed : int
+        Seed for the random choices made when compacting the sketches.
+
+    If the same backend is used for several chains, each chain gets its
+    own summaries (in `chain_summaries`) and its own burn-in; `summaries`
+    are those of the current chain. Calling `setup` again for the same
+    chain carries on where it left off.
+    """
+    def __init__(self, model=None, vars=None, burn=0, k=256, chunk_size=100,
+                 random_seed=None):
+        super(SummaryTrace, self).__init__('summary', model, vars)
+        self.burn = burn
+        self.k = k
+        self.chunk_size = chunk_size
+        self.random_seed = random_seed
+        self.chain_summaries = {}
+        # draws recorded in each chain, with and without the burn-in
+        self._seen = {}
+        self._draws = {}
+        self._buffer = None
+
+    @property
+    def summaries(self):
+        return self.chain_summaries.get(self.chain)
+
+    # Sampling methods
+
+    def setup(self, draws, chain):
+        self._flush()
+        self.chain = chain
+        if chain not in self.chain_summaries:
+            seed = None if self.random_seed is None else self.random_seed + chain
+            self.chain_summaries[chain] = OnlineSummary(
+                {v: tuple(self.var_shapes[v]) for v in self.varnames}, self.k, seed)
+            self._seen[chain] = 0
+            self._draws[chain] = 0
+        self._buffer = {v: [] for v in self.varnames}
+
+    def record(self, point):
+        self._seen[self.chain] += 1
+        if self._seen[self.chain] <= self.burn:
+            return
+        for varname, value in zip(self.varnames, self.fn(point)):
+            self._buffer[varname].append(value)
+        if len(self._buffer[self.varnames[0]]) == self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer or not self._buffer[self.varnames[0]]:
+            return
+        values = {v: np.array(self._buffer[v]) for v in self.varnames}
+        self._draws[self.chain] += len(values[self.varnames[0]])
+        self.summaries.update(values)
+        self._buffer = {v: [] for v in self.varnames}
+
+    def close(self):
+        self._flush()
+
+    # Selection methods
+
+    def __len__(self):
+        return self._draws.get(self.chain, 0)
+
+    def get_values(self, varname, burn=0, thin=1):
+        raise ValueError('SummaryTrace does not keep individual draws; use `summaries`')
+
+    def _slice(self, idx):
+        raise ValueError('SummaryTrace does not keep individual draws; use `summaries`')
+
+    def point(self, idx):
+        raise ValueError('SummaryTrace does not keep individual draws; use `summaries`')
+
+    def summary(self, varname, **kwargs):
+        return self.summaries.summary(varname, **kwargs)
+
+
+def merge_summaries(traces):
+    """Merge the summaries of all chains of several traces (a MultiTrace or
+    list of `SummaryTrace` objects) into one `OnlineSummary`."""
+    if hasattr(traces, 'chains'):
+        traces = [traces._straces[chain] for chain in traces.chains]
+    # a backend used for several chains can appear more than once
+    summaries = []
+    for strace in traces:
+        for summary in strace.chain_summaries.values():
+            if not any(summary is other for other in summaries):
+                summaries.append(summary)
+    first = summaries[0]
+    merged = OnlineSummary(first.var_shapes, first.sketches[first.varnames[0]].k)
+    for summary in summaries:
+        merged.merge(summary)
+    return merged
@@ -0,0 +1,169 @@
+"""Run independent ADVI-initialised NUTS chains in a pool of processes.
+
+Each chain is started from its own ADVI fit, with its own random seed, and
+the chains are merged into one `MultiTrace` so between-chain diagnostics
+(R-hat and effective sample size) can be calculated.
+
+Theano takes a lock on its compile directory, so workers sharing one
+directory spend most of their time waiting for each other. Each worker
+process therefore gets its own compile directory, copied from the parent's.
+The parent first compiles the NUTS and ADVI graphs once, so the C modules
+they need are already in that copy and are not built again in every
+worker; the workers still optimise and link their own graphs.
+
+    trace, diagnostics = model.sample_parallel(500, chains=8, random_seed=974067)
+"""
+
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+# Theano reads its compile directory when it is first imported, so theano
+# and pymc3 must not be imported at module level here: the worker
+# processes import this module before they are given their directory.
+
+
+def _theano_flags(compiledir):
+    """THEANO_FLAGS for a worker, matching the parent's compilation settings."""
+    import theano
+    flags = [f for f in os.environ.get('THEANO_FLAGS', '').split(',')
+             if f and not f.startswith('compiledir=')]
+    flags += ['compiledir={}'.format(compiledir),
+              'mode={}'.format(theano.config.mode),
+              'optimizer={}'.format(theano.config.optimizer),
+              'floatX={}'.format(theano.config.floatX)]
+    return ','.join(flags)
+
+
+def _worker_flags(root, num_workers, base=None):
+    """Copy the parent's compile directory (or `base`) once for each worker,
+    unless the worker's directory is left from an earlier run, and return
+    the THEANO_FLAGS each worker should use."""
+    import theano
+    if base is None:
+        base = theano.config.compiledir
+    # Theano's compiled modules are in tmp* directories, so only the lock
+    # is left out
+    ignore = shutil.ignore_patterns('lock_dir')
+    worker_flags = []
+    for i in range(num_workers):
+        compiledir = os.path.join(root, 'worker-{}'.format(i))
+        if os.path.exists(compiledir):
+            pass
+        elif os.path.exists(base):
+            shutil.copytree(base, compiledir, ignore=ignore)
+        else:
+            os.makedirs(compiledir)
+        worker_flags.append(_theano_flags(compiledir))
+    return worker_flags
+
+
+def _init_worker(flags_queue):
+    os.environ['THEANO_FLAGS'] = flags_queue.get()
+
+
+def _compile_in_parent(model):
+    """Compile the graphs the workers will need into the parent's compile
+    directory, so the workers only have to load the C modules."""
+    import pymc3 as pm
+
+    # ADVI needs at least 10 iterations
+    advi = model.fit_advi(n=10)
+    with model.model:
+        pm.NUTS(scaling=model.model.dict_to_array(advi.stds)**2, is_cov=True)
+
+
+def _run_chain(job):
+    import pymc3 as pm
+
+    model_pickle, chain, seed, draws, n_advi, tune = job
+    model = pickle.loads(model_pickle)
+    advi = model.fit_advi(n=n_advi, random_seed=seed)
+    with model.model:
+        step = pm.NUTS(scaling=model.model.dict_to_array(advi.stds)**2, is_cov=True)
+        trace = pm.sample(draws, step=step, start=advi.means, chain=chain, tune=tune,
+                          random_seed=seed, progressbar=False)
+    values = {varname: trace.get_values(varname) for varname in trace.varnames}
+    return chain, trace.varnames, values, np.asarray(advi.elbo_vals)
+
+
+def sample_chains(model, draws=500, chains=4, njobs=None, n_advi=10000, tune=None,
+                  random_seed=None, compiledir_root=None):
+    """Sample `chains` ADVI-initialised NUTS chains of a `SplitParamModel` in parallel.
+
+    Returns the merged `MultiTrace` and a dictionary of diagnostics with
+    'gelman_rubin', 'effective_n' and the ADVI 'elbo' of each chain.
+
+    This writes a copy of the Theano compile directory for each of the
+    `njobs` workers under `compiledir_root`. By default that is a
+    temporary directory, removed afterwards; a given `compiledir_root` is
+    left in place, so the workers' compiled modules can be reused.
+    """
+    from pymc3.backends.base import MultiTrace
+    from binary_trace import LoadedChain
+
+    if njobs is None:
+        njobs = min(chains, multiprocessing.cpu_count())
+    seeds = np.random.RandomState(random_seed).randint(2**30, size=chains)
+
+    model_pickle = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+    _compile_in_parent(model)
+
+    cleanup = compiledir_root is None
+    if cleanup:
+        compiledir_root = tempfile.mkdtemp(prefix='theano-workers-')
+    try:
+        ctx = multiprocessing.get_context('spawn')
+        flags_queue = ctx.Queue()
+        for flags in _worker_flags(compiledir_root, njobs):
+            flags_queue.put(flags)
+        jobs = [(model_pickle, chain, int(seed), draws, n_advi, tune)
+                for chain, seed in enumerate(seeds)]
+        with ctx.Pool(njobs, initializer=_init_worker, initargs=(flags_queue,)) as pool:
+            results = pool.map(_run_chain, jobs)
+    finally:
+        if cleanup:
+            shutil.rmtree(compiledir_root, ignore_errors=True)
+
+    trace = MultiTrace([LoadedChain(chain, varnames, values)
+                        for chain, varnames, values, _ in results])
+    elbo = {chain: elbo_vals for chain, _, _, elbo_vals in results}
+    varnames = [v.name for v in model.model.vars]
+    return trace, diagnostics(trace, elbo, varnames=varnames)
+
+
+def diagnostics(trace, elbo=None, varnames=None):
+    """R-hat and effective sample size of each variable in a multi-chain trace.
+
+    Both need at least two chains, so are left out for a single chain.
+    Pass the model's free variables as `varnames`, since deterministics
+    which are constant across draws (e.g. the allocation of a process with
+    a single output) have no variance, and the diagnostics fail on them.
+    """
+    import pymc3 as pm
+
+    result = {}
+    if trace.nchains > 1:
+        if varnames is not None:
+            trace = select_varnames(trace, varnames)
+        result['gelman_rubin'] = pm.diagnostics.gelman_rubin(trace)
+        result['effective_n'] = pm.diagnostics.effective_n(trace)
+    if elbo is not None:
+        result['elbo'] = elbo
+    return result
+
+
+def select_varnames(trace, varnames):
+    """The trace with only the variables `varnames`, which PyMC3's
+    diagnostics cannot be given directly."""
+    from pymc3.backends.base import MultiTrace
+    from binary_trace import LoadedChain
+
+    return MultiTrace([
+        LoadedChain(chain, list(varnames),
+                    {v: trace.get_values(v, chains=chain, combine=False) for v in varnames})
+        for chain in trace.chains])
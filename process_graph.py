@@ -0,0 +1,170 @@
+"""Structural analysis of process networks.
+
+These functions only look at the `outputs` lists of the process
+definitions, so the results can be computed once when a model is built and
+reused for every evaluation.
+"""
+
+import numpy as np
+
+
+def process_index(processes):
+    """Lookup process id to index"""
+    return {k: i for i, k in enumerate(processes)}
+
+
+def successors(processes):
+    """List of target indices for each process, in process order."""
+    pids = process_index(processes)
+    return [[pids[dest_id] for dest_id in process.outputs]
+            for process in processes.values()]
+
+
+def strongly_connected_components(processes):
+    """Strongly connected components of the process graph (Tarjan's algorithm).
+
+    Components are returned in topological order: every flow between
+    different components goes from an earlier component to a later one.
+    """
+    succ = successors(processes)
+    Np = len(succ)
+    index = [None] * Np
+    lowlink = [0] * Np
+    on_stack = [False] * Np
+    stack = []
+    components = []
+    counter = 0
+
+    for root in range(Np):
+        if index[root] is not None:
+            continue
+        # iterative depth-first search: (node, position in successor list)
+        work = [(root, 0)]
+        while work:
+            node, pos = work.pop()
+            if pos == 0:
+                index[node] = lowlink[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            recurse = False
+            for i in range(pos, len(succ[node])):
+                child = succ[node][i]
+                if index[child] is None:
+                    work.append((node, i + 1))
+                    work.append((child, 0))
+                    recurse = True
+                    break
+                elif on_stack[child]:
+                    lowlink[node] = min(lowlink[node], index[child])
+            if recurse:
+                continue
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(sorted(component))
+
+    # Tarjan finds components in reverse topological order
+    return components[::-1]
+
+
+def solve_levels(processes):
+    """Group the process graph into levels for forward substitution.
+
+    Returns a list of ``(acyclic, loops)`` pairs in solution order.
+    ``acyclic`` is an index array of processes which are not part of any
+    loop, and ``loops`` is a list of index arrays, one for each recycling
+    loop (a strongly connected component with more than one process, or a
+    process which feeds itself). Everything in a level only depends on
+    throughputs from earlier levels, so a whole level can be solved at once.
+    """
+    succ = successors(processes)
+    components = strongly_connected_components(processes)
+    component_of = {}
+    for c, component in enumerate(components):
+        for i in component:
+            component_of[i] = c
+
+    # longest path from any source in the condensed (acyclic) graph
+    depth = [0] * len(components)
+    for c, component in enumerate(components):
+        for i in component:
+            for j in succ[i]:
+                if component_of[j] != c:
+                    depth[component_of[j]] = max(depth[component_of[j]], depth[c] + 1)
+
+    levels = [([], []) for _ in range(max(depth) + 1 if depth else 0)]
+    for c, component in enumerate(components):
+        acyclic, loops = levels[depth[c]]
+        is_loop = len(component) > 1 or component[0] in succ[component[0]]
+        if is_loop:
+            loops.append(np.array(component, dtype=int))
+        else:
+            acyclic.extend(component)
+
+    return [(np.array(sorted(acyclic), dtype=int), loops) for acyclic, loops in levels]
+
+
+def transfer_coefficient_index(processes, order=None):
+    """Flat (row, col) indices of every transfer coefficient.
+
+    Entries are in process order (or the order of the process ids in
+    `order`) and then in the order of each process's `outputs`, matching
+    the concatenation of the processes' transfer functions. Rows are
+    destinations and columns are sources, as in the transfer coefficient
+    matrix.
+    """
+    pids = process_index(processes)
+    if order is None:
+        order = list(processes)
+    rows = []
+    cols = []
+    for pid in order:
+        for dest_id in processes[pid].outputs:
+            rows.append(pids[dest_id])
+            cols.append(pids[pid])
+    return np.array(rows, dtype=int), np.array(cols, dtype=int)
+
+
+def edge_list(processes):
+    """(source, target) process ids of every possible flow, in edge order.
+
+    The edge order is the order of `transfer_coefficient_index`, so edge
+    vectors of transfer coefficients and flows line up with it.
+    """
+    return [(pid, dest_id) for pid, process in processes.items()
+            for dest_id in process.outputs]
+
+
+def edge_endpoints(processes):
+    """Source and target process indices of every edge, in edge order."""
+    targets, sources = transfer_coefficient_index(processes)
+    return sources, targets
+
+
+def dense_to_edges(processes, dense):
+    """Edge vectors, shape (..., num_edges), from source x target matrices."""
+    sources, targets = edge_endpoints(processes)
+    return np.asarray(dense)[..., sources, targets]
+
+
+def edges_to_dense(processes, edge_values):
+    """Rebuild source x target matrices from edge vectors.
+
+    `edge_values` has shape (..., num_edges); the result has shape
+    (..., Np, Np), indexed [source, target] like the flows matrix `F`.
+    """
+    edge_values = np.asarray(edge_values)
+    Np = len(processes)
+    sources, targets = edge_endpoints(processes)
+    dense = np.zeros(edge_values.shape[:-1] + (Np, Np), dtype=edge_values.dtype)
+    dense[..., sources, targets] = edge_values
+    return dense
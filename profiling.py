@@ -0,0 +1,192 @@
+"""Profiling of model terms and of the inference pipeline.
+
+`profile_terms` times each log-probability term (priors, observation
+likelihoods and potentials) and each deterministic (throughputs, flows,
+observed flows...) separately, which shows whether e.g. the Leontief solve,
+the Dirichlet priors or the inflow-fraction observations dominate.
+`profile_ops` uses Theano's profiler on the full logp and gradient function
+to break the time (and, with ``theano.config.profile_memory``, the memory)
+down by operation. `profile_pipeline` gives wall-clock times of the stages
+from building the model to post-processing the trace.
+
+    report = model.profile(evaluations=200)
+    save_json(report, 'profile.json')
+"""
+
+import json
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import theano
+import theano.tensor as T
+import pymc3 as pm
+from theano.compile.profiling import ProfileStats
+from pymc3.theanof import gradient
+
+from model_cache import CompiledModelFunctions
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None where the
+    `resource` module is not available (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    scale = 1024**2 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+class StageTimer:
+    """Wall-clock time and peak memory (None on Windows) of named stages."""
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        rss = peak_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            peak_rss = peak_rss_mb()
+            self.stages[name] = {
+                'seconds': time.perf_counter() - start,
+                'peak_rss_mb': peak_rss,
+                'peak_rss_increase_mb': None if rss is None else peak_rss - rss,
+            }
+
+
+def _seconds_per_call(fn, inputs, evaluations):
+    start = time.perf_counter()
+    for _ in range(evaluations):
+        fn(*inputs)
+    return (time.perf_counter() - start) / evaluations
+
+
+def profile_terms(model, point=None, evaluations=100, gradients=True):
+    """Time each logp term and deterministic of a `SplitParamModel`.
+
+    Each term is compiled on its own, so its time includes everything it
+    depends on (e.g. 'F' includes solving for 'X'). Output sizes are given
+    in bytes. With `gradients`, the gradient of each logp term with respect
+    to all free variables is timed as well.
+    """
+    pm_model = model.model
+    if point is None:
+        point = pm_model.test_point
+    inputs = [point[v.name] for v in pm_model.vars]
+
+    terms = OrderedDict()
+    for rv in pm_model.basic_RVs:
+        kind = 'observed' if rv in pm_model.observed_RVs else 'prior'
+        terms[rv.name] = (kind, rv.logpt)
+    for potential in pm_model.potentials:
+        terms[potential.name] = ('potential', T.sum(potential))
+    for deterministic in pm_model.deterministics:
+        terms[deterministic.name] = ('deterministic', deterministic)
+
+    report = OrderedDict()
+    for name, (kind, expr) in terms.items():
+        fn = theano.function(pm_model.vars, expr, allow_input_downcast=True,
+                             on_unused_input='ignore')
+        value = np.asarray(fn(*inputs))
+        row = OrderedDict([
+            ('kind', kind),
+            ('seconds_per_call', _seconds_per_call(fn, inputs, evaluations)),
+            ('output_bytes', value.nbytes),
+        ])
+        if kind != 'deterministic':
+            row['value'] = float(value)
+            if gradients:
+                grad_fn = theano.function(pm_model.vars, gradient(expr, pm_model.vars),
+                                          allow_input_downcast=True, on_unused_input='ignore')
+                row['gradient_seconds_per_call'] = _seconds_per_call(grad_fn, inputs, evaluations)
+        report[name] = row
+    return report
+
+
+def profile_ops(model, point=None, evaluations=100):
+    """Theano profile of the full logp and gradient, summed by operation.
+
+    Returns the total time per call and, for each type of operation, its
+    time, number of calls and (if ``theano.config.profile_memory`` is set)
+    the bytes of output it allocates.
+    """
+    pm_model = model.model
+    if point is None:
+        point = pm_model.test_point
+    inputs = [point[v.name] for v in pm_model.vars]
+
+    stats = ProfileStats(atexit_print=False)
+    fn = theano.function(pm_model.vars,
+                         [pm_model.logpt, gradient(pm_model.logpt, pm_model.vars)],
+                         allow_input_downcast=True, on_unused_input='ignore', profile=stats)
+    for _ in range(evaluations):
+        fn(*inputs)
+
+    ops = {}
+    for key, seconds in stats.apply_time.items():
+        # keys are (fgraph, node) in newer versions of Theano
+        node = key[1] if isinstance(key, tuple) else key
+        row = ops.setdefault(str(node.op), {'seconds': 0.0, 'calls': 0, 'output_bytes': None})
+        row['seconds'] += seconds / evaluations
+        row['calls'] += stats.apply_callcount.get(key, 0) // evaluations
+        shapes = [stats.variable_shape.get(out) for out in node.outputs]
+        if all(shape is not None for shape in shapes):
+            nbytes = sum(int(np.prod(shape)) * np.dtype(out.dtype).itemsize
+                         for shape, out in zip(shapes, node.outputs))
+            row['output_bytes'] = (row['output_bytes'] or 0) + nbytes
+
+    ordered = OrderedDict(sorted(ops.items(), key=lambda kv: -kv[1]['seconds']))
+    return OrderedDict([
+        ('seconds_per_call', stats.fct_call_time / evaluations),
+        ('compile_seconds', stats.compile_time),
+        ('ops', ordered),
+    ])
+
+
+def profile_pipeline(model_factory, n_advi=1000, draws=100, post_process=None,
+                     random_seed=None):
+    """Wall-clock times of building, compiling, fitting, sampling and
+    post-processing a model.
+
+    `model_factory` builds the `SplitParamModel`; `post_process`, if given,
+    is called with the model and trace. The 'compile' stage compiles the
+    logp/gradient and deterministics directly, not through the disk cache,
+    so it does not depend on (or write to) the cache directory. ADVI and
+    NUTS compile their own graphs, which is included in their stages.
+    """
+    timer = StageTimer()
+    with timer.stage('build'):
+        model = model_factory()
+    with timer.stage('compile'):
+        CompiledModelFunctions(model.model)
+    with model.model:
+        with timer.stage('advi'):
+            advi = pm.variational.advi(n=n_advi, random_seed=random_seed)
+        with timer.stage('sample'):
+            step = pm.NUTS(scaling=model.model.dict_to_array(advi.stds)**2, is_cov=True)
+            trace = pm.sample(draws, step=step, start=advi.means, random_seed=random_seed,
+                              progressbar=False)
+    if post_process is not None:
+        with timer.stage('post_process'):
+            post_process(model, trace)
+    return timer.stages
+
+
+def _to_json(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('{!r} is not JSON serializable'.format(obj))
+
+
+def save_json(report, filename):
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2, default=_to_json)
@@ -0,0 +1,253 @@
+"""Reuse a trace after the observations change, by importance reweighting.
+
+Draws from the posterior given the old observations are weighted by the
+ratio of the likelihoods of the new and old observations. Only the
+observations which differ contribute, and the likelihoods of all draws are
+found at once from the recorded flows, inputs and throughputs. The
+weights are Pareto-smoothed (PSIS; Vehtari, Gelman & Gabry 2017), and the
+estimated Pareto shape `khat` and the effective sample size say whether
+they can be trusted:
+
+    result = reweight(model, trace, {'inflow_observations': inflow_obs3},
+                      old_observations={'inflow_observations': inflow_obs2}, burn=500)
+    if not result.needs_refit:
+        summary = result.summarise(model.get_flow(trace, 'S', 'IFC')[500:])
+        new_trace = result.resample(2000)
+
+Observations are given as dictionaries of keyword arguments in the form of
+`SplitParamModel.set_observations`; kinds which are not given in
+`new_observations` are taken to be unchanged.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse
+
+from array_trace import ArrayTrace
+from leontief_model import _observation_key
+from process_graph import process_index
+
+
+KINDS = ['flow_observations', 'input_observations', 'inflow_observations']
+
+
+def _observed_values(model, trace, kind, observations, burn=0, thin=1):
+    """Value of each observed quantity in each draw, shape (draws, num_obs)."""
+    pids = process_index(model.processes)
+    if kind == 'input_observations':
+        inputs = trace.get_values('inputs', burn=burn, thin=thin)
+        columns = {pid: i for i, pid in enumerate(model.possible_inputs)}
+        rows, cols = [], []
+        for i, (targets, _, _) in enumerate(observations):
+            for target in set(targets):
+                if target in columns:
+                    rows.append(i)
+                    cols.append(columns[target])
+        operator = scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                           shape=(len(observations), inputs.shape[1]))
+        return operator.dot(inputs.T).T
+
+    # every (source, target) pair needed, and which observation it is part of
+    obs_index, source_idx, target_idx = [], [], []
+    for i, (sources, targets, _, _) in enumerate(observations):
+        sources, targets = np.broadcast_arrays([pids[k] for k in sources],
+                                               [pids[k] for k in targets])
+        pairs = sorted(set(zip(sources, targets)))
+        obs_index.extend([i] * len(pairs))
+        source_idx.extend(j for j, _ in pairs)
+        target_idx.extend(k for _, k in pairs)
+    source_idx = np.array(source_idx, dtype=int)
+    target_idx = np.array(target_idx, dtype=int)
+
+    if 'F_edges' in trace.varnames:
+        F = trace.get_values('F_edges', burn=burn, thin=thin)
+        edge_position = {(pids[s], pids[t]): i for i, (s, t) in enumerate(model.edges)}
+        # pairs which are not possible flows are always zero
+        F = np.concatenate([F, np.zeros((len(F), 1))], axis=1)
+        columns = [edge_position.get(pair, F.shape[1] - 1)
+                   for pair in zip(source_idx, target_idx)]
+        values = F[:, columns]
+    else:
+        F = trace.get_values('F', burn=burn, thin=thin)
+        values = F[:, source_idx, target_idx]
+    if kind == 'inflow_observations':
+        X = trace.get_values('X', burn=burn, thin=thin)
+        values = values / X[:, target_idx]
+
+    operator = scipy.sparse.csr_matrix(
+        (np.ones(len(obs_index)), (obs_index, np.arange(len(obs_index)))),
+        shape=(len(observations), len(obs_index)))
+    return operator.dot(values.T).T
+
+
+def log_likelihood(model, trace, burn=0, thin=1, **observations):
+    """Normal log-likelihood of the observations for each draw of `trace`.
+
+    Observations are given as keyword arguments, as for
+    `SplitParamModel.set_observations`.
+    """
+    total = 0
+    for kind in KINDS:
+        kind_observations = observations.get(kind)
+        if not kind_observations:
+            continue
+        values = _observed_values(model, trace, kind, kind_observations, burn, thin)
+        data = np.array([obs[-2] for obs in kind_observations], dtype=float)
+        stds = np.array([obs[-1] for obs in kind_observations], dtype=float)
+        total = total + np.sum(-0.5 * ((values - data) / stds)**2
+                               - np.log(stds) - 0.5 * np.log(2 * np.pi), axis=1)
+    return total
+
+
+def _changed(old, new):
+    """Observations only in `old`, and only in `new`."""
+    def key(obs):
+        return _observation_key(obs) + (obs[-2], obs[-1])
+    old_keys = set(key(obs) for obs in old or [])
+    new_keys = set(key(obs) for obs in new or [])
+    return ([obs for obs in old or [] if key(obs) not in new_keys],
+            [obs for obs in new or [] if key(obs) not in old_keys])
+
+
+def _gpdfit(x):
+    """Shape and scale of a generalized Pareto distribution fitted to the
+    sorted positive values `x` (Zhang & Stephens 2009, with the weakly
+    informative prior on the shape used for PSIS)."""
+    n = len(x)
+    prior_bs, prior_k = 3, 10
+    m = 30 + int(np.sqrt(n))
+    bs = 1 - np.sqrt(m / (np.arange(1, m + 1) - 0.5))
+    bs /= prior_bs * x[int(n / 4 + 0.5) - 1]
+    bs += 1 / x[-1]
+    ks = np.log1p(-bs[:, None] * x).mean(axis=1)
+    L = n * (np.log(-bs / ks) - ks - 1)
+    w = 1 / np.exp(L - L[:, None]).sum(axis=1)
+    # drop negligible weights
+    keep = w >= 10 * np.finfo(float).eps
+    w, bs = w[keep] / w[keep].sum(), bs[keep]
+    b = np.sum(bs * w)
+    k = np.log1p(-b * x).mean()
+    sigma = -k / b
+    k = (n * k + prior_k * 0.5) / (n + prior_k)
+    return k, sigma
+
+
+def _gpinv(p, k, sigma):
+    """Quantiles `p` of the generalized Pareto distribution."""
+    if abs(k) < np.finfo(float).eps:
+        return -sigma * np.log1p(-p)
+    return sigma * np.expm1(-k * np.log1p(-p)) / k
+
+
+def psis(log_ratios):
+    """Pareto-smoothed importance sampling.
+
+    The largest ratios are replaced by the expected order statistics of a
+    generalized Pareto distribution fitted to them, and truncated at the
+    largest raw ratio. Returns normalised log weights and the estimated
+    Pareto shape `khat`.
+    """
+    x = np.array(log_ratios, dtype=float)
+    x -= x.max()
+    n = len(x)
+    tail_len = int(np.ceil(min(0.2 * n, 3 * np.sqrt(n))))
+    order = np.argsort(x)
+    cutoff = max(x[order[-tail_len - 1]], np.log(np.finfo(float).tiny))
+    tail = order[x[order] > cutoff]
+    if len(tail) <= 4:
+        khat = np.inf
+    else:
+        exceedances = np.exp(x[tail]) - np.exp(cutoff)
+        khat, sigma = _gpdfit(exceedances)
+        if np.isfinite(khat) and sigma > 0:
+            probs = (np.arange(len(tail)) + 0.5) / len(tail)
+            x[tail] = np.log(_gpinv(probs, khat, sigma) + np.exp(cutoff))
+            x = np.minimum(x, 0)
+    x -= np.log(np.sum(np.exp(x - x.max()))) + x.max()
+    return x, khat
+
+
+def weighted_summary(values, weights, quantiles=(0.025, 0.5, 0.975)):
+    """Weighted means, standard deviations and quantiles of each column of
+    `values` (draws along the first axis)."""
+    values = np.asarray(values, dtype=float)
+    flat = values.reshape(len(values), -1)
+    mean = weights.dot(flat)
+    sd = np.sqrt(weights.dot((flat - mean)**2))
+
+    order = np.argsort(flat, axis=0)
+    columns = np.arange(flat.shape[1])
+    cumulative = np.cumsum(weights[order], axis=0)
+    result = np.empty((len(quantiles), flat.shape[1]))
+    for j, q in enumerate(quantiles):
+        idx = np.minimum((cumulative < q).sum(axis=0), len(flat) - 1)
+        result[j] = flat[order[idx, columns], columns]
+    shape = values.shape[1:]
+    return {
+        'mean': mean.reshape(shape),
+        'sd': sd.reshape(shape),
+        'quantiles': result.reshape((len(quantiles),) + shape),
+    }
+
+
+class Reweighting:
+    """Importance weights of the draws of a trace.
+
+    A refit is advised if the Pareto shape `khat` is above `max_khat` (0.7
+    is the usual limit for reliable PSIS estimates) or the effective sample
+    size is below `min_ess`.
+    """
+    def __init__(self, trace, log_weights, khat, burn=0, thin=1, min_ess=100, max_khat=0.7):
+        self.trace = trace
+        self.burn = burn
+        self.thin = thin
+        self.log_weights = log_weights
+        self.weights = np.exp(log_weights)
+        self.khat = khat
+        self.ess = 1 / np.sum(self.weights**2)
+        self.min_ess = min_ess
+        self.max_khat = max_khat
+
+    @property
+    def needs_refit(self):
+        return self.khat > self.max_khat or self.ess < self.min_ess
+
+    def summarise(self, values, quantiles=(0.025, 0.5, 0.975)):
+        """Weighted summary of `values`, one row per draw after burn/thin."""
+        return weighted_summary(values, self.weights, quantiles)
+
+    def resample(self, draws=None, random_seed=None):
+        """`ArrayTrace` of draws picked in proportion to their weights."""
+        rs = np.random.RandomState(random_seed)
+        if draws is None:
+            draws = len(self.weights)
+        idx = rs.choice(len(self.weights), size=draws, p=self.weights)
+        return ArrayTrace(OrderedDict(
+            (varname, self.trace.get_values(varname, burn=self.burn, thin=self.thin)[idx])
+            for varname in self.trace.varnames))
+
+
+def reweight(model, trace, new_observations, old_observations=None, burn=0, thin=1,
+             min_ess=100, max_khat=0.7):
+    """Importance weights for the draws of `trace` (sampled with
+    `old_observations`) to represent the posterior with `new_observations`.
+
+    The trace needs the flows ('F' or 'F_edges'), and 'X' and 'inputs' if
+    there are inflow-fraction or input observations.
+    """
+    old_observations = old_observations or {}
+    removed, added = {}, {}
+    for kind in KINDS:
+        if kind in new_observations:
+            removed[kind], added[kind] = _changed(old_observations.get(kind),
+                                                  new_observations[kind])
+    log_ratios = (log_likelihood(model, trace, burn, thin, **added) -
+                  log_likelihood(model, trace, burn, thin, **removed))
+    if np.isscalar(log_ratios):
+        # nothing changed
+        num_draws = len(trace.get_values(trace.varnames[0], burn=burn, thin=thin))
+        log_weights, khat = np.full(num_draws, -np.log(num_draws)), -np.inf
+    else:
+        log_weights, khat = psis(log_ratios)
+    return Reweighting(trace, log_weights, khat, burn, thin, min_ess, max_khat)
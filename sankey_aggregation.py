@@ -0,0 +1,92 @@
+"""Precompiled mapping from process flows to Sankey diagram links.
+
+floweaver works out which flows make up each link of a diagram by
+selecting, grouping and bundling the rows of a flow table, which is slow to
+repeat for every sample. But the links only depend on which flows are
+possible, not on their values, so the diagram can be woven once from a
+table with one row for every possible input and flow. This gives a sparse
+(links x flows) matrix, and the link values of any number of samples are
+then found with one matrix multiply:
+
+    aggregation = SankeyAggregation(sdd, processes, possible_inputs)
+    values = aggregation.trace_link_values(trace, burn=100, thin=10)
+    widget = aggregation.to_widget(values.mean(axis=0))
+"""
+
+import attr
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from floweaver import SankeyData, weave
+
+from process_graph import dense_to_edges, edge_list
+
+
+class SankeyAggregation:
+    """Links of a Sankey diagram as a sparse sum of inputs and edge flows.
+
+    The columns of `matrix` are the inputs (in the order of
+    `possible_inputs`) followed by the edge flows (in the order of
+    `process_graph.edge_list`).
+    """
+    def __init__(self, sdd, processes, possible_inputs):
+        self.processes = processes
+        self.possible_inputs = possible_inputs
+        pairs = [('inputs', k) for k in possible_inputs] + edge_list(processes)
+        flows = pd.DataFrame({
+            'source': [source for source, _ in pairs],
+            'target': [target for _, target in pairs],
+            'material': '?',
+            'value': 1.0,
+        }, columns=['source', 'target', 'material', 'value'])
+
+        self.result = weave(sdd, flows)
+        # a flow can be part of several links (e.g. along a bundle's waypoints)
+        columns = [flows.index.get_indexer(link.original_flows) for link in self.result.links]
+        rows = np.repeat(np.arange(len(columns)), [len(c) for c in columns])
+        columns = np.concatenate(columns) if columns else np.zeros(0, dtype=int)
+        self.matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)),
+                                        shape=(len(self.result.links), len(pairs)))
+
+    @property
+    def links(self):
+        return self.result.links
+
+    def link_values(self, inputs, edge_flows):
+        """Link values, shape (num_samples, num_links), from inputs of shape
+        (num_samples, num_inputs) and edge flows of shape (num_samples, num_edges)."""
+        flows = np.hstack([np.atleast_2d(inputs), np.atleast_2d(edge_flows)])
+        return np.asarray(self.matrix.dot(flows.T).T)
+
+    def trace_link_values(self, trace, burn=0, thin=1):
+        """Link values for every draw of a trace holding 'F_edges' or 'F'."""
+        return self.link_values(*self._trace_flows(trace, burn, thin))
+
+    def draw_link_values(self, trace, draws):
+        """Link values for the draws of a trace selected by `draws`, an index
+        or array of indices (a single index gives a single row)."""
+        inputs, edge_flows = self._trace_flows(trace)
+        return self.link_values(inputs[draws], edge_flows[draws])
+
+    def _trace_flows(self, trace, burn=0, thin=1):
+        inputs = trace.get_values('inputs', burn=burn, thin=thin)
+        if 'F_edges' in trace.varnames:
+            edge_flows = trace.get_values('F_edges', burn=burn, thin=thin)
+        else:
+            edge_flows = dense_to_edges(self.processes,
+                                        trace.get_values('F', burn=burn, thin=thin))
+        return inputs, edge_flows
+
+    def sankey_data(self, values, colors=None, min_value=0):
+        """`SankeyData` for one set of link values (and optionally colours),
+        leaving out links with values not above `min_value`."""
+        if colors is None:
+            colors = [link.color for link in self.result.links]
+        links = [attr.evolve(link, value=float(value), color=color)
+                 for link, value, color in zip(self.result.links, values, colors)
+                 if value > min_value]
+        return SankeyData(self.result.nodes, links, self.result.groups,
+                          self.result.ordering)
+
+    def to_widget(self, values, **kwargs):
+        return self.sankey_data(values).to_widget(**kwargs)
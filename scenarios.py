@@ -0,0 +1,91 @@
+"""Fit many observation scenarios against one compiled model.
+
+The model must be built with ``shared_observations=True``, with observations
+covering every quantity used by any scenario. Each scenario is a dictionary
+of keyword arguments for `SplitParamModel.set_observations`:
+
+    scenarios = scenario_grid(flow_observations=[observations1, observations2],
+                              input_observations=[input_observations, []])
+    results = run_scenarios(model, scenarios, njobs=8)
+
+The model is compiled once; worker processes are forked from the parent so
+they share the compiled functions instead of compiling their own.
+
+Each scenario is fitted with `fit_map`, so the results are maximum a
+posteriori points found by L-BFGS, without any measure of uncertainty.
+For posterior distributions, call `set_observations` and then `fit_advi`
+or NUTS sampling for each scenario in turn.
+"""
+
+import itertools
+import multiprocessing
+
+from scipy.optimize import minimize
+from pymc3.blocking import ArrayOrdering, DictToArrayBijection
+
+
+def scenario_grid(**alternatives):
+    """Every combination of the alternative observation lists for each kind.
+
+    e.g. ``scenario_grid(flow_observations=[a, b], input_observations=[c, d])``
+    gives four scenarios.
+    """
+    kinds = sorted(alternatives)
+    return [dict(zip(kinds, choice))
+            for choice in itertools.product(*[alternatives[k] for k in kinds])]
+
+
+def fit_map(model, start=None, maxiter=1000):
+    """Maximum a posteriori point of the model with its current observations.
+
+    Uses L-BFGS on the model's compiled log-probability and gradient.
+    Returns a dictionary with the 'point', its 'logp', the deterministic
+    values there ('X', 'F', ...) and whether the optimiser converged.
+    """
+    functions = model.compiled_functions()
+    if start is None:
+        start = model.model.test_point
+    bijection = DictToArrayBijection(ArrayOrdering(model.model.vars), start)
+
+    def neg_logp_dlogp(x):
+        logp, dlogp = functions.logp_dlogp(bijection.rmap(x))
+        return -logp, -dlogp
+
+    result = minimize(neg_logp_dlogp, bijection.map(start), jac=True,
+                      method='L-BFGS-B', options={'maxiter': maxiter})
+    point = bijection.rmap(result.x)
+    return {
+        'point': point,
+        'logp': -result.fun,
+        'deterministics': functions.deterministics(point),
+        'success': result.success,
+    }
+
+
+# Model shared with forked worker processes
+_model = None
+
+
+def _fit_scenario(job):
+    scenario, start, maxiter = job
+    _model.set_observations(**scenario)
+    return fit_map(_model, start, maxiter)
+
+
+def run_scenarios(model, scenarios, njobs=None, start=None, maxiter=1000):
+    """Fit each scenario with `fit_map`, in parallel; returns a list of results."""
+    global _model
+    if not model.shared_observations:
+        raise ValueError('Model was not built with shared_observations')
+
+    # compile before forking, so the workers inherit the compiled functions
+    model.compiled_functions()
+    jobs = [(scenario, start, maxiter) for scenario in scenarios]
+    _model = model
+    try:
+        if njobs == 1:
+            return [_fit_scenario(job) for job in jobs]
+        with multiprocessing.get_context('fork').Pool(njobs) as pool:
+            return pool.map(_fit_scenario, jobs)
+    finally:
+        _model = None
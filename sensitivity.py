@@ -0,0 +1,152 @@
+"""Global and local sensitivity of flows to process parameters and inputs.
+
+Everything is evaluated with the batched NumPy `ForwardModel`, so the
+many evaluations needed are solved a chunk of samples at a time rather
+than one by one through the Theano model.
+
+Sobol indices say how much of the prior variance of each flow is due to
+the parameters of each process (taken together, e.g. all the shares of
+one allocation) and to each input:
+
+    forward = ForwardModel(define_processes(), input_defs, param_defs)
+    indices = sobol_indices(forward, num_samples=20000, random_state=1)
+    rank_factors(indices, 'OBFS', 'CCS')[:5]
+
+`flow_jacobian` gives local derivatives of every flow with respect to
+every parameter and input, at each of a batch of points.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from process_graph import edge_list, process_index
+
+
+def _flows(forward, coeffs, inputs):
+    return forward.edge_flows(coeffs, forward.throughputs(coeffs, inputs))
+
+
+def sobol_indices(forward, num_samples=10000, include_inputs=True, random_state=None,
+                  chunk_size=5000):
+    """First-order and total Sobol indices of every edge flow.
+
+    Uses two independent prior samples A and B, and for each factor the
+    sample A with that factor taken from B, with the estimators of
+    Saltelli et al. (2010) for first-order and Jansen (1999) for total
+    indices. The factors are the parameters of each process and, with
+    `include_inputs`, each input ('inputs:<pid>').
+
+    Returns a dictionary with 'factors', 'edges', 'variance' (of each
+    flow), and 'first_order' and 'total' of shape (factors, edges).
+    Flows with no variance (such as fixed or always-zero flows) have NaN
+    indices.
+    """
+    if random_state is None or isinstance(random_state, int):
+        random_state = np.random.RandomState(random_state)
+    pids = process_index(forward.processes)
+
+    # edges whose coefficients belong to each process with parameters;
+    # processes whose coefficients are fixed (e.g. single-output
+    # allocations) are left out, as they cannot contribute any variance
+    trial = forward.transfer_coefficients(forward.sample_params(2, random_state))
+    factors = OrderedDict()
+    for group_pids, _ in forward.groups:
+        for pid in group_pids:
+            columns = np.nonzero(forward.edge_sources == pids[pid])[0]
+            if np.any(trial[0, columns] != trial[1, columns]):
+                factors[pid] = columns
+    if include_inputs:
+        for i, pid in enumerate(forward.possible_inputs):
+            factors['inputs:{}'.format(pid)] = i
+
+    E = forward.num_edges
+    total_sum, total_sumsq = np.zeros(E), np.zeros(E)
+    first = np.zeros((len(factors), E))
+    total = np.zeros((len(factors), E))
+    for start in range(0, num_samples, chunk_size):
+        n = min(chunk_size, num_samples - start)
+        coeffs_A = forward.transfer_coefficients(forward.sample_params(n, random_state))
+        coeffs_B = forward.transfer_coefficients(forward.sample_params(n, random_state))
+        inputs_A = forward.sample_inputs(n, random_state)
+        inputs_B = forward.sample_inputs(n, random_state)
+        f_A = _flows(forward, coeffs_A, inputs_A)
+        f_B = _flows(forward, coeffs_B, inputs_B)
+        total_sum += f_A.sum(axis=0) + f_B.sum(axis=0)
+        total_sumsq += (f_A**2).sum(axis=0) + (f_B**2).sum(axis=0)
+
+        for i, (name, columns) in enumerate(factors.items()):
+            coeffs, inputs = coeffs_A, inputs_A
+            if name.startswith('inputs:'):
+                inputs = inputs_A.copy()
+                inputs[:, columns] = inputs_B[:, columns]
+            else:
+                coeffs = coeffs_A.copy()
+                coeffs[:, columns] = coeffs_B[:, columns]
+            f_AB = _flows(forward, coeffs, inputs)
+            first[i] += np.sum(f_B * (f_AB - f_A), axis=0)
+            total[i] += np.sum((f_A - f_AB)**2, axis=0)
+
+    mean = total_sum / (2 * num_samples)
+    variance = total_sumsq / (2 * num_samples) - mean**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # allow for rounding error in the variance of constant flows
+        scale = np.where(variance > 1e-10 * mean**2, 1 / variance, np.nan)
+    return {
+        'factors': list(factors),
+        'edges': edge_list(forward.processes),
+        'variance': variance,
+        'first_order': first / num_samples * scale,
+        'total': total / (2 * num_samples) * scale,
+    }
+
+
+def rank_factors(indices, source, target, index='total'):
+    """Factors sorted by their Sobol index for the flow `source` -> `target`."""
+    column = indices['edges'].index((source, target))
+    values = indices[index][:, column]
+    order = np.argsort(-np.nan_to_num(values))
+    return [(indices['factors'][i], values[i]) for i in order]
+
+
+def flow_jacobian(forward, params, inputs, eps=1e-6):
+    """Derivatives of every edge flow with respect to every parameter and
+    input, at each of a batch of points.
+
+    `params` is a dictionary of pid -> (size, nparams), as from
+    `ForwardModel.sample_params` or the 'param_<pid>' values of a trace,
+    and `inputs` has shape (size, num_inputs). Parameters are on the scale
+    `ForwardModel` uses (e.g. logit efficiencies, allocation shares), and
+    each is perturbed on its own. Central differences with relative step
+    `eps` are evaluated for all points and directions as one batch.
+
+    Returns a dictionary with 'labels' ((pid, index) of each parameter,
+    and ('inputs', pid) of each input), 'edges' and 'jacobian' of shape
+    (size, edges, labels).
+    """
+    pids = list(params)
+    widths = [params[pid].shape[1] for pid in pids]
+    labels = ([(pid, j) for pid, width in zip(pids, widths) for j in range(width)] +
+              [('inputs', pid) for pid in forward.possible_inputs])
+    x = np.concatenate([params[pid] for pid in pids] + [inputs], axis=1)
+    size, P = x.shape
+
+    steps = eps * np.maximum(1.0, np.abs(x))
+    perturbed = np.repeat(x[:, None, :], 2 * P, axis=1)
+    diagonal = np.arange(P)
+    perturbed[:, diagonal, diagonal] += steps
+    perturbed[:, P + diagonal, diagonal] -= steps
+    perturbed = perturbed.reshape(-1, P)
+
+    offsets = np.cumsum([0] + widths)
+    batch_params = OrderedDict((pid, perturbed[:, offsets[i]:offsets[i + 1]])
+                               for i, pid in enumerate(pids))
+    coeffs = forward.transfer_coefficients(batch_params)
+    flows = _flows(forward, coeffs, perturbed[:, offsets[-1]:]).reshape(size, 2, P, -1)
+
+    jacobian = (flows[:, 0] - flows[:, 1]) / (2 * steps[:, :, None])
+    return {
+        'labels': labels,
+        'edges': edge_list(forward.processes),
+        'jacobian': jacobian.transpose(0, 2, 1),
+    }
@@ -0,0 +1,133 @@
+"""Random process networks for scaling tests.
+
+The networks are built from the same process types as the steel model: a
+chain of layers of production stages, each an `EfficiencyProcess` (with
+losses going to the sink 'L') followed by a `DirichletAllocationProcess`
+sending its product on to stages in the next layer; the last layer feeds
+`SinkProcess` end uses. Recycling loops are added by sending part of a
+later stage's product to a scrap preparation stage, which feeds back into
+an earlier layer.
+
+    network = generate_network(layers=10, width=250, loops=50, random_state=1)
+    model = SplitParamModel(network.processes, network.input_defs, network.param_defs,
+                            flow_observations=network.flow_observations)
+
+A network has ``2 * layers * width + width + 2 * loops + 1`` processes.
+"""
+
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from forward_model import ForwardModel
+from leontief_model import (
+    EfficiencyProcess,
+    DirichletAllocationProcess as AllocationProcess,
+    SinkProcess
+)
+from priors import dir_prior, logit, logit_range_sd
+from process_graph import edge_list
+
+
+SyntheticNetwork = namedtuple('SyntheticNetwork', [
+    'processes', 'param_defs', 'input_defs',
+    'flow_observations', 'input_observations', 'truth'])
+
+
+def _stage(pid, product_outputs, processes):
+    processes[pid] = EfficiencyProcess('Stage {}'.format(pid), ['{}P'.format(pid), 'L'])
+    processes['{}P'.format(pid)] = AllocationProcess('Product of {}'.format(pid),
+                                                     product_outputs)
+
+
+def generate_network(layers=5, width=10, fan_out=3, loops=2, num_flow_observations=None,
+                     num_input_observations=None, observation_sd=0.1, random_state=None):
+    """Random layered process network with recycling loops.
+
+    `fan_out` is the largest number of stages in the next layer that each
+    stage supplies. Observations of flows and inputs are drawn from one
+    sample of the prior (returned as `truth`), with relative standard
+    deviation `observation_sd`; by default a tenth of the flows and half of
+    the inputs are observed.
+    """
+    if random_state is None or isinstance(random_state, int):
+        random_state = np.random.RandomState(random_state)
+    rs = random_state
+
+    stage_ids = [['E{}_{}'.format(layer, j) for j in range(width)] for layer in range(layers)]
+    sink_ids = ['U{}'.format(j) for j in range(width)]
+
+    # where each stage's product goes
+    outputs = OrderedDict()
+    for layer in range(layers):
+        targets = stage_ids[layer + 1] if layer + 1 < layers else sink_ids
+        for pid in stage_ids[layer]:
+            k = rs.randint(1, min(fan_out, len(targets)) + 1)
+            outputs[pid] = [str(x) for x in rs.choice(targets, size=k, replace=False)]
+
+    # recycling loops: a stage in a later layer sends scrap back to a stage
+    # upstream of it, found by walking back along a random path
+    scrap_feeds = OrderedDict()
+    if layers > 1:
+        for i in range(loops):
+            scrap_id = 'S{}'.format(i)
+            later = rs.randint(1, layers)
+            pid = source = str(rs.choice(stage_ids[later]))
+            for _ in range(rs.randint(1, later + 1)):
+                suppliers = [p for p in outputs if pid in outputs[p]]
+                if not suppliers:
+                    break
+                pid = str(rs.choice(suppliers))
+            outputs[source].append(scrap_id)
+            scrap_feeds[scrap_id] = [pid]
+
+    processes = {'L': SinkProcess('Loss')}
+    for pid in sink_ids:
+        processes[pid] = SinkProcess('End use {}'.format(pid))
+    for pid, product_outputs in list(outputs.items()) + list(scrap_feeds.items()):
+        _stage(pid, product_outputs, processes)
+    processes = OrderedDict(sorted(processes.items()))
+
+    param_defs = {}
+    for pid, product_outputs in list(outputs.items()) + list(scrap_feeds.items()):
+        efficiency = rs.uniform(0.8, 0.98)
+        spread = rs.uniform(0.005, 0.02)
+        param_defs[pid] = (logit(efficiency),
+                           logit_range_sd(efficiency - spread, min(efficiency + spread, 0.999)))
+        if len(product_outputs) > 1:
+            shares = rs.dirichlet(np.full(len(product_outputs), 2.0))
+            # scrap is a small share of a stage's product
+            shares = np.array([share / 10 if target in scrap_feeds else share
+                               for target, share in zip(product_outputs, shares)])
+            param_defs['{}P'.format(pid)] = dir_prior(shares, concentration=rs.uniform(20, 100))
+
+    input_defs = OrderedDict((pid, float(rs.uniform(100, 1000))) for pid in stage_ids[0])
+
+    # observations from one sample of the prior
+    forward = ForwardModel(processes, input_defs, param_defs)
+    truth = forward.sample_prior(1, random_state=rs, dense=False).point(0)
+    edges = edge_list(processes)
+
+    # only flows which are not zero can be observed with a relative error
+    observable = np.nonzero(truth['F_edges'] > 0)[0]
+    if num_flow_observations is None:
+        num_flow_observations = len(edges) // 10
+    num_flow_observations = min(num_flow_observations, len(observable))
+    if num_input_observations is None:
+        num_input_observations = len(input_defs) // 2
+    flow_observations = []
+    for i in rs.choice(observable, size=num_flow_observations, replace=False):
+        source, target = edges[i]
+        value = truth['F_edges'][i]
+        flow_observations.append(([source], [target],
+                                  value * (1 + observation_sd * rs.randn()),
+                                  observation_sd * value))
+    input_observations = []
+    for i in rs.choice(len(input_defs), size=num_input_observations, replace=False):
+        value = truth['inputs'][i]
+        input_observations.append(([forward.possible_inputs[i]],
+                                   value * (1 + observation_sd * rs.randn()),
+                                   observation_sd * value))
+
+    return SyntheticNetwork(processes, param_defs, input_defs,
+                            flow_observations, input_observations, truth)
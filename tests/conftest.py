@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pymc3 as pm
+import pytest
+from pymc3.backends.base import MultiTrace
+
+# the modules live at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+@pytest.fixture
+def multitrace():
+    """Factory for pymc3 MultiTraces holding given arrays (varname -> draws)."""
+    def make(values, chain=0):
+        with pm.Model() as model:
+            for varname, array in values.items():
+                pm.Flat(varname, shape=array.shape[1:])
+        strace = pm.backends.NDArray(model=model)
+        num_draws = len(next(iter(values.values())))
+        strace.setup(num_draws, chain)
+        for i in range(num_draws):
+            strace.record({varname: array[i] for varname, array in values.items()})
+        return MultiTrace([strace])
+    return make
@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pymc3 as pm
+
+import binary_trace
+from binary_trace import BinaryTrace, convert_text_trace
+
+
+def _values(num_draws, seed):
+    rs = np.random.RandomState(seed)
+    return {'x': rs.randn(num_draws, 2, 3), 'y': rs.randn(num_draws)}
+
+
+def _model():
+    with pm.Model() as model:
+        pm.Flat('x', shape=(2, 3))
+        pm.Flat('y')
+    return model
+
+
+def _record(trace, values, chain):
+    num_draws = len(values['y'])
+    trace.setup(num_draws, chain)
+    for i in range(num_draws):
+        trace.record({'x': values['x'][i], 'y': values['y'][i]})
+    trace.close()
+
+
+def test_round_trip_across_chunks(tmpdir):
+    name = str(tmpdir.join('trace'))
+    chains = [_values(25, 0), _values(18, 1)]
+    trace = BinaryTrace(name, model=_model(), chunk_size=7)
+    for chain, values in enumerate(chains):
+        _record(trace, values, chain)
+
+    loaded = binary_trace.load(name)
+    assert sorted(loaded.chains) == [0, 1]
+    for chain, values in enumerate(chains):
+        x = loaded.get_values('x', chains=chain, combine=False)
+        assert isinstance(x, np.memmap)
+        np.testing.assert_array_equal(x, values['x'])
+        np.testing.assert_array_equal(
+            loaded.get_values('y', burn=5, thin=3, chains=chain, combine=False),
+            values['y'][5::3])
+        np.testing.assert_array_equal(loaded._straces[chain].point(9)['x'], values['x'][9])
+    np.testing.assert_array_equal(loaded.get_values('y', burn=4),
+                                  np.concatenate([chains[0]['y'][4:], chains[1]['y'][4:]]))
+
+
+def test_draws_are_readable_while_sampling_and_appended(tmpdir):
+    name = str(tmpdir.join('trace'))
+    values = _values(20, 2)
+    trace = BinaryTrace(name, model=_model(), chunk_size=7)
+    trace.setup(10, 0)
+    for i in range(10):
+        trace.record({'x': values['x'][i], 'y': values['y'][i]})
+    # buffered draws are written before reading
+    assert len(trace) == 10
+    np.testing.assert_array_equal(trace.get_values('y', burn=2, thin=2), values['y'][2:10:2])
+    trace.close()
+
+    # sampling the same chain again appends to it
+    trace = BinaryTrace(name, model=_model(), chunk_size=7)
+    trace.setup(10, 0)
+    for i in range(10, 20):
+        trace.record({'x': values['x'][i], 'y': values['y'][i]})
+    trace.close()
+    np.testing.assert_array_equal(binary_trace.load(name)['x'], values['x'])
+
+
+def test_convert_text_trace(tmpdir):
+    values = _values(12, 3)
+    text_name = tmpdir.mkdir('text')
+    columns = ['x__{}_{}'.format(i, j) for i in range(2) for j in range(3)] + ['y']
+    rows = np.hstack([values['x'].reshape(12, 6), values['y'][:, None]])
+    with open(os.path.join(str(text_name), 'chain-0.csv'), 'w') as f:
+        f.write(','.join(columns) + '\n')
+        for row in rows:
+            f.write(','.join(repr(v) for v in row) + '\n')
+
+    trace = convert_text_trace(str(text_name), str(tmpdir.join('binary')), chunk_size=5)
+    # the CSV parser may round the last bit
+    np.testing.assert_allclose(trace['x'], values['x'], rtol=1e-14)
+    np.testing.assert_allclose(trace['y', 3::2], values['y'][3::2], rtol=1e-14)
@@ -0,0 +1,40 @@
+import numpy as np
+import pymc3 as pm
+
+from flow_statistics import hpd_intervals, link_measures, summarise
+
+
+def _values():
+    rs = np.random.RandomState(0)
+    values = rs.gamma(2, size=(200, 4))
+    # a link which is zero in some draws
+    values[::4, 3] = 0
+    return values
+
+
+def test_hpd_intervals_match_pymc3():
+    values = _values()
+    lower, upper = hpd_intervals(values, alpha=0.1)
+    for j in range(values.shape[1]):
+        np.testing.assert_allclose([lower[j], upper[j]], pm.hpd(values[:, j], alpha=0.1))
+
+    # extra dimensions are kept
+    lower, upper = hpd_intervals(values.reshape(200, 2, 2))
+    assert lower.shape == upper.shape == (2, 2)
+    np.testing.assert_allclose(lower[1, 0], pm.hpd(values[:, 2])[0])
+
+
+def test_summarise_and_link_measures():
+    values = _values()
+    summary = summarise(values, quantiles=(0.1, 0.9))
+    # every draw counts, including those where a link is zero
+    np.testing.assert_allclose(summary['mean'], values.mean(axis=0))
+    np.testing.assert_allclose(summary['sd'], values.std(axis=0))
+    np.testing.assert_allclose(summary['quantiles'], np.percentile(values, [10, 90], axis=0))
+    np.testing.assert_allclose(summary['hpd_width'], summary['hpd_upper'] - summary['hpd_lower'])
+
+    measures = link_measures(summary)
+    assert len(measures) == 4
+    for j, measure in enumerate(measures):
+        assert measure == {k: summary[k][j]
+                           for k in ['mean', 'sd', 'hpd_lower', 'hpd_upper', 'hpd_width']}
@@ -0,0 +1,55 @@
+import numpy as np
+
+from forward_model import ForwardModel
+from priors import param_defs
+from steel_processes import define_processes
+from synthetic_networks import generate_network
+
+
+INPUT_DEFS = {'BF': 5000, 'DR': 300, 'SP': 1000, 'IFC': 300}
+
+
+def _dense_solve(forward, coeffs, inputs):
+    """Throughputs from a dense solve of (I - A) X = b for each sample."""
+    Np = len(forward.processes)
+    A = np.zeros((len(coeffs), Np, Np))
+    A[:, forward.edge_targets, forward.edge_sources] = coeffs
+    b = np.zeros((len(coeffs), Np))
+    b[:, forward.input_idx] = inputs
+    return np.linalg.solve(np.eye(Np) - A, b[:, :, None])[:, :, 0]
+
+
+def _check_throughputs(forward, size=20):
+    rs = np.random.RandomState(1)
+    coeffs = forward.transfer_coefficients(forward.sample_params(size, rs))
+    inputs = forward.sample_inputs(size, rs)
+    np.testing.assert_allclose(forward.throughputs(coeffs, inputs),
+                               _dense_solve(forward, coeffs, inputs), rtol=1e-10, atol=1e-8)
+
+
+def test_throughputs_match_dense_solve():
+    _check_throughputs(ForwardModel(define_processes(), INPUT_DEFS, param_defs))
+
+
+def test_throughputs_with_recycling_loops():
+    network = generate_network(layers=4, width=6, loops=4, random_state=2)
+    _check_throughputs(ForwardModel(network.processes, network.input_defs,
+                                    network.param_defs))
+
+
+def test_sample_prior_layout_follows_edge_flows():
+    forward = ForwardModel(define_processes(), INPUT_DEFS, param_defs, edge_flows=True)
+    trace = forward.sample_prior(30, random_state=3, chunk_size=7)
+    assert 'F_edges' in trace and 'F' not in trace
+    assert trace['F_edges'].shape == (30, forward.num_edges)
+    np.testing.assert_allclose(
+        trace['F_edges'],
+        trace['TCs_edges'] * trace['X'][:, forward.edge_sources])
+
+    # dense by default, like the default SplitParamModel trace
+    dense = ForwardModel(define_processes(), INPUT_DEFS, param_defs).sample_prior(
+        30, random_state=3, chunk_size=7)
+    assert 'F' in dense and 'F_edges' not in dense
+    np.testing.assert_allclose(dense['F'], forward.dense_matrix(trace['F_edges']))
+    override = forward.sample_prior(30, random_state=3, chunk_size=7, dense=True)
+    np.testing.assert_allclose(override['F'], dense['F'])
@@ -0,0 +1,96 @@
+import numpy as np
+import pymc3 as pm
+import pytest
+
+from laplace import LaplaceApproximation, laplace_approximation
+from leontief_model import SplitParamModel
+from model_cache import CompiledModelFunctions
+from synthetic_networks import generate_network
+
+
+SDS = np.array([0.5, 2.0])
+MEANS = np.array([1.0, 2.0])
+
+
+class _GaussianModel:
+    """Stands in for a `SplitParamModel`: x ~ N(MEANS, SDS), y ~ N(sum(x), 1)
+    with y observed as 0, so the posterior is Gaussian."""
+    def __init__(self):
+        with pm.Model() as self.model:
+            x = pm.Normal('x', mu=MEANS, sd=SDS, shape=2)
+            pm.Normal('y', mu=x.sum(), sd=1, observed=0.0)
+            pm.Deterministic('total', x.sum())
+        self._functions = None
+
+    def compiled_functions(self):
+        if self._functions is None:
+            self._functions = CompiledModelFunctions(self.model)
+        return self._functions
+
+
+def _posterior():
+    precision = np.diag(1 / SDS**2) + np.ones((2, 2))
+    mean = np.linalg.solve(precision, MEANS / SDS**2)
+    return mean, precision
+
+
+def test_laplace_matches_gaussian_posterior():
+    mean, precision = _posterior()
+    approx = laplace_approximation(_GaussianModel())
+    np.testing.assert_allclose(approx.mean, mean, rtol=1e-5)
+    np.testing.assert_allclose(approx.precision, precision, rtol=1e-5)
+    assert approx.num_clipped == 0
+    np.testing.assert_allclose(approx.stds['x'], np.sqrt(np.diag(np.linalg.inv(precision))),
+                               rtol=1e-5)
+
+
+def test_unknown_hessian():
+    with pytest.raises(ValueError):
+        laplace_approximation(_GaussianModel(), hessian='bfgs')
+
+
+def test_samples_have_laplace_covariance():
+    mean, precision = _posterior()
+    model = _GaussianModel()
+    point = {'x': mean}
+    approx = LaplaceApproximation(model, {'point': point}, precision)
+    trace = approx.sample(4000, random_seed=1)
+    x = trace['x']
+    np.testing.assert_allclose(x.mean(axis=0), mean, atol=0.05)
+    np.testing.assert_allclose(np.cov(x.T), np.linalg.inv(precision), rtol=0.1, atol=0.01)
+    np.testing.assert_allclose(trace['total'], x.sum(axis=1))
+
+
+def test_non_concave_directions_are_clipped():
+    model = _GaussianModel()
+    approx = LaplaceApproximation(model, {'point': {'x': MEANS}}, np.diag([1.0, -1.0]),
+                                  min_precision=1e-2)
+    assert approx.num_clipped == 1
+    np.testing.assert_allclose(approx.precision, np.diag([1.0, 1e-2]))
+
+
+def test_split_param_model_laplace_sample(tmpdir, monkeypatch):
+    # the compiled functions are cached under ./compiled
+    monkeypatch.chdir(tmpdir)
+    network = generate_network(layers=2, width=3, loops=1, random_state=0)
+    model = SplitParamModel(network.processes, network.input_defs, network.param_defs,
+                            flow_observations=network.flow_observations,
+                            input_observations=network.input_observations)
+    approx = model.laplace()
+    assert approx.map['success']
+    assert approx.num_clipped == 0
+    assert tmpdir.join('compiled').check(dir=True)
+
+    trace = approx.sample(400, random_seed=1)
+    varnames = [v.name for v in model.model.vars]
+    for varname in varnames + ['X', 'F']:
+        assert len(trace[varname]) == 400
+    x = np.array([approx.bijection.map({v: trace[v][i] for v in varnames})
+                  for i in range(400)])
+    # the sample mean is within 4 standard errors of the approximation's
+    standard_errors = np.sqrt(np.diag(approx.cov) / 400)
+    assert np.all(np.abs(x.mean(axis=0) - approx.mean) < 4 * standard_errors)
+
+    # the deterministics are those of each drawn point
+    point = {v: trace[v][7] for v in varnames}
+    np.testing.assert_allclose(trace['X'][7], model.model.fastfn(model.model['X'])(point))
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import theano
+
+from leontief_model import SplitParamModel
+from priors import param_defs
+from steel_processes import define_processes
+
+
+INPUT_DEFS = {'BF': 5000, 'DR': 300, 'SP': 1000, 'IFC': 300}
+
+
+def _logp_and_throughputs(model, point):
+    pm_model = model.model
+    fn = theano.function(pm_model.vars, [pm_model.logpt, pm_model['X']],
+                         on_unused_input='ignore')
+    return fn(*[point[v.name] for v in pm_model.vars])
+
+
+@pytest.fixture(scope='module')
+def default_model():
+    return SplitParamModel(define_processes(), INPUT_DEFS, param_defs)
+
+
+def _random_point(model, seed=0):
+    rs = np.random.RandomState(seed)
+    return {name: value + 0.3 * rs.randn(*np.shape(value))
+            for name, value in model.model.test_point.items()}
+
+
+def _packed_point(packed, default_point):
+    """The point of the packed model with the parameter values of `default_point`."""
+    point = {}
+    for var in packed.model.vars:
+        value = packed.model.test_point[var.name]
+        rows = [(pid, row) for pid, (name, row) in packed.param_index.items()
+                if var.name.startswith(name + '_') or var.name == name]
+        if not rows:
+            point[var.name] = default_point[var.name]
+            continue
+        name = packed.param_index[rows[0][0]][0]
+        suffix = var.name[len(name):]
+        rows.sort(key=lambda pid_row: pid_row[1])
+        point[var.name] = np.reshape(
+            [default_point['param_{}{}'.format(pid, suffix)] for pid, _ in rows], value.shape)
+    return point
+
+
+def test_block_solver_matches_default(default_model):
+    blocks = SplitParamModel(define_processes(), INPUT_DEFS, param_defs, solver='blocks')
+    for point in (default_model.model.test_point, _random_point(default_model)):
+        logp, X = _logp_and_throughputs(default_model, point)
+        blocks_logp, blocks_X = _logp_and_throughputs(blocks, point)
+        np.testing.assert_allclose(blocks_logp, logp)
+        np.testing.assert_allclose(blocks_X, X)
+
+
+def test_packed_params_match_default(default_model):
+    packed = SplitParamModel(define_processes(), INPUT_DEFS, param_defs, packed_params=True)
+    assert len(packed.model.vars) < len(default_model.model.vars)
+    for point in (default_model.model.test_point, _random_point(default_model)):
+        logp, X = _logp_and_throughputs(default_model, point)
+        packed_logp, packed_X = _logp_and_throughputs(packed, _packed_point(packed, point))
+        np.testing.assert_allclose(packed_logp, logp)
+        np.testing.assert_allclose(packed_X, X)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import theano
+import theano.tensor as T
+
+from leontief_op import LeontiefSolve, leontief_solve
+
+
+@pytest.fixture(autouse=True)
+def no_test_values():
+    # importing pymc3 turns on test values, which these graphs do not have
+    with theano.change_flags(compute_test_value='off'):
+        yield
+
+
+def _system(rs, shape, Np=5):
+    # column sums below one, as for transfer coefficients, so I - A is invertible
+    A = rs.rand(*(shape + (Np, Np))) / Np
+    b = rs.rand(*(shape + (Np,)))
+    return A, b
+
+
+def test_solve_matches_numpy():
+    rs = np.random.RandomState(0)
+    A, b = _system(rs, ())
+    A_stack, b_stack = _system(rs, (3,))
+    Av, bv = T.matrix(), T.vector()
+    As, bs = T.tensor3(), T.matrix()
+    fn = theano.function([Av, bv, As, bs], [leontief_solve(Av, bv),
+                                            LeontiefSolve(trans=True)(Av, bv),
+                                            leontief_solve(As, bs)])
+    x, x_trans, x_stack = fn(A, b, A_stack, b_stack)
+    I = np.eye(len(b))
+    np.testing.assert_allclose(x, np.linalg.solve(I - A, b))
+    np.testing.assert_allclose(x_trans, np.linalg.solve((I - A).T, b))
+    np.testing.assert_allclose(x_stack, np.linalg.solve(I - A_stack, b_stack[:, :, None])[:, :, 0])
+
+
+def test_adjoint_gradient():
+    rs = np.random.RandomState(1)
+    for shape in [(), (3,)]:
+        A, b = _system(rs, shape)
+        theano.gradient.verify_grad(LeontiefSolve(), [A, b], rng=rs)
+        theano.gradient.verify_grad(LeontiefSolve(trans=True), [A, b], rng=rs)
+
+
+def test_gradient_matches_inverse():
+    rs = np.random.RandomState(2)
+    A, b = _system(rs, ())
+    w = rs.rand(len(b))
+    Av, bv = T.matrix(), T.vector()
+    I = T.eye(len(b))
+    inverse = T.dot(T.nlinalg.matrix_inverse(I - Av), bv)
+    loss_op, loss_inv = T.dot(w, leontief_solve(Av, bv)), T.dot(w, inverse)
+    fn = theano.function([Av, bv], T.grad(loss_op, [Av, bv]) + T.grad(loss_inv, [Av, bv]))
+    gA_op, gb_op, gA_inv, gb_inv = fn(A, b)
+    np.testing.assert_allclose(gA_op, gA_inv, rtol=1e-8)
+    np.testing.assert_allclose(gb_op, gb_inv, rtol=1e-8)
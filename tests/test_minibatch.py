@@ -0,0 +1,34 @@
+import numpy as np
+import theano
+
+from leontief_model import SplitParamModel, _padded_rows
+from synthetic_networks import generate_network
+
+
+def test_padded_rows():
+    obs_index = np.array([0, 0, 1, 2, 2, 2])
+    sources = np.array([5, 6, 7, 8, 9, 10])
+    used, (rows,) = _padded_rows(obs_index, 4, sources)
+    np.testing.assert_array_equal(used, [[1, 1, 0], [1, 0, 0], [1, 1, 1], [0, 0, 0]])
+    np.testing.assert_array_equal(rows * used, [[5, 6, 0], [7, 0, 0], [8, 9, 10], [0, 0, 0]])
+
+
+def test_minibatch_likelihood_is_unbiased():
+    network = generate_network(layers=2, width=3, loops=1, num_flow_observations=6,
+                               random_state=0)
+    model = SplitParamModel(network.processes, network.input_defs, network.param_defs,
+                            flow_observations=network.flow_observations,
+                            input_observations=network.input_observations,
+                            minibatch_size=2)
+    pm_model = model.model
+    logp = theano.function(pm_model.vars, pm_model.logpt, on_unused_input='ignore')
+    inputs = [pm_model.test_point[v.name] for v in pm_model.vars]
+    full = logp(*inputs)
+
+    model._random.seed(1)
+    model.use_minibatches.set_value(1)
+    estimates = np.array([logp(*inputs) for _ in range(2000)])
+    model.use_minibatches.set_value(0)
+    assert len(np.unique(estimates)) > 1
+    assert abs(estimates.mean() - full) < 4 * estimates.std() / np.sqrt(len(estimates))
+    assert logp(*inputs) == full
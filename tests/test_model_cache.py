@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+import pymc3 as pm
+
+import model_cache
+from leontief_model import SplitParamModel
+from model_cache import CompiledModelFunctions, load_or_compile, model_cache_key
+from steel_processes import define_processes
+from synthetic_networks import generate_network
+
+
+def test_key_depends_on_definitions():
+    processes = define_processes()
+    key = model_cache_key(processes, inputs={'BF': 5000}, solver='adjoint')
+    assert key == model_cache_key(processes, inputs={'BF': 5000}, solver='adjoint')
+    assert key != model_cache_key(processes, inputs={'BF': 4000}, solver='adjoint')
+    assert key != model_cache_key(processes, inputs={'BF': 5000}, solver='dense')
+
+
+def test_key_depends_on_module_sources(tmpdir, monkeypatch):
+    processes = define_processes()
+    key = model_cache_key(processes, solver='adjoint')
+    # stand in a changed copy of the sources
+    tmpdir.join('model_cache.py').write('# changed')
+    for name in model_cache.GRAPH_MODULES:
+        if name != 'model_cache.py':
+            tmpdir.join(name).write('')
+    source_hash = model_cache.source_hash
+    monkeypatch.setattr(model_cache, 'source_hash', lambda: source_hash(str(tmpdir)))
+    assert key != model_cache_key(processes, solver='adjoint')
+
+
+def test_load_or_compile_round_trip(tmpdir):
+    with pm.Model() as model:
+        x = pm.Normal('x', mu=1, sd=2)
+        pm.Deterministic('y', 3 * x)
+    cache_dir = str(tmpdir.join('compiled'))
+    compiled = load_or_compile(model, 'key', cache_dir)
+    assert os.listdir(cache_dir) == ['key.pickle']
+    loaded = load_or_compile(model, 'key', cache_dir)
+    assert loaded is not compiled
+
+    point = {'x': np.array(0.5)}
+    for functions in (compiled, loaded):
+        logp, dlogp = functions.logp_dlogp(point)
+        np.testing.assert_allclose(logp, -0.5 * (0.5 - 1)**2 / 4 - np.log(2 * np.sqrt(2 * np.pi)))
+        np.testing.assert_allclose(dlogp, [-(0.5 - 1) / 4])
+        assert functions.deterministics(point)['y'] == 1.5
+    assert isinstance(loaded, CompiledModelFunctions)
+
+
+def _small_model():
+    network = generate_network(layers=2, width=3, loops=1, random_state=0)
+    return SplitParamModel(network.processes, network.input_defs, network.param_defs,
+                           flow_observations=network.flow_observations,
+                           input_observations=network.input_observations)
+
+
+def test_split_param_model_round_trip(tmpdir):
+    model = _small_model()
+    cache_dir = str(tmpdir.join('compiled'))
+    compiled = model.compiled_functions(cache_dir)
+    assert model.compiled_functions(cache_dir) is compiled
+    point = model.model.test_point
+    logp, dlogp = compiled.logp_dlogp(point)
+    np.testing.assert_allclose(logp, model.model.logp(point))
+
+    # with some BLAS setups the functions cannot be pickled, and then
+    # nothing (not even a partial file) is left in the cache
+    files = os.listdir(cache_dir)
+    assert files in ([], ['{}.pickle'.format(model.cache_key)])
+    if files:
+        loaded = load_or_compile(model.model, model.cache_key, cache_dir)
+        assert loaded is not compiled
+        loaded_logp, loaded_dlogp = loaded.logp_dlogp(point)
+        np.testing.assert_allclose(loaded_logp, logp)
+        np.testing.assert_allclose(loaded_dlogp, dlogp)
+        np.testing.assert_allclose(loaded.deterministics(point)['X'],
+                                   compiled.deterministics(point)['X'])
+
+
+def test_unpicklable_functions_are_not_cached(tmpdir, monkeypatch):
+    def dump(obj, f, protocol=None):
+        f.write(b'partial')
+        raise TypeError("cannot pickle 'fortran' object")
+    monkeypatch.setattr(model_cache.pickle, 'dump', dump)
+
+    with pm.Model() as model:
+        pm.Normal('x', mu=1, sd=2)
+    cache_dir = str(tmpdir.join('compiled'))
+    functions = load_or_compile(model, 'key', cache_dir)
+    assert isinstance(functions, CompiledModelFunctions)
+    assert os.listdir(cache_dir) == []
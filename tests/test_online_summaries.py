@@ -0,0 +1,59 @@
+import numpy as np
+import pymc3 as pm
+
+from online_summaries import QuantileSketch, RunningMoments, SummaryTrace, merge_summaries
+
+
+def test_running_moments_match_numpy():
+    values = np.random.RandomState(0).randn(1000, 3) * [1, 2, 3] + [0, 1, 2]
+    moments = RunningMoments((3,))
+    for start in range(0, 600, 70):
+        moments.update(values[start:min(start + 70, 600)])
+    other = RunningMoments((3,))
+    other.update(values[600:])
+    moments.merge(other)
+
+    assert moments.count == 1000
+    np.testing.assert_allclose(moments.mean, values.mean(axis=0))
+    np.testing.assert_allclose(moments.variance(), values.var(axis=0))
+    np.testing.assert_allclose(moments.variance(ddof=1), values.var(axis=0, ddof=1))
+
+
+def test_quantile_sketch_rank_error():
+    values = np.random.RandomState(1).standard_normal((20000, 2))
+    sketch = QuantileSketch((2,), k=128, random_state=2)
+    for batch in np.split(values, 40):
+        sketch.update(batch)
+    q = np.array([0.025, 0.25, 0.5, 0.75, 0.975])
+    estimates = sketch.quantiles(q)
+    assert estimates.shape == (5, 2)
+    # check the rank of each estimate, rather than its value
+    ranks = (values[:, None, :] <= estimates[None]).mean(axis=0)
+    assert np.all(np.abs(ranks - q[:, None]) < 0.02)
+    assert sum(len(level) for level in sketch.levels) < 2000
+
+
+def _record_chain(trace, values, chain):
+    trace.setup(len(values), chain)
+    for value in values:
+        trace.record({'x': value})
+    trace.close()
+
+
+def test_summary_trace_burns_and_summarises_each_chain():
+    rs = np.random.RandomState(3)
+    chains = [rs.randn(300, 2), rs.randn(300, 2) + 5]
+    with pm.Model():
+        pm.Normal('x', shape=2)
+        trace = SummaryTrace(burn=50, chunk_size=40, random_seed=1)
+    for chain, values in enumerate(chains):
+        _record_chain(trace, values, chain)
+        assert len(trace) == 250
+        np.testing.assert_allclose(trace.summary('x')['mean'], values[50:].mean(axis=0))
+
+    merged = merge_summaries([trace])
+    kept = np.concatenate([values[50:] for values in chains])
+    summary = merged.summary('x')
+    assert summary['count'] == 500
+    np.testing.assert_allclose(summary['mean'], kept.mean(axis=0))
+    np.testing.assert_allclose(summary['sd'], kept.std(axis=0))
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+from pymc3.backends.base import merge_traces
+
+from leontief_model import SplitParamModel
+from parallel_sampling import _worker_flags, diagnostics, sample_chains
+from synthetic_networks import generate_network
+
+
+def test_worker_compiledirs_are_copies(tmpdir):
+    base = tmpdir.mkdir('base')
+    base.join('module.so').write('compiled')
+    base.mkdir('tmpabc123').join('key.pkl').write('stale')
+    base.mkdir('lock_dir')
+
+    root = str(tmpdir.join('workers'))
+    flags = _worker_flags(root, 2, str(base))
+    assert len(flags) == 2
+    for i, worker_flags in enumerate(flags):
+        compiledir = os.path.join(root, 'worker-{}'.format(i))
+        assert 'compiledir={}'.format(compiledir) in worker_flags.split(',')
+        assert sorted(os.listdir(compiledir)) == ['module.so', 'tmpabc123']
+
+    # directories left from an earlier run are reused
+    tmpdir.join('workers', 'worker-0', 'other.so').write('compiled')
+    assert _worker_flags(root, 2, str(base)) == flags
+    assert 'other.so' in os.listdir(os.path.join(root, 'worker-0'))
+
+
+def test_diagnostics_skip_constant_deterministics(multitrace):
+    rs = np.random.RandomState(0)
+    values = [{'a': rs.randn(50, 2), 'const': np.ones((50, 1))} for _ in range(2)]
+    trace = merge_traces([multitrace(v, chain=chain) for chain, v in enumerate(values)])
+    result = diagnostics(trace, elbo={0: [1.0]}, varnames=['a'])
+    assert sorted(result['gelman_rubin']) == ['a']
+    assert result['effective_n']['a'].shape == (2,)
+    assert result['elbo'] == {0: [1.0]}
+    # a single chain has no between-chain diagnostics
+    assert diagnostics(multitrace(values[0]), varnames=['a']) == {}
+
+
+def test_sample_chains(tmpdir):
+    network = generate_network(layers=2, width=3, loops=1, random_state=0)
+    model = SplitParamModel(network.processes, network.input_defs, network.param_defs,
+                            flow_observations=network.flow_observations,
+                            input_observations=network.input_observations)
+    trace, result = sample_chains(model, draws=20, chains=2, njobs=2, n_advi=200, tune=10,
+                                  random_seed=1, compiledir_root=str(tmpdir))
+    assert trace.nchains == 2
+    assert len(trace) == 20
+    varnames = [v.name for v in model.model.vars]
+    assert sorted(result['gelman_rubin']) == sorted(varnames)
+    assert all(np.all(np.isfinite(value)) for value in result['effective_n'].values())
+    assert sorted(result['elbo']) == [0, 1]
+    assert all(len(elbo) == 200 for elbo in result['elbo'].values())
+    # the deterministics are kept in the trace
+    assert trace['X'].shape[0] == 40
@@ -0,0 +1,38 @@
+import numpy as np
+
+from flow_frames import edge_flows_as_dataframe, flows_as_dataframe
+from process_graph import (dense_to_edges, edge_endpoints, edge_list, edges_to_dense,
+                           process_index)
+from steel_processes import define_processes
+
+
+def test_edge_endpoints_match_edge_list():
+    processes = define_processes()
+    pids = process_index(processes)
+    sources, targets = edge_endpoints(processes)
+    assert [(pids[s], pids[t]) for s, t in edge_list(processes)] == list(zip(sources, targets))
+
+
+def test_dense_round_trip():
+    processes = define_processes()
+    sources, _ = edge_endpoints(processes)
+    edges = np.random.RandomState(0).rand(3, len(sources))
+    dense = edges_to_dense(processes, edges)
+    assert dense.shape == (3, len(processes), len(processes))
+    np.testing.assert_array_equal(dense_to_edges(processes, dense), edges)
+    np.testing.assert_allclose(dense.sum(), edges.sum())
+
+
+def test_edge_and_dense_flow_tables_agree():
+    processes = define_processes()
+    possible_inputs = ['BF', 'SP']
+    rs = np.random.RandomState(1)
+    inputs = rs.rand(4, 2)
+    edges = rs.rand(4, len(edge_list(processes))) * (rs.rand(4, len(edge_list(processes))) > 0.3)
+    from_edges = edge_flows_as_dataframe(processes, possible_inputs, inputs, edges)
+    from_dense = flows_as_dataframe(processes, possible_inputs, inputs,
+                                    edges_to_dense(processes, edges))
+    key = ['sample', 'source', 'target']
+    from_edges = from_edges.sort_values(key).reset_index(drop=True)
+    from_dense = from_dense.sort_values(key).reset_index(drop=True)
+    assert from_edges.equals(from_dense)
@@ -0,0 +1,46 @@
+import sys
+import types
+
+import numpy as np
+import pymc3 as pm
+
+from profiling import StageTimer, profile_ops, profile_terms
+
+
+def _model():
+    with pm.Model() as model:
+        x = pm.Normal('x', mu=0, sd=1, shape=3)
+        pm.Normal('y', mu=x.sum(), sd=2, observed=1.5)
+        pm.Deterministic('z', 2 * x)
+    # profiling only needs the `model` attribute of a `SplitParamModel`
+    return types.SimpleNamespace(model=model)
+
+
+def test_profile_terms_add_up_to_logp():
+    model = _model()
+    report = profile_terms(model, evaluations=2)
+    assert [report[name]['kind'] for name in ['x', 'y', 'z']] == [
+        'prior', 'observed', 'deterministic']
+    assert report['z']['output_bytes'] == 3 * 8
+    total = report['x']['value'] + report['y']['value']
+    np.testing.assert_allclose(total, model.model.logp(model.model.test_point))
+
+
+def test_profile_ops_and_stage_timer():
+    report = profile_ops(_model(), evaluations=2)
+    assert report['seconds_per_call'] > 0 and report['ops']
+
+    timer = StageTimer()
+    with timer.stage('allocate'):
+        np.ones(10)
+    assert set(timer.stages['allocate']) == {'seconds', 'peak_rss_mb', 'peak_rss_increase_mb'}
+
+
+def test_stage_timer_without_resource(monkeypatch):
+    # as on Windows, where there is no resource module
+    monkeypatch.setitem(sys.modules, 'resource', None)
+    timer = StageTimer()
+    with timer.stage('allocate'):
+        np.ones(10)
+    assert timer.stages['allocate']['peak_rss_mb'] is None
+    assert timer.stages['allocate']['peak_rss_increase_mb'] is None
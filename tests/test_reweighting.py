@@ -0,0 +1,97 @@
+import types
+
+import numpy as np
+import scipy.stats
+
+from process_graph import edge_list, process_index
+from reweighting import _gpdfit, log_likelihood, psis, reweight, weighted_summary
+from steel_processes import define_processes
+
+
+def _normal_logpdf(x, mu, sd):
+    return -0.5 * ((x - mu) / sd)**2 - np.log(sd) - 0.5 * np.log(2 * np.pi)
+
+
+def test_gpdfit_recovers_shape():
+    x = np.sort(scipy.stats.genpareto.rvs(0.3, scale=2, size=5000, random_state=0))
+    k, sigma = _gpdfit(x)
+    assert abs(k - 0.3) < 0.1
+    assert abs(sigma - 2) < 0.3
+
+
+def test_psis_weighted_mean():
+    # draws from N(0, 1), reweighted to N(0.5, 1)
+    x = np.random.RandomState(1).randn(4000)
+    log_weights, khat = psis(_normal_logpdf(x, 0.5, 1) - _normal_logpdf(x, 0, 1))
+    weights = np.exp(log_weights)
+    np.testing.assert_allclose(weights.sum(), 1)
+    assert khat < 0.5
+    assert abs(weights.dot(x) - 0.5) < 0.1
+
+
+def test_psis_flags_heavy_tailed_ratios():
+    # the target is much wider than the proposal
+    x = np.random.RandomState(2).randn(4000)
+    _, khat = psis(_normal_logpdf(x, 0, 5) - _normal_logpdf(x, 0, 1))
+    assert khat > 0.7
+
+
+def test_weighted_summary_with_equal_weights():
+    values = np.random.RandomState(3).randn(1001, 2, 3)
+    weights = np.full(len(values), 1 / len(values))
+    summary = weighted_summary(values, weights, quantiles=(0.1, 0.5, 0.9))
+    np.testing.assert_allclose(summary['mean'], values.mean(axis=0))
+    np.testing.assert_allclose(summary['sd'], values.std(axis=0))
+    np.testing.assert_allclose(summary['quantiles'],
+                               np.percentile(values, [10, 50, 90], axis=0), atol=0.05)
+
+
+def _model_and_trace(multitrace, num_draws=20):
+    processes = define_processes()
+    edges = edge_list(processes)
+    model = types.SimpleNamespace(processes=processes, edges=edges,
+                                  possible_inputs=['BF', 'DR', 'SP', 'IFC'])
+    rs = np.random.RandomState(4)
+    trace = multitrace({
+        'inputs': rs.rand(num_draws, 4),
+        'X': 1 + rs.rand(num_draws, len(processes)),
+        'F_edges': rs.rand(num_draws, len(edges)),
+    })
+    return model, trace
+
+
+def test_log_likelihood_by_hand(multitrace):
+    model, trace = _model_and_trace(multitrace)
+    pids = process_index(model.processes)
+    (s0, t0), (s1, t1) = model.edges[:2]
+    flow_obs = [([s0, s1], [t0, t1], 1.0, 0.5)]
+    inflow_obs = [([s0], [t0], 0.3, 0.1)]
+    input_obs = [(['SP'], 0.4, 0.2)]
+
+    F, X, inputs = trace['F_edges'], trace['X'], trace['inputs']
+    expected = (_normal_logpdf(F[:, 0] + F[:, 1], 1.0, 0.5) +
+                _normal_logpdf(F[:, 0] / X[:, pids[t0]], 0.3, 0.1) +
+                _normal_logpdf(inputs[:, 2], 0.4, 0.2))
+    result = log_likelihood(model, trace, flow_observations=flow_obs,
+                            inflow_observations=inflow_obs, input_observations=input_obs)
+    np.testing.assert_allclose(result, expected)
+    np.testing.assert_allclose(
+        log_likelihood(model, trace, burn=5, thin=2, flow_observations=flow_obs),
+        _normal_logpdf(F[5::2, 0] + F[5::2, 1], 1.0, 0.5))
+
+
+def test_reweight_only_uses_changed_observations(multitrace):
+    model, trace = _model_and_trace(multitrace)
+    (s0, t0), (s1, t1) = model.edges[:2]
+    kept, old, new = ([s1], [t1], 0.5, 0.5), ([s0], [t0], 0.5, 0.5), ([s0], [t0], 0.6, 0.5)
+
+    unchanged = reweight(model, trace, {'flow_observations': [kept, old]},
+                         old_observations={'flow_observations': [kept, old]})
+    np.testing.assert_allclose(unchanged.weights, 1 / len(trace))
+    assert unchanged.khat == -np.inf
+
+    result = reweight(model, trace, {'flow_observations': [kept, new]},
+                      old_observations={'flow_observations': [kept, old]}, min_ess=1)
+    F = trace['F_edges'][:, 0]
+    log_ratios = _normal_logpdf(F, 0.6, 0.5) - _normal_logpdf(F, 0.5, 0.5)
+    np.testing.assert_allclose(result.log_weights, psis(log_ratios)[0])
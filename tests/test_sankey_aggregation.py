@@ -0,0 +1,55 @@
+import numpy as np
+from floweaver import weave
+
+from flow_frames import inputs_flows_as_dataframe
+from process_graph import edge_list, edges_to_dense
+from sankey_aggregation import SankeyAggregation
+from steel_processes import define_processes
+from steel_sdd import diagram
+
+
+POSSIBLE_INPUTS = ['BF', 'DR', 'SP', 'IFC']
+
+
+def _flows(num_draws=6):
+    processes = define_processes()
+    rs = np.random.RandomState(0)
+    inputs = rs.rand(num_draws, len(POSSIBLE_INPUTS))
+    edge_flows = rs.rand(num_draws, len(edge_list(processes)))
+    return processes, inputs, edge_flows
+
+
+def test_draw_link_values_selects_single_draws(multitrace):
+    processes, inputs, edge_flows = _flows()
+    aggregation = SankeyAggregation(diagram(), processes, POSSIBLE_INPUTS)
+    expected = aggregation.link_values(inputs, edge_flows)
+    trace = multitrace({'inputs': inputs, 'F_edges': edge_flows})
+
+    np.testing.assert_allclose(aggregation.draw_link_values(trace, 2), expected[[2]])
+    np.testing.assert_allclose(aggregation.draw_link_values(trace, [1, 4]), expected[[1, 4]])
+    np.testing.assert_allclose(aggregation.trace_link_values(trace, burn=1, thin=2),
+                               expected[1::2])
+
+
+def test_dense_trace_gives_same_link_values(multitrace):
+    processes, inputs, edge_flows = _flows()
+    aggregation = SankeyAggregation(diagram(), processes, POSSIBLE_INPUTS)
+    trace = multitrace({'inputs': inputs, 'F': edges_to_dense(processes, edge_flows)})
+    np.testing.assert_allclose(aggregation.draw_link_values(trace, 3),
+                               aggregation.link_values(inputs[3], edge_flows[3]))
+
+
+def test_link_values_match_weave():
+    processes, inputs, edge_flows = _flows()
+    # links with no flow are left out by weave
+    edge_flows[:, ::3] = 0
+    aggregation = SankeyAggregation(diagram(), processes, POSSIBLE_INPUTS)
+    values = aggregation.link_values(inputs, edge_flows)
+    keys = [(link.source, link.target, link.type, link.time) for link in aggregation.links]
+    for draw in range(len(inputs)):
+        dataset = inputs_flows_as_dataframe(processes, POSSIBLE_INPUTS, inputs[draw],
+                                            edges_to_dense(processes, edge_flows[draw]))
+        woven = {(link.source, link.target, link.type, link.time): link.value
+                 for link in weave(diagram(), dataset).links}
+        assert set(woven) <= set(keys)
+        np.testing.assert_allclose(values[draw], [woven.get(key, 0) for key in keys])
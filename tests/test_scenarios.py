@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from leontief_model import SplitParamModel
+from scenarios import fit_map, run_scenarios, scenario_grid
+from synthetic_networks import generate_network
+
+
+NETWORK = generate_network(layers=2, width=3, loops=1, random_state=0)
+
+
+def _model(flow_observations=None, input_observations=None, shared_observations=True):
+    return SplitParamModel(NETWORK.processes, NETWORK.input_defs, NETWORK.param_defs,
+                           flow_observations=flow_observations,
+                           input_observations=input_observations,
+                           shared_observations=shared_observations)
+
+
+def _shared_model():
+    return _model(NETWORK.flow_observations, NETWORK.input_observations)
+
+
+def _changed(observation, value, std):
+    return observation[:-2] + (value, std)
+
+
+def _points(model):
+    point = model.model.test_point
+    rs = np.random.RandomState(0)
+    moved = {k: v + 0.3 * rs.randn(*np.shape(v)) for k, v in point.items()}
+    return [point, moved]
+
+
+def test_set_observations():
+    model = _shared_model()
+    flow_layout = model.observation_layout['flow']
+    assert len(flow_layout) == len(NETWORK.flow_observations)
+
+    second = _changed(NETWORK.flow_observations[1], 150.0, 20.0)
+    model.set_observations(flow_observations=[second])
+    data, stds, mask = (var.get_value() for var in model.observation_data['flow'])
+    np.testing.assert_array_equal(mask, [0, 1])
+    assert data[1] == 150.0 and stds[1] == 20.0
+
+    # input observations were not given, so are left as they were
+    data, stds, mask = (var.get_value() for var in model.observation_data['input'])
+    np.testing.assert_array_equal(mask, [1])
+    assert data[0] == NETWORK.input_observations[0][-2]
+
+
+def test_set_observations_errors():
+    model = _model(NETWORK.flow_observations)
+    with pytest.raises(ValueError):
+        model.set_observations(input_observations=NETWORK.input_observations)
+    with pytest.raises(ValueError):
+        # the reverse of an observed flow is not in the layout
+        sources, targets, value, std = NETWORK.flow_observations[0]
+        model.set_observations(flow_observations=[(targets, sources, value, std)])
+    with pytest.raises(ValueError):
+        _model(NETWORK.flow_observations, shared_observations=False).set_observations(
+            flow_observations=NETWORK.flow_observations)
+
+
+def test_shared_logp_matches_fresh_model():
+    second = _changed(NETWORK.flow_observations[1], 150.0, 20.0)
+    model = _shared_model()
+    model.set_observations(flow_observations=[second], input_observations=[])
+    fresh = _model([second], shared_observations=False)
+    for point in _points(model):
+        np.testing.assert_allclose(model.model.logp(point), fresh.model.logp(point))
+
+
+def test_scenario_grid():
+    scenarios = scenario_grid(flow_observations=['a', 'b'], input_observations=['c', 'd'])
+    assert len(scenarios) == 4
+    assert {'flow_observations': 'b', 'input_observations': 'c'} in scenarios
+
+
+@pytest.mark.parametrize('njobs', [1, 2])
+def test_run_scenarios(njobs):
+    model = _shared_model()
+    scenarios = [
+        {'flow_observations': NETWORK.flow_observations},
+        {'flow_observations': [_changed(NETWORK.flow_observations[0], 50.0, 5.0)]},
+    ]
+    results = run_scenarios(model, scenarios, njobs=njobs)
+    assert len(results) == 2
+    for scenario, result in zip(scenarios, results):
+        assert result['success']
+        assert set(result['deterministics']) >= {'X', 'F'}
+        # the same fit as in this process, with the scenario's observations
+        model.set_observations(**scenario)
+        expected = fit_map(model)
+        np.testing.assert_allclose(result['logp'], expected['logp'])
+        np.testing.assert_allclose(result['logp'], model.model.logp(result['point']))
+    with pytest.raises(ValueError):
+        run_scenarios(_model(NETWORK.flow_observations, shared_observations=False), scenarios)
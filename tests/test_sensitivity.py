@@ -0,0 +1,76 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from forward_model import ForwardModel
+from leontief_model import EfficiencyProcess, SinkProcess
+from priors import param_defs
+from sensitivity import flow_jacobian, rank_factors, sobol_indices
+from steel_processes import define_processes
+
+
+def _product_model():
+    """One process with efficiency e = logistic(p), p ~ N(0, 1), and input
+    u ~ U(0, 10), so the flow A -> B is u * e."""
+    processes = OrderedDict([
+        ('A', EfficiencyProcess('A', ['B', 'L'])),
+        ('B', SinkProcess('B')),
+        ('L', SinkProcess('L')),
+    ])
+    return ForwardModel(processes, {'A': 10}, {'A': (0.0, 1.0)})
+
+
+def test_sobol_indices_of_product():
+    # moments of the efficiency by Gauss-Hermite quadrature
+    nodes, weights = np.polynomial.hermite_e.hermegauss(60)
+    weights = weights / weights.sum()
+    e = 1 / (1 + np.exp(-nodes))
+    e_mean, e_sq = weights.dot(e), weights.dot(e**2)
+    u_mean, u_sq = 5.0, 100 / 3
+    variance = u_sq * e_sq - u_mean**2 * e_mean**2
+    first_u = e_mean**2 * (u_sq - u_mean**2) / variance
+    first_e = u_mean**2 * (e_sq - e_mean**2) / variance
+
+    indices = sobol_indices(_product_model(), num_samples=40000, random_state=0)
+    assert indices['factors'] == ['A', 'inputs:A']
+    column = indices['edges'].index(('A', 'B'))
+    np.testing.assert_allclose(indices['variance'][column], variance, rtol=0.05)
+    np.testing.assert_allclose(indices['first_order'][:, column], [first_e, first_u], atol=0.03)
+    np.testing.assert_allclose(indices['total'][:, column], [1 - first_u, 1 - first_e],
+                               atol=0.03)
+    assert rank_factors(indices, 'A', 'B')[0][0] == 'inputs:A'
+
+
+def test_flow_jacobian_of_product():
+    forward = _product_model()
+    params = OrderedDict([('A', np.array([[0.3], [-1.0]]))])
+    inputs = np.array([[4.0], [7.0]])
+    result = flow_jacobian(forward, params, inputs)
+    assert result['labels'] == [('A', 0), ('inputs', 'A')]
+
+    e = 1 / (1 + np.exp(-params['A'][:, 0]))
+    u = inputs[:, 0]
+    column = result['edges'].index(('A', 'B'))
+    np.testing.assert_allclose(result['jacobian'][:, column, 0], u * e * (1 - e), rtol=1e-6)
+    np.testing.assert_allclose(result['jacobian'][:, column, 1], e, rtol=1e-6)
+
+
+def test_flow_jacobian_inputs_match_inverse():
+    forward = ForwardModel(define_processes(), {'BF': 5000, 'DR': 300, 'SP': 1000, 'IFC': 300},
+                           param_defs)
+    rs = np.random.RandomState(1)
+    params = forward.sample_params(3, rs)
+    inputs = forward.sample_inputs(3, rs)
+    result = flow_jacobian(forward, params, inputs)
+
+    # d flow_e / d input_j = coefficient_e * (I - A)^-1[source_e, input_j]
+    coeffs = forward.transfer_coefficients(params)
+    Np = len(forward.processes)
+    A = np.zeros((3, Np, Np))
+    A[:, forward.edge_targets, forward.edge_sources] = coeffs
+    inverse = np.linalg.inv(np.eye(Np) - A)
+    expected = (coeffs[:, :, None] *
+                inverse[:, forward.edge_sources][:, :, forward.input_idx])
+    num_inputs = len(forward.possible_inputs)
+    np.testing.assert_allclose(result['jacobian'][:, :, -num_inputs:], expected,
+                               rtol=1e-5, atol=1e-8)
@@ -0,0 +1,121 @@
+import numpy as np
+from scipy import stats
+from scipy.special import expit, softmax
+
+from leontief_model import EfficiencyProcess
+from process_graph import edges_to_dense, process_index
+from synthetic_networks import generate_network
+from timeseries_model import TimeSeriesModel, _unconstrained_prior
+
+
+NETWORK = generate_network(layers=2, width=3, loops=1, random_state=0)
+YEARS = [2000, 2001, 2002]
+
+
+def _model(**kwargs):
+    # one efficiency without a prior
+    param_defs = dict(NETWORK.param_defs)
+    del param_defs['E0_0']
+    return TimeSeriesModel(NETWORK.processes, NETWORK.input_defs, param_defs, YEARS, **kwargs)
+
+
+def _evaluate(model, names):
+    point = dict(model.model.test_point)
+    rs = np.random.RandomState(0)
+    for name in point:
+        point[name] = point[name] + 0.2 * rs.randn(*point[name].shape)
+    variables = {var.name: var for var in model.model.deterministics}
+    variables.update(model.model.named_vars)
+    values = model.model.fastfn([variables[name] for name in names])(point)
+    return point, dict(zip(names, values))
+
+
+def test_throughputs_and_edge_order():
+    model = _model()
+    point, values = _evaluate(model, ['inputs', 'params', 'TCs_edges', 'X', 'F_edges'])
+    Np = len(NETWORK.processes)
+    pids = process_index(NETWORK.processes)
+    assert values['TCs_edges'].shape == values['F_edges'].shape == (3, len(model.edges))
+
+    for t in range(len(YEARS)):
+        # transfer coefficients from the parameters, placed by `edge_list`
+        params = values['params'][t]
+        expected = np.zeros(len(model.edges))
+        for pid, process in NETWORK.processes.items():
+            if not process.outputs:
+                continue
+            p = params[model.param_slices[pid]]
+            if isinstance(process, EfficiencyProcess):
+                coeffs = [expit(p[0]), 1 - expit(p[0])]
+            else:
+                coeffs = softmax(p) if len(p) else [1.0]
+            for dest_id, coeff in zip(process.outputs, coeffs):
+                expected[model.edge_index(pid, dest_id)] = coeff
+        np.testing.assert_allclose(values['TCs_edges'][t], expected)
+
+        A = edges_to_dense(NETWORK.processes, values['TCs_edges'][t]).T
+        b = np.zeros(Np)
+        b[[pids[k] for k in model.possible_inputs]] = values['inputs'][t]
+        X = np.linalg.solve(np.eye(Np) - A, b)
+        np.testing.assert_allclose(values['X'][t], X)
+        sources = [pids[source] for source, _ in model.edges]
+        np.testing.assert_allclose(values['F_edges'][t], values['TCs_edges'][t] * X[sources])
+
+
+def test_observations_pick_their_year():
+    model = _model(flow_observations={2001: [(['E0_1P'], ['E1_2', 'E1_0'], 100, 10)]},
+                   input_observations={2002: [(['E0_1'], 500, 50)]},
+                   inflow_observations={2000: [(['E0_1P'], ['E1_2'], 0.5, 0.1)]})
+    _, values = _evaluate(model, ['inputs', 'X', 'F_edges', 'Fobs', 'Iobs', 'IFobs'])
+    pids = process_index(NETWORK.processes)
+    F = values['F_edges']
+    np.testing.assert_allclose(values['Fobs'], [F[1, model.edge_index('E0_1P', 'E1_2')] +
+                                                F[1, model.edge_index('E0_1P', 'E1_0')]])
+    np.testing.assert_allclose(values['Iobs'],
+                               [values['inputs'][2, model.possible_inputs.index('E0_1')]])
+    np.testing.assert_allclose(values['IFobs'], [F[0, model.edge_index('E0_1P', 'E1_2')] /
+                                                 values['X'][0, pids['E1_2']]])
+
+
+def test_random_walk_couples_neighbouring_years():
+    model = _model(smoothing_sd={'E0_1': 0.5, 'default': 0.2})
+    point, values = _evaluate(model, ['params'])
+    params = values['params']
+
+    means, stds, steps = [], [], []
+    param_defs = dict(NETWORK.param_defs, E0_0=None)
+    for pid in model.param_slices:
+        mu, sd, _ = _unconstrained_prior(NETWORK.processes[pid], param_defs.get(pid))
+        means.append(mu)
+        stds.append(sd)
+        steps.append(np.full(len(mu), 0.5 if pid == 'E0_1' else 0.2))
+    means, stds, steps = (np.concatenate(xx) for xx in (means, stds, steps))
+
+    # the first year has the priors, and each later year is a step from
+    # the year before
+    expected = (stats.norm.logpdf(params[0], means, stds).sum() +
+                stats.norm.logpdf(params[1:], params[:-1], steps).sum())
+    walk, = [p for p in model.model.potentials if p.name == 'params_walk']
+    walk_logp = model.model.fn(walk)
+    np.testing.assert_allclose(walk_logp(point), expected)
+
+    # moving every year together only changes the first year's prior, but
+    # moving one year changes its steps to both neighbours
+    shifted = dict(point, params=params + 1)
+    np.testing.assert_allclose(walk_logp(shifted),
+                               stats.norm.logpdf(params[0] + 1, means, stds).sum() +
+                               stats.norm.logpdf(params[1:], params[:-1], steps).sum())
+    moved = params.copy()
+    moved[1] += 0.3
+    change = (stats.norm.logpdf(moved[1], params[0], steps) +
+              stats.norm.logpdf(params[2], moved[1], steps) -
+              stats.norm.logpdf(params[1], params[0], steps) -
+              stats.norm.logpdf(params[2], params[1], steps)).sum()
+    np.testing.assert_allclose(walk_logp(dict(point, params=moved)) - walk_logp(point), change)
+
+
+def test_efficiency_without_prior_matches_uniform():
+    means, stds, _ = _unconstrained_prior(NETWORK.processes['E0_0'], None)
+    # the logit of a uniform variable has a logistic distribution
+    np.testing.assert_allclose(means, [0])
+    np.testing.assert_allclose(stds ** 2, [stats.logistic.var()])
@@ -0,0 +1,68 @@
+import time
+
+import numpy as np
+from floweaver import weave
+
+from flow_frames import inputs_flows_as_dataframe
+from process_graph import edge_list, edges_to_dense
+from steel_processes import define_processes
+from steel_sdd import diagram
+from trace_sankey_helpers import FramePlayer, _flow_matrix, sankey_frames
+
+
+POSSIBLE_INPUTS = ['BF', 'DR', 'SP', 'IFC']
+
+
+def test_flow_matrix_from_multitrace(multitrace):
+    processes = define_processes()
+    edge_flows = np.random.RandomState(0).rand(5, len(edge_list(processes)))
+    dense = edges_to_dense(processes, edge_flows)
+    for trace in (multitrace({'F_edges': edge_flows}), multitrace({'F': dense})):
+        np.testing.assert_allclose(_flow_matrix(processes, trace, 2), dense[2])
+        np.testing.assert_allclose(_flow_matrix(processes, trace, slice(1, 3)), dense[1:3])
+        np.testing.assert_allclose(_flow_matrix(processes, trace, slice(3, None)).mean(axis=0),
+                                   dense[3:].mean(axis=0))
+
+
+def _link_values(result):
+    return {(link.source, link.target, link.type, link.time): link.value
+            for link in result.links}
+
+
+def _frames(multitrace, samples):
+    processes = define_processes()
+    rs = np.random.RandomState(1)
+    inputs = rs.rand(6, len(POSSIBLE_INPUTS))
+    edge_flows = rs.rand(6, len(edge_list(processes)))
+    trace = multitrace({'inputs': inputs, 'F_edges': edge_flows})
+    frames = sankey_frames(processes, POSSIBLE_INPUTS, trace, diagram(), samples)
+    return processes, inputs, edge_flows, frames
+
+
+def test_sankey_frames_match_weaving_each_draw(multitrace):
+    samples = [4, 0, 2]
+    processes, inputs, edge_flows, frames = _frames(multitrace, samples)
+    assert len(frames) == 3
+    links = [(link.source, link.target, link.type, link.time) for link in frames.result.links]
+    for i, draw in enumerate(samples):
+        dataset = inputs_flows_as_dataframe(processes, POSSIBLE_INPUTS, inputs[draw],
+                                            edges_to_dense(processes, edge_flows[draw]))
+        expected = _link_values(weave(diagram(), dataset))
+        np.testing.assert_allclose(frames.values[i], [expected.get(key, 0) for key in links])
+        assert [link['value'] for link in frames.links(i)] == list(frames.values[i])
+    assert frames.links(1) is frames.links(1)
+
+
+def test_frame_player(multitrace):
+    _, _, _, frames = _frames(multitrace, [0, 1, 2])
+    player = FramePlayer(frames, interval=0.01)
+    assert player.widget.links == frames.links(0)
+    player.slider.value = 2
+    assert player.widget.links == frames.links(2)
+
+    player.play()
+    time.sleep(0.2)
+    player.stop()
+    player._thread.join(1)
+    assert not player._thread.is_alive()
+    assert player.widget.links == frames.links(player.slider.value)
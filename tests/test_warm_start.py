@@ -0,0 +1,41 @@
+import types
+
+import numpy as np
+import pymc3 as pm
+
+from warm_start import load_advi, map_to_model, trace_moments
+
+
+def test_load_advi(tmpdir):
+    filename = str(tmpdir.join('advi.npz'))
+    means, stds = {'a': np.array([1.0, 2.0])}, {'a': np.array([0.1, 0.2])}
+    np.savez(filename, np.array([means, stds, np.zeros(3)], dtype=object))
+    loaded_means, loaded_stds = load_advi(filename)
+    np.testing.assert_array_equal(loaded_means['a'], means['a'])
+    np.testing.assert_array_equal(loaded_stds['a'], stds['a'])
+
+
+def test_trace_moments(multitrace):
+    values = np.random.RandomState(0).randn(50, 3)
+    means, stds = trace_moments(multitrace({'a': values}), burn=10)
+    np.testing.assert_allclose(means['a'], values[10:].mean(axis=0))
+    np.testing.assert_allclose(stds['a'], values[10:].std(axis=0))
+
+
+def test_map_to_model():
+    with pm.Model() as pm_model:
+        pm.Normal('a', shape=2)
+        pm.Normal('b', shape=3)
+        pm.Normal('c')
+    model = types.SimpleNamespace(model=pm_model)
+    means = {'a': [1.0, 2.0], 'b': [1.0, 2.0], 'old': 1.0}
+    stds = {'a': [0.1, 0.2], 'b': [0.1, 0.2], 'old': 1.0}
+    start, new_stds, missing = map_to_model(model, means, stds, default_std=0.5)
+
+    np.testing.assert_array_equal(start['a'], [1.0, 2.0])
+    np.testing.assert_array_equal(new_stds['a'], [0.1, 0.2])
+    # wrong shape, or not in the previous results
+    assert missing == ['b', 'c']
+    np.testing.assert_array_equal(start['b'], pm_model.test_point['b'])
+    np.testing.assert_array_equal(new_stds['b'], [0.5, 0.5, 0.5])
+    assert set(start) == {'a', 'b', 'c'}
@@ -0,0 +1,256 @@
+"""Multi-year version of `SplitParamModel`.
+
+All years share one process structure. The parameters of every process are
+put on an unconstrained scale (logit efficiencies, log allocation shares)
+and follow a Gaussian random walk from year to year, so neighbouring years
+share information. The Leontief systems of all years are solved together
+as one (years x Np x Np) stack, so the model is compiled and sampled once.
+
+    model = TimeSeriesModel(define_processes(), input_defs, param_defs,
+                            years=range(1985, 2015),
+                            flow_observations={1985: [...], 1986: [...]})
+    with model.model:
+        trace = pm.sample(500, ...)
+    bf_to_pi = model.get_flow(trace, 'BF', 'PI')   # draws x years
+
+Dirichlet allocation priors are replaced by a logistic-normal prior: the
+log-gamma variables behind the Dirichlet distribution are given normal
+distributions with the same means and variances (digamma and trigamma of
+the concentrations), so that all parameters can share the random walk.
+In the same way, efficiencies without a prior, which `SplitParamModel`
+gives a uniform prior, are given a normal prior on the logit scale with
+the mean and variance of the logit of a uniform efficiency (0 and pi^2/3).
+"""
+
+import numpy as np
+import theano.tensor as T
+import pymc3 as pm
+from scipy.special import digamma, polygamma
+
+from leontief_model import (
+    EfficiencyProcess,
+    DirichletAllocationProcess,
+    SoftmaxAllocationProcess,
+    SymlogAllocationProcess,
+    _segment_sum
+)
+from leontief_op import leontief_solve
+from process_graph import edge_list, edges_to_dense, process_index, transfer_coefficient_index
+
+
+def _efficiency_coeffs(params):
+    eff = T.nnet.sigmoid(params)
+    return T.concatenate([eff, 1 - eff], axis=1)
+
+
+def _single_output_coeffs(params):
+    return T.ones((params.shape[0], 1))
+
+
+def _unconstrained_prior(process, defs):
+    """Means and standard deviations of the first year's parameters of a
+    process on an unconstrained scale, and the function from parameters
+    (one row per year) to transfer coefficients."""
+    if isinstance(process, EfficiencyProcess):
+        # without defs, the mean and variance of the logit of a uniform
+        # efficiency, standing in for `SplitParamModel`'s uniform prior
+        means, stds = (np.atleast_1d(xx) for xx in (defs or (0.0, np.pi / np.sqrt(3))))
+        return means, stds, _efficiency_coeffs
+    if isinstance(process, DirichletAllocationProcess):
+        if process.nparams == 1:
+            return np.zeros(0), np.zeros(0), _single_output_coeffs
+        alphas = np.ones(process.nparams) if defs is None else np.asarray(defs, dtype=float)
+        return digamma(alphas), np.sqrt(polygamma(1, alphas)), T.nnet.softmax
+    if isinstance(process, (SoftmaxAllocationProcess, SymlogAllocationProcess)):
+        if defs:
+            means, stds = (np.atleast_1d(xx) for xx in defs)
+        else:
+            means, stds = process.default_param_prior()
+        return means, stds, T.nnet.softmax
+    raise TypeError('{} is not supported by TimeSeriesModel'.format(type(process).__name__))
+
+
+class TimeSeriesModel:
+    """Flow model of several years with one shared process structure.
+
+    `input_defs` and `param_defs` are as for `SplitParamModel` (with the
+    priors moved to an unconstrained scale, see the module docstring); the
+    parameter priors apply to the first year, and each later year's
+    parameters differ from the year before by a normal step with standard
+    deviation `smoothing_sd` (on the unconstrained scale; a number, or a
+    dictionary by process id with 'default' for the rest). Inputs are
+    independent between years.
+
+    Observations are dictionaries of year -> list of observations, each in
+    the same form as for `SplitParamModel`.
+
+    Transfer coefficients and flows are recorded as `TCs_edges` and
+    `F_edges` of shape (years, edges), and throughputs as `X` of shape
+    (years, Np).
+    """
+    def __init__(self, processes, input_defs, param_defs, years, flow_observations=None,
+                 input_observations=None, inflow_observations=None, smoothing_sd=0.1):
+        self.processes = processes
+        self.years = list(years)
+        self.edges = edge_list(processes)
+        self.possible_inputs = possible_inputs = sorted(list(input_defs.keys()))
+        input_max = np.array([input_defs[k] for k in possible_inputs], dtype=float)
+        self.param_defs = param_defs
+        Ny, Np = len(self.years), len(processes)
+
+        # unconstrained parameters of all processes side by side
+        self.param_slices = {}
+        means, stds, steps, transforms = [], [], [], []
+        offset = 0
+        for pid, process in processes.items():
+            if not process.outputs:
+                continue
+            mu, sd, transform = _unconstrained_prior(process, param_defs.get(pid))
+            self.param_slices[pid] = slice(offset, offset + len(mu))
+            offset += len(mu)
+            if isinstance(smoothing_sd, dict):
+                step = smoothing_sd.get(pid, smoothing_sd.get('default', 0.1))
+            else:
+                step = smoothing_sd
+            means.append(mu)
+            stds.append(sd)
+            steps.append(np.full(len(mu), step, dtype=float))
+            transforms.append((pid, transform))
+        means, stds, steps = (np.concatenate(xx) for xx in (means, stds, steps))
+
+        pids = process_index(processes)
+        input_idx = [pids[k] for k in possible_inputs]
+        edge_targets, edge_sources = transfer_coefficient_index(processes)
+
+        with pm.Model() as self.model:
+            inputs = pm.Uniform('inputs', lower=np.zeros((Ny, len(input_max))),
+                                upper=np.tile(input_max, (Ny, 1)),
+                                shape=(Ny, len(input_max)))
+            # Gaussian random walk from the first year's priors. This is
+            # written out, since pm.GaussianRandomWalk adds its vector
+            # `init` logp to the summed steps, counting the steps once for
+            # every parameter.
+            params = pm.Flat('params', shape=(Ny, len(means)),
+                             testval=np.tile(means, (Ny, 1)))
+            first_year = pm.Normal.dist(mu=means, sd=stds).logp(params[0])
+            year_steps = pm.Normal.dist(mu=params[:-1], sd=steps).logp(params[1:])
+            pm.Potential('params_walk', T.sum(first_year) + T.sum(year_steps))
+
+            edge_coeffs = pm.Deterministic('TCs_edges', T.concatenate(
+                [transform(params[:, self.param_slices[pid]]) for pid, transform in transforms],
+                axis=1))
+
+            # Scatter into (Np * Np, years) and (Np, years), so that only
+            # one axis is indexed, then turn round to put years first
+            flat_idx = np.asarray(edge_targets) * Np + np.asarray(edge_sources)
+            transfer_coeffs = T.set_subtensor(T.zeros((Np * Np, Ny))[flat_idx],
+                                              edge_coeffs.T).T.reshape((Ny, Np, Np))
+            all_inputs = T.set_subtensor(T.zeros((Np, Ny))[input_idx], inputs.T).T
+
+            # all years' Leontief systems in one batched solve
+            process_throughputs = pm.Deterministic(
+                'X', leontief_solve(transfer_coeffs, all_inputs))
+            pm.Deterministic('F_edges', edge_coeffs * process_throughputs.T[edge_sources].T)
+
+            if flow_observations is not None:
+                flow_obs, flow_data, flow_stds = self._flow_observations(flow_observations)
+                Fobs = pm.Deterministic('Fobs', self._observed_flows(
+                    flow_obs, len(flow_data), transfer_coeffs, process_throughputs))
+                pm.Normal('FD', mu=Fobs, sd=flow_stds, observed=flow_data)
+
+            if input_observations is not None:
+                input_obs, input_data, input_stds = self._input_observations(input_observations)
+                obs_index, year_idx, target_idx = input_obs
+                Iobs = pm.Deterministic('Iobs', _segment_sum(
+                    obs_index, all_inputs.flatten()[year_idx * Np + target_idx],
+                    len(input_data)))
+                pm.Normal('ID', mu=Iobs, sd=input_stds, observed=input_data)
+
+            if inflow_observations is not None:
+                inflow_obs, inflow_data, inflow_stds = self._flow_observations(
+                    inflow_observations)
+                Iratioobs = pm.Deterministic('IFobs', self._observed_flows(
+                    inflow_obs, len(inflow_data), transfer_coeffs, process_throughputs,
+                    inflow_fractions=True))
+                pm.Normal('IFD', mu=Iratioobs, sd=inflow_stds, observed=inflow_data)
+
+    def _flow_observations(self, observations):
+        """Sparse observation operator: each observation is the sum of the
+        flows ``source_idx[i] -> target_idx[i]`` in year ``year_idx[i]`` for
+        which ``obs_index[i]`` is the observation number."""
+        obs_index, year_idx, source_idx, target_idx = [], [], [], []
+        flow_data, flow_stds = [], []
+        pids = process_index(self.processes)
+        for year, year_observations in sorted(observations.items()):
+            t = self.year_index(year)
+            for sources, targets, value, std in year_observations:
+                sources, targets = np.broadcast_arrays([pids[k] for k in sources],
+                                                       [pids[k] for k in targets])
+                pairs = sorted(set(zip(sources, targets)))
+                obs_index.extend([len(flow_data)] * len(pairs))
+                year_idx.extend([t] * len(pairs))
+                source_idx.extend(j for j, _ in pairs)
+                target_idx.extend(k for _, k in pairs)
+                flow_data.append(value)
+                flow_stds.append(std)
+        flow_obs = tuple(np.array(xx, dtype=int)
+                         for xx in (obs_index, year_idx, source_idx, target_idx))
+        return flow_obs, np.array(flow_data, dtype=float), np.array(flow_stds, dtype=float)
+
+    def _input_observations(self, observations):
+        """Sparse observation operator: each observation is the sum of the
+        inputs to ``target_idx[i]`` in year ``year_idx[i]`` for which
+        ``obs_index[i]`` is the observation number."""
+        obs_index, year_idx, target_idx = [], [], []
+        input_data, input_stds = [], []
+        pids = process_index(self.processes)
+        for year, year_observations in sorted(observations.items()):
+            t = self.year_index(year)
+            for targets, value, std in year_observations:
+                targets = sorted(set(pids[k] for k in targets))
+                obs_index.extend([len(input_data)] * len(targets))
+                year_idx.extend([t] * len(targets))
+                target_idx.extend(targets)
+                input_data.append(value)
+                input_stds.append(std)
+        input_obs = tuple(np.array(xx, dtype=int) for xx in (obs_index, year_idx, target_idx))
+        return input_obs, np.array(input_data, dtype=float), np.array(input_stds, dtype=float)
+
+    def _observed_flows(self, flow_obs, num_obs, transfer_coeffs, process_throughputs,
+                        inflow_fractions=False):
+        """Evaluate sparse flow observations by gathering only the flows needed."""
+        obs_index, year_idx, source_idx, target_idx = flow_obs
+        Np = len(self.processes)
+        X = process_throughputs.flatten()
+        coeffs = transfer_coeffs.flatten()[(year_idx * Np + target_idx) * Np + source_idx]
+        values = coeffs * X[year_idx * Np + source_idx]
+        if inflow_fractions:
+            values = values / X[year_idx * Np + target_idx]
+        return _segment_sum(obs_index, values, num_obs)
+
+    def year_index(self, year):
+        """Position of `year` along the first axis of each variable."""
+        if year not in self.years:
+            raise ValueError('Year {} is not in the model'.format(year))
+        return self.years.index(year)
+
+    def edge_index(self, source, target):
+        """Position of the flow from `source` to `target` in edge vectors."""
+        return self.edges.index((source, target))
+
+    def get_params(self, trace, pid):
+        """Pick out unconstrained parameter values for one process from
+        trace, shape (draws, years, nparams)."""
+        return trace['params'][:, :, self.param_slices[pid]]
+
+    def get_flow(self, trace, source, target, year=None):
+        """Pick out flow from trace, for every year or just `year`."""
+        values = trace['F_edges'][:, :, self.edge_index(source, target)]
+        if year is not None:
+            return values[:, self.year_index(year)]
+        return values
+
+    def dense_flows(self, edge_values):
+        """Rebuild (..., Np, Np) flow matrices, indexed [source, target],
+        from edge vectors such as ``trace['F_edges']``."""
+        return edges_to_dense(self.processes, edge_values)
@@ -1,5 +1,6 @@
 """Helper functions for showing traces as Sankey diagrams."""
 
+import threading
 import time
 import numpy as np
 import pandas as pd
@@ -7,67 +8,112 @@ import ipywidgets
 from floweaver import Dataset, weave
 from palettable.colorbrewer import qualitative, sequential
 
-
-def inputs_flows_as_dataframe(processes, possible_inputs, I, F):
-    """Turn inputs & flows vectors into dataframe of flows"""
-    flows = []
-    Np = F.shape[0]
-    for i in range(len(I)):
-        if I[i] > 0:
-            flows.append(('inputs', possible_inputs[i], '?', I[i]))
-
-    # lookup process id to index
-    process_ids = list(processes.keys())
-    for i in range(Np):
-        for j in range(Np):
-            if F[i, j] > 0:
-                flows.append((process_ids[i], process_ids[j], '?', F[i, j]))
-    return pd.DataFrame.from_records(flows, columns=('source', 'target', 'material', 'value'))
+from flow_frames import edge_flows_as_dataframe, flows_as_dataframe, inputs_flows_as_dataframe
+from flow_statistics import link_measures, summarise
+from process_graph import edges_to_dense
+from sankey_aggregation import SankeyAggregation
 
 
 def flows_from_trace(processes, possible_inputs, trace, nburn=100, thin=10):
+    """Long-format table of the inputs and flows in every sample of the trace."""
     inputs = trace['inputs', nburn::thin]
+    if _has_edge_flows(trace):
+        return edge_flows_as_dataframe(processes, possible_inputs, inputs,
+                                       trace['F_edges', nburn::thin])
     flows = trace['F', nburn::thin]
+    return flows_as_dataframe(processes, possible_inputs, inputs, flows)
 
-    # lookup process id to index
-    process_ids = list(processes.keys())
-
-    Np = flows.shape[1]
-    rows = []
-    for i in range(flows.shape[0]):
-        for j in range(inputs.shape[1]):
-            if inputs[i, j] > 0:
-                rows.append(('inputs', possible_inputs[j], '?', i, inputs[i, j]))
-
-        for j in range(Np):
-            for k in range(Np):
-                if flows[i, j, k] > 0:
-                    rows.append((process_ids[j], process_ids[k], '?', i, flows[i, j, k]))
-
-    return pd.DataFrame.from_records(rows, columns=('source', 'target', 'material', 'sample', 'value'))
 
+def iter_flows_from_trace(processes, possible_inputs, trace, nburn=100, thin=10,
+                          chunk_size=500):
+    """Like `flows_from_trace`, but yield tables for `chunk_size` samples at a time.
 
-def show_sample(processes, possible_inputs, trace, isamp, sdd, widget=None, burn=500):
-    if isamp is None:
+    Sample numbers carry on across chunks (and chains), so the tables can be
+    concatenated. Only one chunk of the trace is read into memory at once.
+    """
+    if _has_edge_flows(trace):
+        varname, to_dataframe = 'F_edges', edge_flows_as_dataframe
+    else:
+        varname, to_dataframe = 'F', flows_as_dataframe
+    sample = 0
+    for inputs, flows in zip(_chain_values(trace, 'inputs'), _chain_values(trace, varname)):
+        draws = np.arange(nburn, len(flows), thin)
+        for start in range(0, len(draws), chunk_size):
+            chunk = draws[start:start + chunk_size]
+            yield to_dataframe(processes, possible_inputs, inputs[chunk], flows[chunk],
+                               samples=sample + np.arange(len(chunk)))
+            sample += len(chunk)
+
+
+def _chain_values(trace, varname):
+    """Unsliced values of `varname` for each chain, without copying if possible."""
+    if hasattr(trace, 'chains'):
+        return [trace.get_values(varname, chains=chain, combine=False)
+                for chain in trace.chains]
+    return [trace.get_values(varname)]
+
+
+def _has_edge_flows(trace):
+    return 'F_edges' in trace.varnames
+
+
+def _flow_matrix(processes, trace, draws):
+    """Dense (source x target) flows at `draws` (an index or slice), from
+    'F' or 'F_edges'."""
+    # MultiTrace only supports slices without a stop, so index the values
+    if _has_edge_flows(trace):
+        return edges_to_dense(processes, trace.get_values('F_edges')[draws])
+    return trace.get_values('F')[draws]
+
+
+def show_sample(processes, possible_inputs, trace, isamp, sdd, widget=None, burn=500,
+                aggregation=None):
+    """Sankey diagram of one sample, or of the mean after `burn` if `isamp` is None.
+
+    Passing a `sankey_aggregation.SankeyAggregation` as `aggregation` skips
+    weaving the diagram again.
+    """
+    if aggregation is not None:
+        if isamp is None:
+            values = aggregation.trace_link_values(trace, burn=burn).mean(axis=0)
+        else:
+            values = aggregation.draw_link_values(trace, isamp)[0]
+        new_widget = aggregation.to_widget(values, width=600, height=300,
+                                           margins=dict(left=50, right=100, top=10, bottom=10))
+    elif isamp is None:
         I = trace['inputs', burn:].mean(axis=0)
-        F = trace['F', burn:].mean(axis=0)
+        F = _flow_matrix(processes, trace, slice(burn, None)).mean(axis=0)
         dataset = Dataset(inputs_flows_as_dataframe(processes, possible_inputs, I, F))
     else:
         I = trace['inputs'][isamp]
-        F = trace['F'][isamp]
+        F = _flow_matrix(processes, trace, isamp)
         dataset = Dataset(inputs_flows_as_dataframe(processes, possible_inputs, I, F))
-    new_widget = weave(sdd, dataset).to_widget(width=600, height=300,
-                                               margins=dict(left=50, right=100, top=10, bottom=10))
+    if aggregation is None:
+        new_widget = weave(sdd, dataset).to_widget(
+            width=600, height=300, margins=dict(left=50, right=100, top=10, bottom=10))
     if widget is None:
         return new_widget
     else:
         widget.value = new_widget.value
 
 
-def animate_samples(processes, possible_inputs, trace, sdd, rescale=False):
+def animate_samples(processes, possible_inputs, trace, sdd, rescale=False,
+                    precompute=False, samples=None, interval=0.5):
+    """Animated Sankey diagram of the samples in the trace.
+
+    With `precompute`, the link values for every animated sample are
+    calculated up front (see `sankey_frames`) and played from a background
+    thread, so playback is smooth and does not block the notebook.
+    """
+    if precompute:
+        if samples is None:
+            samples = np.arange(0, len(trace), 10)
+        frames = sankey_frames(processes, possible_inputs, trace, sdd, samples)
+        return FramePlayer(frames, interval=interval, rescale=rescale).box
+
     def dataset(isamp):
         I = trace['inputs'][isamp]
-        F = trace['F'][isamp]
+        F = _flow_matrix(processes, trace, isamp)
         return Dataset(inputs_flows_as_dataframe(processes, possible_inputs, I, F))
 
     widget = weave(sdd, dataset(0)).to_widget(width=800, height=500,
@@ -95,6 +141,106 @@ def animate_samples(processes, possible_inputs, trace, sdd, rescale=False):
     return box
 
 
+def _sample_flows(processes, possible_inputs, trace, samples):
+    """Long-format flow table for the given draws, numbered 0, 1, ..."""
+    samples = np.asarray(samples)
+    inputs = trace['inputs'][samples]
+    if _has_edge_flows(trace):
+        return edge_flows_as_dataframe(processes, possible_inputs, inputs,
+                                       trace['F_edges'][samples])
+    return flows_as_dataframe(processes, possible_inputs, inputs, trace['F'][samples])
+
+
+def sankey_frames(processes, possible_inputs, trace, sdd, samples):
+    """Link values of the Sankey diagram for each of the draws `samples`.
+
+    The diagram is woven once from the flows of all the samples, which
+    fixes the nodes and links; each link's value in each sample is then
+    found by summing the flows that make up the link in one pass.
+    """
+    flows = _sample_flows(processes, possible_inputs, trace, samples)
+    result = weave(sdd, flows)
+
+    # a flow can be part of several links (e.g. along a bundle's waypoints)
+    rows = [flows.index.get_indexer(link.original_flows) for link in result.links]
+    link_idx = np.repeat(np.arange(len(rows)), [len(r) for r in rows])
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=int)
+    values = np.zeros((len(samples), len(result.links)))
+    np.add.at(values, (flows['sample'].values[rows], link_idx), flows['value'].values[rows])
+    return SankeyFrames(result, values)
+
+
+class SankeyFrames:
+    """Sankey diagram with fixed nodes and links and a value for each link
+    in each frame. Widget link data is built on first use and cached."""
+    def __init__(self, result, values):
+        self.result = result
+        self.values = values
+        self._links = [link.to_json(format='widget') for link in result.links]
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def links(self, i):
+        if i not in self._cache:
+            self._cache[i] = [dict(link, value=float(value))
+                              for link, value in zip(self._links, self.values[i])]
+        return self._cache[i]
+
+    def to_widget(self, i=0, **kwargs):
+        widget = self.result.to_widget(**kwargs)
+        widget.links = self.links(i)
+        return widget
+
+
+class FramePlayer:
+    """Play precomputed `SankeyFrames` in a widget from a background thread.
+
+    Nothing is woven while playing: each frame sets the widget's links to
+    the cached link list of that frame (see `SankeyFrames.links`), which
+    differs from the others only in the values. `box` holds the play/stop
+    buttons, a frame slider and the diagram.
+    """
+    def __init__(self, frames, interval=0.5, rescale=False, width=800, height=500):
+        self.frames = frames
+        self.interval = interval
+        self.rescale = rescale
+        self.widget = frames.to_widget(width=width, height=height,
+                                       margins=dict(left=50, right=100, top=10, bottom=10))
+        self.slider = ipywidgets.IntSlider(min=0, max=len(frames) - 1, description='Frame')
+        self.slider.observe(lambda change: self.show(change['new']), names='value')
+        play_button = ipywidgets.Button(description='Play')
+        stop_button = ipywidgets.Button(description='Stop')
+        play_button.on_click(self.play)
+        stop_button.on_click(self.stop)
+        self.box = ipywidgets.VBox([ipywidgets.HBox([play_button, stop_button, self.slider]),
+                                    self.widget])
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def show(self, i):
+        self.widget.links = self.frames.links(i)
+        if self.rescale:
+            self.widget.set_scale()
+
+    def play(self, _=None):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, _=None):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            # moving the slider shows the frame
+            self.slider.value = (self.slider.value + 1) % len(self.frames)
+            self._stopped.wait(self.interval)
+
+
 import floweaver
 import ipywidgets
 from ipysankeywidget import SankeyWidget
@@ -113,6 +259,16 @@ def rgb2hex(rgb):
 
 
 def weave_variance(flows, sdd, normed=False, vlim=None, palette=None):
+    """Sankey diagram of mean flows, coloured by credible interval width.
+
+    `flows` is a long-format table of flows in each sample (see
+    `flows_from_trace`). Alternatively, `sdd` can be a
+    `sankey_aggregation.SankeyAggregation` and `flows` an array of link
+    values (samples x links), in which case all the link statistics are
+    calculated together. Those include the draws in which a link is zero,
+    which the flow table leaves out (see `flow_statistics`), so links that
+    are only sometimes present have a smaller mean and a wider interval.
+    """
     if palette is None:
         palette = sequential.Reds_9.mpl_colormap
 
@@ -130,15 +286,30 @@ def weave_variance(flows, sdd, normed=False, vlim=None, palette=None):
     if vlim is not None:
         scale.set_domain(vlim)
 
+    if isinstance(sdd, SankeyAggregation):
+        return _aggregated_variance(flows, sdd, scale)
+
     result = weave(sdd, flows, measures=measures, link_width=link_width, link_color=scale)
 
     return result, scale.get_domain()
 
 
+def _aggregated_variance(link_values, aggregation, scale):
+    summary = summarise(link_values)
+    measures = link_measures(summary)
+    present = summary['mean'] > 0
+    if scale.get_domain() is None:
+        scale.set_domain_from([m for m, p in zip(measures, present) if p])
+    colors = [scale(link, m) if p else None
+              for link, m, p in zip(aggregation.links, measures, present)]
+    result = aggregation.sankey_data(summary['mean'], colors)
+    return result, scale.get_domain()
+
+
 def show_variance(flows, sdd, normed=False, vlim=None, width=800, palette=None):
     result, vlim = weave_variance(flows, sdd, normed, vlim, palette)
 
-    colorbar(palette, scale.domain[0], scale.domain[1],
+    colorbar(palette, vlim[0], vlim[1],
              'Credible interval width' + (' (normalised)' if normed else ' [Mt]'))
 
     return result.to_widget(width=width, height=400,
@@ -174,11 +345,16 @@ def _calc_variance(flows, sdd, normed, vlim, palette):
 
 class AbsoluteHPDRangeScale(floweaver.QuantitativeScale):
     def get_value(self, link, measures):
+        if 'hpd_width' in measures:
+            # precomputed by flow_statistics.summarise
+            return measures['hpd_width']
         return hpd_range(measures['value'])
 
 
 class NormalisedHPDRangeScale(floweaver.QuantitativeScale):
     def get_value(self, link, measures):
+        if 'hpd_width' in measures:
+            return measures['hpd_width'] / measures['mean']
         return hpd_range(measures['value']) / measures['value'].mean()
 
 
@@ -0,0 +1,77 @@
+"""Warm-start inference from a previous ADVI fit or trace.
+
+When a model is refitted after a small change (e.g. a few more
+observations), the previous posterior is a much better starting point than
+the default. Means and standard deviations of the free variables are taken
+from a stored ADVI fit (as saved in ``traces/advi*.npz``) or a trace, and
+mapped onto the new model's free variables by name:
+
+    previous = load_advi('traces/advi2.npz')
+    trace, advi3 = warm_start_sample(model3, previous, n_advi=2000)
+
+Variables of the new model which are missing from the previous results (or
+have a different shape) start from the model's test point instead.
+"""
+
+import numpy as np
+import pymc3 as pm
+
+
+def load_advi(filename):
+    """Means and standard deviations from an ADVI fit saved with `np.savez`."""
+    with np.load(filename, allow_pickle=True) as data:
+        means, stds = data['arr_0'][:2]
+    return means, stds
+
+
+def trace_moments(trace, burn=0, varnames=None):
+    """Means and standard deviations of the variables in a trace."""
+    if varnames is None:
+        varnames = trace.varnames
+    means, stds = {}, {}
+    for varname in varnames:
+        values = trace.get_values(varname, burn=burn)
+        means[varname] = values.mean(axis=0)
+        stds[varname] = values.std(axis=0)
+    return means, stds
+
+
+def map_to_model(model, means, stds, default_std=1.0):
+    """Map previous means and stds onto the free variables of `model`.
+
+    Returns a start point, stds for every free variable and the names of
+    the variables which were not found in the previous results.
+    """
+    test_point = model.model.test_point
+    start, new_stds, missing = {}, {}, []
+    for var in model.model.vars:
+        shape = np.shape(test_point[var.name])
+        if var.name in means and np.shape(means[var.name]) == shape:
+            start[var.name] = np.asarray(means[var.name], dtype=float)
+            new_stds[var.name] = np.asarray(stds[var.name], dtype=float)
+        else:
+            start[var.name] = test_point[var.name]
+            new_stds[var.name] = np.full(shape, default_std)
+            missing.append(var.name)
+    return start, new_stds, missing
+
+
+def warm_start_sample(model, previous, draws=500, n_advi=2000, trace=None,
+                      random_seed=None):
+    """Sample `model` with NUTS, starting from previous (means, stds).
+
+    With `n_advi`, a short ADVI fit is run first from the previous means,
+    and its result gives the NUTS start point and mass matrix; otherwise the
+    previous results are used for these directly. Returns the trace and the
+    new ADVI fit (or None).
+    """
+    start, stds, _ = map_to_model(model, *previous)
+    advi = None
+    with model.model:
+        if n_advi:
+            advi = pm.variational.advi(start=start, n=n_advi, random_seed=random_seed)
+            start, stds = advi.means, advi.stds
+        step = pm.NUTS(scaling=model.model.dict_to_array(stds)**2, is_cov=True)
+        trace = pm.sample(draws, step=step, start=start, trace=trace,
+                          random_seed=random_seed)
+    return trace, advi